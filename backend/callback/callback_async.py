@@ -0,0 +1,252 @@
+'''
+Асинхронный callback (HANDLER_ASYNC=true): тот же путь, что handle_request и settle_payment, на asyncpg и httpx.
+Перевод счёта в paid и постановка уведомлений — одна транзакция; Bitrix24 и вебхуки вызываются параллельно
+вместе с записью callback_received в журнал, а результаты доставки, ответ в callback_ledger и журнал вызовов
+пишутся одновременно на разных соединениях пула. Настройки уведомлений читаются через settings_cache,
+промах загружается на asyncpg теми же колонками и разбором строки, что и в bill_payment.
+'''
+
+import asyncio
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from aio_runtime import aio_connection, aio_flush_logs, aio_invocation, aio_request, run_query
+from bill_payment import (NOTIFICATION_SETTINGS_COLUMNS, NOTIFY_INLINE_TIMEOUT, get_notification_settings,
+                          notification_settings_from_row, settlement_response)
+from integration_log import log_integration
+from notifications import (NOTIFY_CONCURRENCY, NOTIFY_LEASE_SECONDS, delivery_from_row, delivery_outcomes,
+                           resolve_targets)
+from settings_cache import get_cached_settings_async
+from tracing import set_span_attributes, span
+
+async def fetch_notification_settings(member_id: str) -> Optional[Dict[str, Any]]:
+    async with aio_connection() as conn:
+        row = await run_query(conn, 'fetchrow',
+                              f'SELECT {NOTIFICATION_SETTINGS_COLUMNS} FROM users WHERE member_id = $1', member_id)
+    return notification_settings_from_row(row) if row else None
+
+async def get_bill_by_external_id(external_id: str, secret: str) -> Optional[Dict[str, Any]]:
+    async with aio_connection() as conn:
+        row = await run_query(conn, 'fetchrow', '''
+            SELECT b.id, b.member_id, b.payment_id, b.paysystem_id, b.deal_id, b.status,
+                   l.status_code, l.response_body
+            FROM bills b
+            LEFT JOIN callback_ledger l ON l.external_id = b.external_id
+            WHERE b.external_id = $1 AND b.secret = $2
+        ''', external_id, secret)
+
+    if not row:
+        return None
+
+    return {
+        'id': row[0],
+        'member_id': row[1],
+        'payment_id': row[2],
+        'paysystem_id': row[3],
+        'deal_id': row[4],
+        'status': row[5],
+        'ledger_status_code': row[6],
+        'ledger_response_body': row[7]
+    }
+
+async def claim_payment(bill: Dict[str, Any], external_id: str,
+                        targets: List[Dict[str, str]]) -> Optional[List[Dict[str, Any]]]:
+    async with aio_connection() as conn, conn.transaction():
+        claimed = await run_query(conn, 'fetchval', '''
+            UPDATE bills
+            SET status = 'paid', updated_at = CURRENT_TIMESTAMP
+            WHERE id = $1 AND status = 'pending'
+            RETURNING id
+        ''', bill['id'])
+        if claimed is None:
+            return None
+
+        rows = await run_query(conn, 'fetch', '''
+            INSERT INTO notification_deliveries (bill_id, member_id, external_id, deal_id, payment_id,
+                                                 target_type, url, status, attempts, next_attempt_at)
+            SELECT $1::integer, $2::varchar, $3::varchar, $4::integer, $5::integer, t.target_type, t.url,
+                   'processing', 1, LOCALTIMESTAMP + make_interval(secs => $6::double precision)
+            FROM unnest($7::varchar[], $8::varchar[]) AS t(target_type, url)
+            ON CONFLICT (bill_id, target_type, url) DO NOTHING
+            RETURNING id, bill_id, member_id, external_id, deal_id, payment_id, target_type, url, attempts
+        ''', bill['id'], bill['member_id'], external_id, bill['deal_id'], bill['payment_id'], NOTIFY_LEASE_SECONDS,
+            [target['target_type'] for target in targets], [target['url'] for target in targets])
+
+    return [delivery_from_row(row) for row in rows]
+
+async def deliver_notification(delivery: Dict[str, Any], limit: asyncio.Semaphore,
+                               read_timeout: float) -> Optional[str]:
+    if delivery['target_type'] == 'bitrix24':
+        log_type = 'bitrix24_payment'
+        url = f"{delivery['url']}/rest/sale.paysystem.pay.payment"
+        params = {'ID': delivery['payment_id']}
+        request_data = f"{url}?ID={delivery['payment_id']}"
+    else:
+        log_type = 'webhook_call'
+        url = delivery['url'].replace('{{ID}}', str(delivery['deal_id']))
+        params = None
+        request_data = url
+
+    stats: Dict[str, Any] = {}
+    async with limit:
+        with span(f"notify.{delivery['target_type']}", external_id=delivery['external_id']):
+            try:
+                response = await aio_request('GET', url, read_timeout, stats, retry_reads=False, params=params)
+                error = None if response.status_code == 200 else f'HTTP {response.status_code}'
+
+                log_integration(log_type, delivery['member_id'], str(delivery['deal_id']), delivery['external_id'],
+                                request_data, response.text, 'success' if error is None else 'error', error, stats)
+                return error
+            except Exception as e:
+                log_integration(log_type, delivery['member_id'], str(delivery['deal_id']), delivery['external_id'],
+                                request_data, '', 'error', str(e), stats)
+                return str(e)
+
+async def deliver_notifications(deliveries: List[Dict[str, Any]], read_timeout: float) -> List[Optional[str]]:
+    limit = asyncio.Semaphore(NOTIFY_CONCURRENCY)
+    return list(await asyncio.gather(*(deliver_notification(delivery, limit, read_timeout) for delivery in deliveries)))
+
+async def update_deliveries(rows: List[Tuple]):
+    if not rows:
+        return
+
+    async with aio_connection() as conn:
+        await run_query(conn, 'executemany', '''
+            UPDATE notification_deliveries
+            SET status = $2,
+                last_error = $3,
+                next_attempt_at = LOCALTIMESTAMP + make_interval(secs => $4::double precision),
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = $1
+        ''', rows)
+
+async def record_callback_result(external_id: str, bill_id: int, response: Dict[str, Any]):
+    async with aio_connection() as conn:
+        await run_query(conn, 'execute', '''
+            INSERT INTO callback_ledger (external_id, bill_id, status_code, response_body)
+            VALUES ($1, $2, $3, $4)
+            ON CONFLICT (external_id) DO UPDATE
+            SET status_code = EXCLUDED.status_code,
+                response_body = EXCLUDED.response_body,
+                updated_at = CURRENT_TIMESTAMP
+        ''', external_id, bill_id, response['statusCode'], response['body'])
+
+async def settle_payment(bill: Dict[str, Any], external_id: str) -> Dict[str, Any]:
+    notification_settings = await get_cached_settings_async(bill['member_id'], get_notification_settings,
+                                                            fetch_notification_settings) or {}
+    targets = resolve_targets({**bill, **notification_settings})
+
+    if not targets:
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({
+                'error': 'Failed to mark payment in Bitrix24',
+                'external_id': external_id
+            }),
+            'isBase64Encoded': False
+        }
+
+    deliveries = await claim_payment(bill, external_id, targets)
+
+    if deliveries is None:
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'message': 'Payment already processed'}),
+            'isBase64Encoded': False
+        }
+
+    errors, _ = await asyncio.gather(deliver_notifications(deliveries, NOTIFY_INLINE_TIMEOUT), aio_flush_logs())
+    statuses, rows = delivery_outcomes(deliveries, errors)
+    response = settlement_response(external_id, deliveries, statuses)
+
+    await asyncio.gather(update_deliveries(rows), record_callback_result(external_id, bill['id'], response),
+                         aio_flush_logs())
+    return response
+
+async def handle_request(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    method: str = event.get('httpMethod', 'GET')
+
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': '',
+            'isBase64Encoded': False
+        }
+
+    if method not in ['GET', 'POST']:
+        return {
+            'statusCode': 405,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Method not allowed'}),
+            'isBase64Encoded': False
+        }
+
+    try:
+        params = event.get('queryStringParameters', {}) or {}
+        external_id = params.get('external_id')
+        secret = params.get('secret')
+        set_span_attributes(external_id=external_id)
+
+        if not external_id or not secret:
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Missing external_id or secret'}),
+                'isBase64Encoded': False
+            }
+
+        bill = await get_bill_by_external_id(external_id, secret)
+
+        if not bill:
+            return {
+                'statusCode': 404,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Bill not found or invalid secret'}),
+                'isBase64Encoded': False
+            }
+
+        if bill['ledger_status_code'] is not None:
+            return {
+                'statusCode': bill['ledger_status_code'],
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*',
+                    'X-Idempotent-Replay': 'true'
+                },
+                'body': bill['ledger_response_body'],
+                'isBase64Encoded': False
+            }
+
+        if bill['status'] != 'pending':
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'message': 'Payment already processed'}),
+                'isBase64Encoded': False
+            }
+
+        log_integration('callback_received', bill['member_id'], str(bill['deal_id']), external_id,
+                        json.dumps(params), '', 'processing')
+
+        return await settle_payment(bill, external_id)
+
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
+
+async def async_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    request_id = getattr(context, 'request_id', None)
+    async with aio_invocation('callback', event, request_id):
+        return await handle_request(event, context)
@@ -0,0 +1,117 @@
+'''
+Буферизованная запись integration_logs: события копятся в памяти в пределах запроса
+и пишутся одним многострочным INSERT при выходе из log_buffer().
+При LOG_BUFFER_ENABLED=false каждое событие пишется сразу, как раньше.
+Исходящий вызов пишется одной записью со статистикой из http_client (call_stats)
+и request_id вызова функции, переданным в log_buffer(), а также trace_id текущего trace.
+Длинные тела сжимаются при записи (payload_codec), ключи для поиска извлекаются до сжатия (payload_search).
+Буфер и request_id хранятся в ContextVar, поэтому параллельные задачи asyncio не смешивают записи чужих запросов.
+'''
+
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from db import db_connection
+from payload_codec import encode_payloads
+from payload_search import extract_search_keys
+from tracing import current_trace_id
+
+LOG_BUFFER_ENABLED = os.environ.get('LOG_BUFFER_ENABLED', 'true').lower() != 'false'
+LOG_BUFFER_MAX_ENTRIES = int(os.environ.get('LOG_BUFFER_MAX_ENTRIES', '100'))
+
+_entries: ContextVar[Optional[List[Tuple]]] = ContextVar('log_entries', default=None)
+_request_id: ContextVar[Optional[str]] = ContextVar('log_request_id', default=None)
+
+def prepare_log_rows(entries: List[Tuple]) -> List[Tuple]:
+    rows = []
+    for entry in entries:
+        search_keys = extract_search_keys(entry[5], entry[6])
+        request_data, response_data, request_blob, response_blob, codec = encode_payloads(entry[5], entry[6])
+        rows.append(entry[:5] + (request_data, response_data) + entry[7:] + (request_blob, response_blob, codec, search_keys))
+    return rows
+
+def write_log_entries(entries: List[Tuple]):
+    from psycopg2.extras import execute_values
+
+    if not entries:
+        return
+
+    rows = prepare_log_rows(entries)
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+
+        query = '''
+            INSERT INTO integration_logs (created_at, log_type, member_id, deal_id, external_id,
+                                          request_data, response_data, status, error_message,
+                                          duration_ms, connect_ms, bytes_out, bytes_in, http_status, request_id, trace_id,
+                                          request_blob, response_blob, payload_codec, search_keys)
+            VALUES %s
+        '''
+        execute_values(
+            cur, query, rows,
+            template='(to_timestamp(%s)::timestamp, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, '
+                     '%s, %s, %s, %s::jsonb)',
+            page_size=LOG_BUFFER_MAX_ENTRIES
+        )
+
+        conn.commit()
+        cur.close()
+
+def take_log_entries() -> List[Tuple]:
+    entries = _entries.get()
+    if not entries:
+        return []
+
+    taken = entries[:]
+    del entries[:]
+    return taken
+
+def flush_log_buffer():
+    entries = take_log_entries()
+    if not entries:
+        return
+
+    try:
+        write_log_entries(entries)
+    except Exception as e:
+        print(f'Failed to flush {len(entries)} integration log entries: {e}')
+
+def current_request_id() -> Optional[str]:
+    return _request_id.get()
+
+def log_integration(log_type: str, member_id: str, deal_id: str, external_id: str,
+                    request_data: str, response_data: str, status: str, error_message: str = None,
+                    call_stats: Optional[Dict[str, Any]] = None):
+    call_stats = call_stats or {}
+    entry = (time.time(), log_type, member_id, deal_id, external_id,
+             request_data, response_data, status, error_message,
+             call_stats.get('duration_ms'), call_stats.get('connect_ms'), call_stats.get('bytes_out'),
+             call_stats.get('bytes_in'), call_stats.get('http_status'), current_request_id(), current_trace_id())
+
+    entries = _entries.get()
+    if not LOG_BUFFER_ENABLED or entries is None:
+        write_log_entries([entry])
+        return
+
+    entries.append(entry)
+    if len(entries) >= LOG_BUFFER_MAX_ENTRIES:
+        flush_log_buffer()
+
+@contextmanager
+def log_buffer(request_id: Optional[str] = None) -> Iterator[None]:
+    if _entries.get() is not None:
+        yield
+        return
+
+    entries_token = _entries.set([])
+    request_token = _request_id.set(request_id)
+    try:
+        yield
+    finally:
+        flush_log_buffer()
+        _entries.reset(entries_token)
+        _request_id.reset(request_token)
@@ -0,0 +1,174 @@
+'''
+Пул соединений PostgreSQL, общий для всех вызовов функции в пределах одного контейнера.
+Соединения переживают тёплые вызовы, проверяются при выдаче и переоткрываются при обрыве.
+request_connection() закрепляет одно соединение за всем запросом.
+Выдачу ограничивает семафор на DB_SYNC_POOL_MAX: при занятом пуле поток ждёт соединение до DB_ACQUIRE_TIMEOUT секунд,
+а не получает PoolError. DB_POOL_MAX — бюджет соединений контейнера: при HANDLER_ASYNC=true из него
+DB_ASYNC_POOL_MAX отдаётся пулу asyncpg (aio_runtime), а синхронному пулу остаётся не меньше двух соединений
+(закреплённое соединение пакета и отдельное для обновления токена).
+Ожидание соединения и каждый запрос попадают в текущий trace спанами db.acquire и db.query.
+psycopg2 импортируется при создании пула, поэтому OPTIONS и другие пути без БД его не загружают.
+db_stats() отдаёт счётчики контейнера: запросы к БД, выдачи соединений из пула и новые подключения.
+'''
+
+import os
+import time
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from tracing import TRACE_STATEMENT_MAX, set_span_attributes, span
+
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '5'))
+DB_ASYNC_POOL_MAX = int(os.environ.get('DB_ASYNC_POOL_MAX') or max(1, DB_POOL_MAX - 2)) \
+    if os.environ.get('HANDLER_ASYNC', 'false').lower() == 'true' else 0
+DB_SYNC_POOL_MAX = max(2, DB_POOL_MAX - DB_ASYNC_POOL_MAX) if DB_ASYNC_POOL_MAX else DB_POOL_MAX
+DB_POOL_CHECK_AFTER = float(os.environ.get('DB_POOL_CHECK_AFTER', '30'))
+DB_ACQUIRE_TIMEOUT = float(os.environ.get('DB_ACQUIRE_TIMEOUT', '10'))
+
+_pool: Optional[Any] = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(DB_SYNC_POOL_MAX)
+_last_used: Dict[int, float] = {}
+_local = threading.local()
+_stats = {'queries': 0, 'acquires': 0, 'connects': 0}
+_stats_lock = threading.Lock()
+
+def count_stat(name: str):
+    with _stats_lock:
+        _stats[name] += 1
+
+def db_stats() -> Dict[str, int]:
+    with _stats_lock:
+        return dict(_stats)
+
+def broken_connection_errors() -> Tuple[type, ...]:
+    import psycopg2
+    return psycopg2.OperationalError, psycopg2.InterfaceError
+
+def build_db_pool():
+    from psycopg2 import pool as pg_pool
+    from psycopg2.extensions import cursor as pg_cursor
+
+    class TracedCursor(pg_cursor):
+        def execute(self, query, vars=None):
+            count_stat('queries')
+            statement = query.decode(errors='replace') if isinstance(query, bytes) else str(query)
+            with span('db.query', statement=' '.join(statement.split())[:TRACE_STATEMENT_MAX]):
+                result = super().execute(query, vars)
+                if self.rowcount >= 0:
+                    set_span_attributes(rows=self.rowcount)
+                return result
+
+    return pg_pool.ThreadedConnectionPool(
+        min(DB_POOL_MIN, DB_SYNC_POOL_MAX), DB_SYNC_POOL_MAX, os.environ.get('DATABASE_URL'),
+        cursor_factory=TracedCursor
+    )
+
+def get_db_pool():
+    global _pool
+    if _pool is None or _pool.closed:
+        with _pool_lock:
+            if _pool is None or _pool.closed:
+                _pool = build_db_pool()
+    return _pool
+
+def is_connection_healthy(conn) -> bool:
+    if conn.closed:
+        return False
+    last_used = _last_used.get(id(conn))
+    if last_used is None or time.monotonic() - last_used < DB_POOL_CHECK_AFTER:
+        return True
+    try:
+        cur = conn.cursor()
+        cur.execute('SELECT 1')
+        cur.close()
+        conn.rollback()
+        return True
+    except broken_connection_errors():
+        return False
+
+def acquire_connection():
+    if not _slots.acquire(timeout=DB_ACQUIRE_TIMEOUT):
+        raise broken_connection_errors()[0](f'No database connection available in {DB_ACQUIRE_TIMEOUT}s')
+    try:
+        db_pool = get_db_pool()
+        for _ in range(DB_SYNC_POOL_MAX + 1):
+            conn = db_pool.getconn()
+            count_stat('acquires')
+            if id(conn) not in _last_used:
+                count_stat('connects')
+            if is_connection_healthy(conn):
+                return conn
+            _last_used.pop(id(conn), None)
+            db_pool.putconn(conn, close=True)
+    except BaseException:
+        _slots.release()
+        raise
+    _slots.release()
+    raise broken_connection_errors()[0]('No healthy database connection available')
+
+def release_connection(conn, broken: bool = False):
+    if not broken and not conn.closed:
+        try:
+            conn.rollback()
+        except broken_connection_errors():
+            broken = True
+    try:
+        if broken or conn.closed:
+            _last_used.pop(id(conn), None)
+            get_db_pool().putconn(conn, close=True)
+            return
+        _last_used[id(conn)] = time.monotonic()
+        get_db_pool().putconn(conn)
+    finally:
+        _slots.release()
+
+@contextmanager
+def db_connection() -> Iterator:
+    scoped = getattr(_local, 'scoped', False)
+    conn = getattr(_local, 'conn', None) if scoped else None
+    if conn is None:
+        with span('db.acquire'):
+            conn = acquire_connection()
+        if scoped:
+            _local.conn = conn
+
+    try:
+        yield conn
+    except broken_connection_errors():
+        if scoped:
+            _local.conn = None
+        release_connection(conn, broken=True)
+        raise
+    except Exception:
+        if scoped:
+            try:
+                conn.rollback()
+            except broken_connection_errors():
+                _local.conn = None
+                release_connection(conn, broken=True)
+        else:
+            release_connection(conn)
+        raise
+
+    if not scoped:
+        release_connection(conn)
+
+@contextmanager
+def request_connection() -> Iterator[None]:
+    if getattr(_local, 'scoped', False):
+        yield
+        return
+
+    _local.scoped = True
+    _local.conn = None
+    try:
+        yield
+    finally:
+        conn = _local.conn
+        _local.scoped = False
+        _local.conn = None
+        if conn is not None:
+            release_connection(conn)
@@ -0,0 +1,131 @@
+'''
+Выгрузка integration_logs для аудита: все записи портала (или всех порталов с ИНН) за период в NDJSON или CSV,
+при необходимости сразу в gzip. Строки читаются серверным курсором пачками по --fetch-size и пишутся по одной,
+тела раскодируются построчно через decode_payload, поэтому память не зависит от объёма выгрузки.
+COPY ... TO STDOUT не подходит: сжатые тела лежат в bytea и раскодируются только на стороне Python.
+
+    DATABASE_URL=... python3 backend/logs/export_logs.py --member-id portal.bitrix24.ru --from 2026-07-01 --to 2026-10-01 > q3.ndjson
+    python3 backend/logs/export_logs.py --inn 7707083893 --from 2026-07-01 --to 2026-10-01 --format csv --gzip -o q3.csv.gz
+'''
+
+import argparse
+import csv
+import gzip
+import io
+import json
+import os
+import sys
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, TextIO
+
+from db import db_connection
+from payload_codec import decode_payload
+
+EXPORT_FETCH_SIZE = int(os.environ.get('LOGS_EXPORT_FETCH_SIZE', '2000'))
+
+EXPORT_COLUMNS = ('id', 'created_at', 'log_type', 'member_id', 'deal_id', 'external_id', 'status', 'error_message',
+                  'duration_ms', 'connect_ms', 'bytes_out', 'bytes_in', 'http_status', 'request_id', 'trace_id',
+                  'request_data', 'response_data')
+
+def resolve_members(inn: str) -> List[str]:
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('SELECT member_id FROM users WHERE company_inn = %s ORDER BY member_id', (inn,))
+        members = [row[0] for row in cur.fetchall()]
+        cur.close()
+
+    return members
+
+def iter_logs(members: List[str], time_from: datetime, time_to: datetime, log_type: Optional[str],
+              fetch_size: int = EXPORT_FETCH_SIZE) -> Iterator[Dict[str, Any]]:
+    with db_connection() as conn:
+        cur = conn.cursor(name='integration_logs_export')
+        cur.itersize = fetch_size
+
+        query = '''
+            SELECT id, created_at, log_type, member_id, deal_id, external_id, status, error_message,
+                   duration_ms, connect_ms, bytes_out, bytes_in, http_status, request_id, trace_id,
+                   request_data, response_data, request_blob, response_blob, payload_codec
+            FROM integration_logs
+            WHERE member_id = ANY(%s) AND created_at >= %s AND created_at < %s
+              AND (%s::text IS NULL OR log_type = %s)
+            ORDER BY created_at, id
+        '''
+        cur.execute(query, (members, time_from, time_to, log_type, log_type))
+
+        for row in cur:
+            yield {
+                **dict(zip(EXPORT_COLUMNS[:15], row[:15])),
+                'created_at': row[1].isoformat() if row[1] else None,
+                'request_data': decode_payload(row[15], row[17], row[19]),
+                'response_data': decode_payload(row[16], row[18], row[19])
+            }
+
+        cur.close()
+        conn.commit()
+
+def write_ndjson(rows: Iterator[Dict[str, Any]], out: TextIO) -> int:
+    count = 0
+    for row in rows:
+        out.write(json.dumps(row, ensure_ascii=False, default=str))
+        out.write('\n')
+        count += 1
+    return count
+
+def write_csv(rows: Iterator[Dict[str, Any]], out: TextIO) -> int:
+    writer = csv.DictWriter(out, fieldnames=EXPORT_COLUMNS)
+    writer.writeheader()
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    return count
+
+def open_output(path: Optional[str], compress: bool) -> TextIO:
+    if compress and path:
+        return gzip.open(path, 'wt', encoding='utf-8', newline='')
+    if compress:
+        return io.TextIOWrapper(gzip.GzipFile(fileobj=sys.stdout.buffer, mode='wb'), encoding='utf-8', newline='')
+    if path:
+        return open(path, 'w', encoding='utf-8', newline='')
+    return sys.stdout
+
+def main():
+    parser = argparse.ArgumentParser(description='Stream integration_logs of a portal or INN as NDJSON or CSV')
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--member-id', action='append', help='portal member_id (repeatable)')
+    target.add_argument('--inn', help='export every portal with this users.company_inn')
+    parser.add_argument('--from', dest='time_from', required=True, type=datetime.fromisoformat)
+    parser.add_argument('--to', dest='time_to', required=True, type=datetime.fromisoformat)
+    parser.add_argument('--log-type')
+    parser.add_argument('--format', choices=('ndjson', 'csv'), default='ndjson')
+    parser.add_argument('--gzip', action='store_true', help='gzip the output (also implied by a .gz path)')
+    parser.add_argument('-o', '--output', help='output file (default: stdout)')
+    parser.add_argument('--fetch-size', type=int, default=EXPORT_FETCH_SIZE, help='rows per server cursor round trip')
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL'))
+    args = parser.parse_args()
+
+    if not args.database_url:
+        parser.error('--database-url or DATABASE_URL is required')
+    if args.time_from >= args.time_to:
+        parser.error('--from must be earlier than --to')
+    os.environ['DATABASE_URL'] = args.database_url
+
+    members = args.member_id or resolve_members(args.inn)
+    if not members:
+        parser.error(f'no portals with INN {args.inn}')
+
+    compress = args.gzip or bool(args.output and args.output.endswith('.gz'))
+    out = open_output(args.output, compress)
+    writer = write_csv if args.format == 'csv' else write_ndjson
+    try:
+        count = writer(iter_logs(members, args.time_from, args.time_to, args.log_type, args.fetch_size), out)
+    finally:
+        out.flush()
+        if out is not sys.stdout:
+            out.close()
+
+    print(f'exported {count} rows for {len(members)} portal(s)', file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
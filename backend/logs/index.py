@@ -0,0 +1,340 @@
+'''
+Business: Просмотр integration_logs портала для дашборда: список с фильтрами, поиском по ключам тел и keyset-пагинацией по (created_at, id), тела запросов по одной записи без секретов, спаны trace
+Args: event с httpMethod, заголовками X-Member-Id и X-Secret-Code (secret_code портала), queryStringParameters (member_id, external_id, deal_id, log_type, status, trace_id, email, inn, amount, kassa_id, receipt_uuid, receipt_status, error_code, jsonpath, from, to, limit, cursor, или id + created_at, или trace_id + spans=1), context с request_id
+Returns: HTTP response со списком записей и next_cursor, с полной записью журнала либо со спанами trace
+'''
+
+import base64
+import hmac
+import json
+import os
+import re
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+from db import db_connection, request_connection
+from payload_codec import decode_payload
+from payload_search import SEARCH_KEYS, normalize_search_keys
+from tracing import trace_invocation
+
+LOGS_PAGE_SIZE = int(os.environ.get('LOGS_PAGE_SIZE', '50'))
+LOGS_MAX_PAGE_SIZE = int(os.environ.get('LOGS_MAX_PAGE_SIZE', '200'))
+
+FILTER_COLUMNS = ('member_id', 'external_id', 'deal_id', 'log_type', 'status', 'trace_id')
+TRACE_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+INVALID_JSONPATH_CODES = ('42601', '22P02', '2203A', '2203B', '2203C')
+SECRET_FIELDS = ('secret', 'secret_code', 'ecom_pass', 'pass', 'password', 'token', 'token_ecom_kassa')
+SECRET_QUERY_RE = re.compile(r'([?&](?:secret|secret_code|token|auth)=)[^&#"\s]*')
+SECRET_JSON_RE = re.compile(r'("(?:' + '|'.join(SECRET_FIELDS) + r')"\s*:\s*)("(?:[^"\\]|\\.)*"|[^,}\s]+)')
+BITRIX_WEBHOOK_TOKEN_RE = re.compile(r'(/rest/\d+/)[^/\s"?]+')
+REDACTED = '***'
+
+def redact_secrets(text: Optional[str]) -> Optional[str]:
+    if not text:
+        return text
+    text = SECRET_QUERY_RE.sub(rf'\1{REDACTED}', text)
+    text = SECRET_JSON_RE.sub(rf'\1"{REDACTED}"', text)
+    return BITRIX_WEBHOOK_TOKEN_RE.sub(rf'\1{REDACTED}', text)
+
+def authenticate(member_id: Optional[str], secret_code: Optional[str]) -> bool:
+    if not member_id or not secret_code:
+        return False
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('SELECT secret_code FROM users WHERE member_id = %s', (member_id,))
+        row = cur.fetchone()
+        cur.close()
+
+    return bool(row and row[0]) and hmac.compare_digest(row[0], secret_code)
+
+def encode_cursor(created_at: datetime, log_id: int) -> str:
+    raw = json.dumps([created_at.isoformat(), log_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+    created_at, log_id = json.loads(raw)
+    return datetime.fromisoformat(created_at), int(log_id)
+
+def parse_time(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+def parse_search(params: Dict[str, str]) -> Dict[str, Any]:
+    search = {key: params[key] for key in SEARCH_KEYS if key not in FILTER_COLUMNS and params.get(key)}
+    keys = normalize_search_keys(search)
+    if len(keys) != len(search):
+        raise ValueError('Invalid search value')
+    return keys
+
+def list_logs(filters: Dict[str, str], time_from: Optional[datetime], time_to: Optional[datetime],
+              cursor: Optional[Tuple[datetime, int]], limit: int, search: Dict[str, Any]) -> Dict[str, Any]:
+    conditions: List[str] = []
+    args: List[Any] = []
+
+    for column in FILTER_COLUMNS:
+        if filters.get(column):
+            conditions.append(f'{column} = %s')
+            args.append(filters[column])
+    if search:
+        conditions.append('search_keys @> %s::jsonb')
+        args.append(json.dumps(search, ensure_ascii=False))
+    if filters.get('jsonpath'):
+        conditions.append('search_keys @? %s::jsonpath')
+        args.append(filters['jsonpath'])
+    if time_from:
+        conditions.append('created_at >= %s')
+        args.append(time_from)
+    if time_to:
+        conditions.append('created_at < %s')
+        args.append(time_to)
+    if cursor:
+        conditions.append('(created_at, id) < (%s, %s)')
+        args.extend(cursor)
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+
+        query = f'''
+            SELECT id, created_at, log_type, member_id, deal_id, external_id, status, error_message,
+                   COALESCE(octet_length(request_data), octet_length(request_blob)),
+                   COALESCE(octet_length(response_data), octet_length(response_blob)),
+                   duration_ms, connect_ms, bytes_out, bytes_in, http_status, request_id, trace_id, search_keys
+            FROM integration_logs
+            {where}
+            ORDER BY created_at DESC, id DESC
+            LIMIT %s
+        '''
+        cur.execute(query, (*args, limit + 1))
+        rows = cur.fetchall()
+        cur.close()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    return {
+        'items': [{
+            'id': row[0],
+            'created_at': row[1].isoformat() if row[1] else None,
+            'log_type': row[2],
+            'member_id': row[3],
+            'deal_id': row[4],
+            'external_id': row[5],
+            'status': row[6],
+            'error_message': redact_secrets(row[7]),
+            'request_size': row[8] or 0,
+            'response_size': row[9] or 0,
+            'duration_ms': row[10],
+            'connect_ms': row[11],
+            'bytes_out': row[12],
+            'bytes_in': row[13],
+            'http_status': row[14],
+            'request_id': row[15],
+            'trace_id': row[16],
+            'search_keys': row[17]
+        } for row in rows],
+        'next_cursor': encode_cursor(rows[-1][1], rows[-1][0]) if has_more else None
+    }
+
+def get_log(member_id: str, log_id: int, created_at: Optional[datetime]) -> Optional[Dict[str, Any]]:
+    with db_connection() as conn:
+        cur = conn.cursor()
+
+        query = '''
+            SELECT id, created_at, log_type, member_id, deal_id, external_id,
+                   request_data, response_data, status, error_message,
+                   duration_ms, connect_ms, bytes_out, bytes_in, http_status, request_id, trace_id,
+                   request_blob, response_blob, payload_codec
+            FROM integration_logs
+            WHERE id = %s AND member_id = %s AND (%s::timestamp IS NULL OR created_at = %s::timestamp)
+        '''
+        cur.execute(query, (log_id, member_id, created_at, created_at))
+        row = cur.fetchone()
+        cur.close()
+
+    if not row:
+        return None
+
+    return {
+        'id': row[0],
+        'created_at': row[1].isoformat() if row[1] else None,
+        'log_type': row[2],
+        'member_id': row[3],
+        'deal_id': row[4],
+        'external_id': row[5],
+        'request_data': redact_secrets(decode_payload(row[6], row[17], row[19])),
+        'response_data': redact_secrets(decode_payload(row[7], row[18], row[19])),
+        'status': row[8],
+        'error_message': redact_secrets(row[9]),
+        'duration_ms': row[10],
+        'connect_ms': row[11],
+        'bytes_out': row[12],
+        'bytes_in': row[13],
+        'http_status': row[14],
+        'request_id': row[15],
+        'trace_id': row[16]
+    }
+
+def get_trace_spans(member_id: str, trace_id: str) -> List[Dict[str, Any]]:
+    with db_connection() as conn:
+        cur = conn.cursor()
+
+        query = '''
+            SELECT span_id, parent_span_id, service, name, started_at, duration_ms, status, attributes
+            FROM trace_spans
+            WHERE trace_id = %s
+              AND EXISTS (SELECT 1 FROM integration_logs WHERE trace_id = %s AND member_id = %s)
+            ORDER BY started_at, span_id
+        '''
+        cur.execute(query, (trace_id, trace_id, member_id))
+        rows = cur.fetchall()
+        cur.close()
+
+    return [{
+        'span_id': row[0],
+        'parent_span_id': row[1],
+        'service': row[2],
+        'name': row[3],
+        'started_at': row[4].isoformat() if row[4] else None,
+        'duration_ms': row[5],
+        'status': row[6],
+        'attributes': json.loads(row[7]) if row[7] else {}
+    } for row in rows]
+
+def handle_request(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    method: str = event.get('httpMethod', 'GET')
+
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'GET, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Member-Id, X-Secret-Code',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': '',
+            'isBase64Encoded': False
+        }
+
+    if method != 'GET':
+        return {
+            'statusCode': 405,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Method not allowed'}),
+            'isBase64Encoded': False
+        }
+
+    try:
+        params = event.get('queryStringParameters', {}) or {}
+
+        try:
+            created_at = parse_time(params.get('created_at'))
+            time_from = parse_time(params.get('from'))
+            time_to = parse_time(params.get('to'))
+            cursor = decode_cursor(params['cursor']) if params.get('cursor') else None
+            limit = int(params.get('limit') or LOGS_PAGE_SIZE)
+            log_id = int(params['id']) if params.get('id') else None
+            search = parse_search(params)
+        except (ValueError, TypeError):
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Invalid id, limit, cursor, time range or search value'}),
+                'isBase64Encoded': False
+            }
+
+        if params.get('trace_id') and not TRACE_ID_RE.match(params['trace_id']):
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'trace_id must be 32 lowercase hex characters'}),
+                'isBase64Encoded': False
+            }
+
+        if log_id is None and (limit < 1 or limit > LOGS_MAX_PAGE_SIZE):
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': f'limit must be between 1 and {LOGS_MAX_PAGE_SIZE}'}),
+                'isBase64Encoded': False
+            }
+
+        headers = {key.lower(): value for key, value in (event.get('headers') or {}).items()}
+        member_id = headers.get('x-member-id')
+
+        if not authenticate(member_id, headers.get('x-secret-code')):
+            return {
+                'statusCode': 401,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Invalid X-Member-Id or X-Secret-Code'}),
+                'isBase64Encoded': False
+            }
+
+        if params.get('member_id') and params['member_id'] != member_id:
+            return {
+                'statusCode': 403,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Logs of another portal are not available'}),
+                'isBase64Encoded': False
+            }
+
+        if params.get('trace_id') and params.get('spans'):
+            spans = get_trace_spans(member_id, params['trace_id'])
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'trace_id': params['trace_id'], 'spans': spans}),
+                'isBase64Encoded': False
+            }
+
+        if log_id is not None:
+            log = get_log(member_id, log_id, created_at)
+
+            if not log:
+                return {
+                    'statusCode': 404,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Log entry not found'}),
+                    'isBase64Encoded': False
+                }
+
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps(log),
+                'isBase64Encoded': False
+            }
+
+        try:
+            result = list_logs({**params, 'member_id': member_id}, time_from, time_to, cursor, limit, search)
+        except Exception as e:
+            if not params.get('jsonpath') or getattr(e, 'pgcode', None) not in INVALID_JSONPATH_CODES:
+                raise
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': f'Invalid jsonpath: {str(e).splitlines()[0]}'}),
+                'isBase64Encoded': False
+            }
+
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps(result),
+            'isBase64Encoded': False
+        }
+
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    request_id = getattr(context, 'request_id', None)
+    with request_connection(), trace_invocation('logs', event, request_id):
+        return handle_request(event, context)
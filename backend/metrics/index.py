@@ -0,0 +1,305 @@
+'''
+Business: Агрегаты integration_logs для графиков монитора: инкрементальная свёртка журнала в поминутные и почасовые корзины и выдача метрик за окно
+Args: event от таймера или HTTP POST — свёртка новых записей; HTTP GET с queryStringParameters (from, to, member_id, log_type, step) — метрики; context с request_id
+Returns: HTTP response со статистикой свёртки либо рядами {time, count, errors, avg, p95} и распределением по статусам
+'''
+
+import json
+import math
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Tuple
+from db import db_connection, request_connection
+from tracing import trace_invocation
+
+ROLLUP_LAG_SECONDS = int(os.environ.get('METRICS_ROLLUP_LAG_SECONDS', '300'))
+ROLLUP_MAX_MINUTES = int(os.environ.get('METRICS_ROLLUP_MAX_MINUTES', '1440'))
+ROLLUP_MINUTE_RETENTION_DAYS = int(os.environ.get('METRICS_MINUTE_RETENTION_DAYS', '7'))
+ROLLUP_HOUR_RETENTION_DAYS = int(os.environ.get('METRICS_HOUR_RETENTION_DAYS', '90'))
+MINUTE_STEP_MAX_HOURS = int(os.environ.get('METRICS_MINUTE_STEP_MAX_HOURS', '6'))
+
+HIST_BASE = 1.25
+HIST_BUCKETS = 64
+
+RollupKey = Tuple[datetime, str, str, str]
+
+def bucket_upper_bound(index: int) -> float:
+    return 1.0 if index == 0 else HIST_BASE ** index
+
+def hist_percentile(hist: List[int], quantile: float) -> Optional[float]:
+    total = sum(hist)
+    if not total:
+        return None
+    rank = math.ceil(total * quantile)
+    seen = 0
+    for index, count in enumerate(hist):
+        seen += count
+        if seen >= rank:
+            return round(bucket_upper_bound(index), 1)
+    return round(bucket_upper_bound(len(hist) - 1), 1)
+
+def merge_hist(target: List[int], source: List[int]):
+    if len(target) < len(source):
+        target.extend([0] * (len(source) - len(target)))
+    for index, count in enumerate(source):
+        target[index] += count
+
+def new_aggregate() -> Dict[str, Any]:
+    return {'count': 0, 'errors': 0, 'latency_count': 0, 'latency_sum': 0, 'hist': [0] * HIST_BUCKETS}
+
+def get_rollup_window() -> Tuple[datetime, datetime]:
+    with db_connection() as conn:
+        cur = conn.cursor()
+
+        query = '''
+            SELECT s.rolled_until,
+                   LEAST(date_trunc('minute', LOCALTIMESTAMP - make_interval(secs => %s)),
+                         s.rolled_until + make_interval(mins => %s))
+            FROM metrics_rollup_state s
+            WHERE s.id = 1
+            FOR UPDATE
+        '''
+        cur.execute(query, (ROLLUP_LAG_SECONDS, ROLLUP_MAX_MINUTES))
+        row = cur.fetchone()
+        cur.close()
+
+    return row[0], row[1]
+
+def aggregate_logs(window_start: datetime, window_end: datetime) -> Dict[RollupKey, Dict[str, Any]]:
+    with db_connection() as conn:
+        cur = conn.cursor()
+
+        query = '''
+            SELECT date_trunc('minute', created_at), log_type,
+                   COALESCE(member_id, ''), COALESCE(status, ''),
+                   CASE
+                       WHEN duration_ms IS NULL THEN NULL
+                       WHEN duration_ms < 1 THEN 0
+                       ELSE LEAST(%s - 1, 1 + floor(ln(duration_ms) / ln(%s))::int)
+                   END AS bucket,
+                   count(*), COALESCE(sum(duration_ms), 0)
+            FROM integration_logs
+            WHERE created_at >= %s AND created_at < %s
+            GROUP BY 1, 2, 3, 4, 5
+        '''
+        cur.execute(query, (HIST_BUCKETS, HIST_BASE, window_start, window_end))
+        rows = cur.fetchall()
+        cur.close()
+
+    aggregates: Dict[RollupKey, Dict[str, Any]] = defaultdict(new_aggregate)
+    for minute, log_type, member_id, status, bucket, count, duration_sum in rows:
+        aggregate = aggregates[(minute, log_type, member_id, status)]
+        aggregate['count'] += count
+        if status == 'error':
+            aggregate['errors'] += count
+        if bucket is not None:
+            aggregate['latency_count'] += count
+            aggregate['latency_sum'] += int(duration_sum)
+            aggregate['hist'][bucket] += count
+
+    return aggregates
+
+def to_hourly(aggregates: Dict[RollupKey, Dict[str, Any]]) -> Dict[RollupKey, Dict[str, Any]]:
+    hourly: Dict[RollupKey, Dict[str, Any]] = defaultdict(new_aggregate)
+    for (minute, log_type, member_id, status), aggregate in aggregates.items():
+        target = hourly[(minute.replace(minute=0), log_type, member_id, status)]
+        target['count'] += aggregate['count']
+        target['errors'] += aggregate['errors']
+        target['latency_count'] += aggregate['latency_count']
+        target['latency_sum'] += aggregate['latency_sum']
+        merge_hist(target['hist'], aggregate['hist'])
+    return hourly
+
+def upsert_rollups(cur, table: str, aggregates: Dict[RollupKey, Dict[str, Any]]):
+    from psycopg2.extras import execute_values
+
+    if not aggregates:
+        return
+
+    execute_values(cur, f'''
+        INSERT INTO {table} AS r (bucket_start, log_type, member_id, status, request_count, error_count,
+                                  latency_count, latency_sum_ms, latency_hist)
+        VALUES %s
+        ON CONFLICT (bucket_start, log_type, member_id, status) DO UPDATE
+        SET request_count = r.request_count + EXCLUDED.request_count,
+            error_count = r.error_count + EXCLUDED.error_count,
+            latency_count = r.latency_count + EXCLUDED.latency_count,
+            latency_sum_ms = r.latency_sum_ms + EXCLUDED.latency_sum_ms,
+            latency_hist = int_array_add(r.latency_hist, EXCLUDED.latency_hist)
+    ''', [
+        (*key, aggregate['count'], aggregate['errors'], aggregate['latency_count'],
+         aggregate['latency_sum'], aggregate['hist'])
+        for key, aggregate in aggregates.items()
+    ], page_size=500)
+
+def roll_up_logs() -> Dict[str, Any]:
+    with db_connection() as conn:
+        window_start, window_end = get_rollup_window()
+        if window_end <= window_start:
+            conn.rollback()
+            return {'rolled_from': window_start.isoformat(), 'rolled_until': window_start.isoformat(), 'groups': 0}
+
+        aggregates = aggregate_logs(window_start, window_end)
+
+        cur = conn.cursor()
+        upsert_rollups(cur, 'metrics_rollup_minute', aggregates)
+        upsert_rollups(cur, 'metrics_rollup_hour', to_hourly(aggregates))
+        cur.execute('UPDATE metrics_rollup_state SET rolled_until = %s WHERE id = 1', (window_end,))
+        cur.execute('DELETE FROM metrics_rollup_minute WHERE bucket_start < LOCALTIMESTAMP - make_interval(days => %s)',
+                    (ROLLUP_MINUTE_RETENTION_DAYS,))
+        cur.execute('DELETE FROM metrics_rollup_hour WHERE bucket_start < LOCALTIMESTAMP - make_interval(days => %s)',
+                    (ROLLUP_HOUR_RETENTION_DAYS,))
+        conn.commit()
+        cur.close()
+
+    return {'rolled_from': window_start.isoformat(), 'rolled_until': window_end.isoformat(), 'groups': len(aggregates)}
+
+def read_rollups(table: str, time_from: datetime, time_to: datetime,
+                 member_id: Optional[str], log_type: Optional[str]) -> List[Tuple]:
+    conditions = ['bucket_start >= %s', 'bucket_start < %s']
+    args: List[Any] = [time_from, time_to]
+    if member_id:
+        conditions.append('member_id = %s')
+        args.append(member_id)
+    if log_type:
+        conditions.append('log_type = %s')
+        args.append(log_type)
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+
+        query = f'''
+            SELECT bucket_start, status, request_count, error_count,
+                   latency_count, latency_sum_ms, latency_hist
+            FROM {table}
+            WHERE {' AND '.join(conditions)}
+        '''
+        cur.execute(query, args)
+        rows = cur.fetchall()
+        cur.close()
+
+    return rows
+
+def summarize(aggregate: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'count': aggregate['count'],
+        'errors': aggregate['errors'],
+        'avg': round(aggregate['latency_sum'] / aggregate['latency_count'], 1) if aggregate['latency_count'] else None,
+        'p50': hist_percentile(aggregate['hist'], 0.5),
+        'p95': hist_percentile(aggregate['hist'], 0.95),
+        'p99': hist_percentile(aggregate['hist'], 0.99)
+    }
+
+def get_metrics(time_from: datetime, time_to: datetime, step: str,
+                member_id: Optional[str], log_type: Optional[str]) -> Dict[str, Any]:
+    table = 'metrics_rollup_minute' if step == 'minute' else 'metrics_rollup_hour'
+    rows = read_rollups(table, time_from, time_to, member_id, log_type)
+
+    series: Dict[datetime, Dict[str, Any]] = defaultdict(new_aggregate)
+    statuses: Dict[str, int] = defaultdict(int)
+    total = new_aggregate()
+
+    for bucket_start, status, count, errors, latency_count, latency_sum, hist in rows:
+        statuses[status or 'unknown'] += count
+        for aggregate in (series[bucket_start], total):
+            aggregate['count'] += count
+            aggregate['errors'] += errors
+            aggregate['latency_count'] += latency_count
+            aggregate['latency_sum'] += latency_sum
+            merge_hist(aggregate['hist'], hist)
+
+    return {
+        'step': step,
+        'from': time_from.isoformat(),
+        'to': time_to.isoformat(),
+        'totals': summarize(total),
+        'series': [
+            {'time': bucket_start.isoformat(), **summarize(series[bucket_start])}
+            for bucket_start in sorted(series)
+        ],
+        'status': [
+            {'name': name, 'count': count}
+            for name, count in sorted(statuses.items(), key=lambda item: -item[1])
+        ]
+    }
+
+def handle_request(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    method: str = event.get('httpMethod', 'TIMER')
+
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Member-Id',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': '',
+            'isBase64Encoded': False
+        }
+
+    if method not in ['GET', 'POST', 'TIMER']:
+        return {
+            'statusCode': 405,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Method not allowed'}),
+            'isBase64Encoded': False
+        }
+
+    try:
+        if method in ['POST', 'TIMER']:
+            result = roll_up_logs()
+
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'success': True, **result}),
+                'isBase64Encoded': False
+            }
+
+        params = event.get('queryStringParameters', {}) or {}
+
+        try:
+            time_to = datetime.fromisoformat(params['to']) if params.get('to') else datetime.now()
+            time_from = datetime.fromisoformat(params['from']) if params.get('from') else time_to - timedelta(hours=1)
+        except ValueError:
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'from and to must be ISO 8601 timestamps'}),
+                'isBase64Encoded': False
+            }
+
+        step = params.get('step') or ('minute' if time_to - time_from <= timedelta(hours=MINUTE_STEP_MAX_HOURS) else 'hour')
+
+        if time_from >= time_to or step not in ['minute', 'hour']:
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'from must be before to and step must be minute or hour'}),
+                'isBase64Encoded': False
+            }
+
+        result = get_metrics(time_from, time_to, step, params.get('member_id'), params.get('log_type'))
+
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps(result),
+            'isBase64Encoded': False
+        }
+
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    request_id = getattr(context, 'request_id', None)
+    with request_connection(), trace_invocation('metrics', event, request_id):
+        return handle_request(event, context)
@@ -0,0 +1,101 @@
+'''
+Business: Повторная доставка уведомлений об оплате в Bitrix24 и вебхуки по расписанию из notification_deliveries
+Args: event от таймера или HTTP POST с body (batch_size, max_seconds), context с request_id
+Returns: HTTP response со статистикой обработки (claimed, delivered, retried, dead)
+'''
+
+import json
+import os
+import time
+from typing import Dict, Any
+from db import request_connection
+from integration_log import log_buffer
+from notifications import claim_due_notifications, deliver_notifications
+from tracing import trace_invocation
+
+NOTIFY_BATCH_SIZE = int(os.environ.get('NOTIFY_BATCH_SIZE', '100'))
+NOTIFY_MAX_SECONDS = float(os.environ.get('NOTIFY_MAX_SECONDS', '240'))
+
+def redeliver_notifications(batch_size: int, max_seconds: float) -> Dict[str, Any]:
+    started = time.monotonic()
+    stats = {'claimed': 0, 'delivered': 0, 'retried': 0, 'dead': 0}
+
+    while time.monotonic() - started < max_seconds:
+        with request_connection():
+            deliveries = claim_due_notifications(batch_size)
+            if not deliveries:
+                break
+
+            stats['claimed'] += len(deliveries)
+            for status in deliver_notifications(deliveries):
+                if status == 'delivered':
+                    stats['delivered'] += 1
+                elif status == 'dead':
+                    stats['dead'] += 1
+                else:
+                    stats['retried'] += 1
+
+        print(json.dumps({'event': 'notifier_batch', **stats}))
+
+    stats['elapsed'] = round(time.monotonic() - started, 3)
+    return stats
+
+def handle_request(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    method: str = event.get('httpMethod', 'TIMER')
+
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': '',
+            'isBase64Encoded': False
+        }
+
+    if method not in ['POST', 'TIMER']:
+        return {
+            'statusCode': 405,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Method not allowed'}),
+            'isBase64Encoded': False
+        }
+
+    try:
+        body_data = json.loads(event.get('body') or '{}') if method == 'POST' else {}
+
+        batch_size = int(body_data.get('batch_size') or NOTIFY_BATCH_SIZE)
+        max_seconds = float(body_data.get('max_seconds') or NOTIFY_MAX_SECONDS)
+
+        if batch_size < 1 or max_seconds <= 0:
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'batch_size and max_seconds must be positive'}),
+                'isBase64Encoded': False
+            }
+
+        result = redeliver_notifications(batch_size, max_seconds)
+
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'success': True, **result}),
+            'isBase64Encoded': False
+        }
+
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    request_id = getattr(context, 'request_id', None)
+    with log_buffer(request_id), trace_invocation('notifier', event, request_id):
+        return handle_request(event, context)
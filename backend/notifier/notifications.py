@@ -0,0 +1,201 @@
+'''
+Доставка уведомлений об оплате: Bitrix24 (sale.paysystem.pay.payment) и пользовательские вебхуки.
+Каждый получатель — строка notification_deliveries с собственным расписанием повторов,
+получатели одного счёта обходятся параллельно.
+Каждый вызов — одна запись bitrix24_payment или webhook_call с ответом, временем и размерами.
+'''
+
+import os
+import random
+from typing import Any, Dict, List, Optional, Tuple
+
+from db import db_connection, request_connection
+from integration_log import current_request_id, log_buffer, log_integration
+from http_client import http_get
+from tracing import TraceContext, current_trace_context, trace
+
+NOTIFY_READ_TIMEOUT = float(os.environ.get('NOTIFY_READ_TIMEOUT', '10'))
+NOTIFY_CONCURRENCY = int(os.environ.get('NOTIFY_CONCURRENCY', '4'))
+NOTIFY_MAX_ATTEMPTS = int(os.environ.get('NOTIFY_MAX_ATTEMPTS', '10'))
+NOTIFY_RETRY_BASE = float(os.environ.get('NOTIFY_RETRY_BASE', '30'))
+NOTIFY_RETRY_MAX = float(os.environ.get('NOTIFY_RETRY_MAX', '21600'))
+NOTIFY_LEASE_SECONDS = int(os.environ.get('NOTIFY_LEASE_SECONDS', '120'))
+
+def mark_payment_as_paid_bitrix24(payment_id: int, webhook_url: str, member_id: str, deal_id: int, external_id: str,
+                                  read_timeout: float = NOTIFY_READ_TIMEOUT) -> Optional[str]:
+    url = f'{webhook_url}/rest/sale.paysystem.pay.payment'
+    stats: Dict[str, Any] = {}
+    try:
+        response = http_get(url, read_timeout=read_timeout, stats=stats, retry_reads=False, params={'ID': payment_id})
+        error = None if response.status_code == 200 else f'HTTP {response.status_code}'
+
+        log_integration('bitrix24_payment', member_id, str(deal_id), external_id,
+                       f'{url}?ID={payment_id}', response.text, 'success' if error is None else 'error', error, stats)
+        return error
+    except Exception as e:
+        log_integration('bitrix24_payment', member_id, str(deal_id), external_id,
+                       f'{url}?ID={payment_id}', '', 'error', str(e), stats)
+        return str(e)
+
+def call_custom_webhook(webhook_url: str, deal_id: int, member_id: str, external_id: str,
+                        read_timeout: float = NOTIFY_READ_TIMEOUT) -> Optional[str]:
+    url = webhook_url.replace('{{ID}}', str(deal_id))
+    stats: Dict[str, Any] = {}
+    try:
+        response = http_get(url, read_timeout=read_timeout, stats=stats, retry_reads=False)
+        error = None if response.status_code == 200 else f'HTTP {response.status_code}'
+
+        log_integration('webhook_call', member_id, str(deal_id), external_id,
+                       url, response.text, 'success' if error is None else 'error', error, stats)
+        return error
+    except Exception as e:
+        log_integration('webhook_call', member_id, str(deal_id), external_id,
+                       url, '', 'error', str(e), stats)
+        return str(e)
+
+def resolve_targets(bill: Dict[str, Any]) -> List[Dict[str, str]]:
+    targets = []
+    webhook_url = bill.get('webhook_url') or ''
+
+    if '{{ID}}' in webhook_url:
+        targets.append({'target_type': 'webhook', 'url': webhook_url})
+    elif bill.get('payment_id'):
+        bitrix_webhook = webhook_url.split('/rest/')[0]
+        if bitrix_webhook:
+            targets.append({'target_type': 'bitrix24', 'url': bitrix_webhook})
+
+    for url in bill.get('extra_webhook_urls') or []:
+        if url and url != webhook_url:
+            targets.append({'target_type': 'webhook', 'url': url})
+
+    return targets
+
+def enqueue_notifications(cur, bill: Dict[str, Any], external_id: str, targets: List[Dict[str, str]]) -> List[Dict[str, Any]]:
+    from psycopg2.extras import execute_values
+
+    if not targets:
+        return []
+
+    rows = execute_values(cur, '''
+        INSERT INTO notification_deliveries (bill_id, member_id, external_id, deal_id, payment_id,
+                                             target_type, url, status, attempts, next_attempt_at)
+        VALUES %s
+        ON CONFLICT (bill_id, target_type, url) DO NOTHING
+        RETURNING id, bill_id, member_id, external_id, deal_id, payment_id, target_type, url, attempts
+    ''', [
+        (bill['id'], bill['member_id'], external_id, bill['deal_id'], bill['payment_id'],
+         target['target_type'], target['url'], NOTIFY_LEASE_SECONDS)
+        for target in targets
+    ], template="(%s, %s, %s, %s, %s, %s, %s, 'processing', 1, LOCALTIMESTAMP + make_interval(secs => %s))",
+        page_size=len(targets), fetch=True)
+
+    return [delivery_from_row(row) for row in rows]
+
+def delivery_from_row(row) -> Dict[str, Any]:
+    return {
+        'id': row[0],
+        'bill_id': row[1],
+        'member_id': row[2],
+        'external_id': row[3],
+        'deal_id': row[4],
+        'payment_id': row[5],
+        'target_type': row[6],
+        'url': row[7],
+        'attempts': row[8]
+    }
+
+def claim_due_notifications(limit: int) -> List[Dict[str, Any]]:
+    with db_connection() as conn:
+        cur = conn.cursor()
+
+        query = '''
+            UPDATE notification_deliveries d
+            SET status = 'processing',
+                attempts = d.attempts + 1,
+                next_attempt_at = LOCALTIMESTAMP + make_interval(secs => %s),
+                updated_at = CURRENT_TIMESTAMP
+            WHERE d.id IN (
+                SELECT id FROM notification_deliveries
+                WHERE status IN ('pending', 'processing') AND next_attempt_at <= LOCALTIMESTAMP
+                ORDER BY next_attempt_at
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING d.id, d.bill_id, d.member_id, d.external_id, d.deal_id, d.payment_id,
+                      d.target_type, d.url, d.attempts
+        '''
+        cur.execute(query, (NOTIFY_LEASE_SECONDS, limit))
+        rows = cur.fetchall()
+
+        conn.commit()
+        cur.close()
+
+    return [delivery_from_row(row) for row in rows]
+
+def deliver_notification(delivery: Dict[str, Any], read_timeout: float, request_id: Optional[str],
+                         trace_context: Optional[TraceContext]) -> Optional[str]:
+    with request_connection(), log_buffer(request_id), \
+            trace(f"notify.{delivery['target_type']}", parent=trace_context,
+                  external_id=delivery['external_id']):
+        if delivery['target_type'] == 'bitrix24':
+            return mark_payment_as_paid_bitrix24(delivery['payment_id'], delivery['url'], delivery['member_id'],
+                                                 delivery['deal_id'], delivery['external_id'], read_timeout)
+        return call_custom_webhook(delivery['url'], delivery['deal_id'], delivery['member_id'],
+                                   delivery['external_id'], read_timeout)
+
+def retry_delay(attempts: int) -> float:
+    return random.uniform(0, min(NOTIFY_RETRY_MAX, NOTIFY_RETRY_BASE * (2 ** max(attempts - 1, 0))))
+
+def delivery_outcomes(deliveries: List[Dict[str, Any]], errors: List[Optional[str]]) -> Tuple[List[str], List[Tuple]]:
+    statuses = []
+    rows = []
+    for delivery, error in zip(deliveries, errors):
+        if error is None:
+            status = 'delivered'
+        elif delivery['attempts'] >= NOTIFY_MAX_ATTEMPTS:
+            status = 'dead'
+        else:
+            status = 'pending'
+        statuses.append(status)
+        rows.append((delivery['id'], status, error, retry_delay(delivery['attempts']) if status == 'pending' else 0))
+    return statuses, rows
+
+def record_delivery_results(deliveries: List[Dict[str, Any]], errors: List[Optional[str]]) -> List[str]:
+    from psycopg2.extras import execute_values
+
+    statuses, rows = delivery_outcomes(deliveries, errors)
+
+    if rows:
+        with db_connection() as conn:
+            cur = conn.cursor()
+
+            query = '''
+                UPDATE notification_deliveries d
+                SET status = v.status,
+                    last_error = v.last_error,
+                    next_attempt_at = LOCALTIMESTAMP + make_interval(secs => v.delay),
+                    updated_at = CURRENT_TIMESTAMP
+                FROM (VALUES %s) AS v(id, status, last_error, delay)
+                WHERE d.id = v.id
+            '''
+            execute_values(cur, query, rows, template='(%s::bigint, %s, %s, %s::double precision)',
+                           page_size=len(rows))
+
+            conn.commit()
+            cur.close()
+
+    return statuses
+
+def deliver_notifications(deliveries: List[Dict[str, Any]], read_timeout: float = NOTIFY_READ_TIMEOUT) -> List[str]:
+    from concurrent.futures import ThreadPoolExecutor
+
+    if not deliveries:
+        return []
+
+    request_id = current_request_id()
+    trace_context = current_trace_context()
+    with ThreadPoolExecutor(max_workers=min(NOTIFY_CONCURRENCY, len(deliveries))) as executor:
+        errors = list(executor.map(lambda delivery: deliver_notification(delivery, read_timeout, request_id,
+                                                                         trace_context), deliveries))
+
+    return record_delivery_results(deliveries, errors)
@@ -0,0 +1,132 @@
+'''
+Сжатое хранение тел request_data/response_data в integration_logs.
+Тела длиннее PAYLOAD_COMPRESS_MIN сжимаются zlib с общим словарём из payload_dictionaries
+и пишутся в request_blob/response_blob; payload_codec хранит кодек и версию словаря (zlib:<версия>).
+Словарь собирается функцией retention из свежих чеков и состоит из целых чеков: deflate выгоднее длинные
+совпадения, чем разрозненные фрагменты. Чеки выбираются жадно по n-граммам из PAYLOAD_DICT_NGRAM байт, общим
+для нескольких чеков: каждый следующий — тот, что добавляет больше ещё не покрытых общих n-грамм (с весом
+по числу чеков), поэтому в словарь попадают варианты разных порталов, а не первые по порядку почти одинаковые чеки.
+Самые ценные ставятся в конец, ближе к сжимаемым данным; повторяющиеся ИНН, адреса и настройки налогов портала
+кодируются ссылками на словарь. Читатели раскодируют через decode_payload().
+'''
+
+import heapq
+import os
+import time
+import zlib
+from collections import Counter
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from db import db_connection
+
+PAYLOAD_STORAGE = os.environ.get('LOG_PAYLOAD_STORAGE', 'zlib').lower()
+PAYLOAD_COMPRESS_MIN = int(os.environ.get('LOG_PAYLOAD_COMPRESS_MIN', '256'))
+PAYLOAD_COMPRESS_LEVEL = int(os.environ.get('LOG_PAYLOAD_COMPRESS_LEVEL', '6'))
+PAYLOAD_DICT_TTL = float(os.environ.get('LOG_PAYLOAD_DICT_TTL', '3600'))
+PAYLOAD_DICT_SIZE = 32 * 1024
+PAYLOAD_DICT_NGRAM = 8
+
+_dictionaries: Dict[int, bytes] = {0: b''}
+_latest: Optional[Tuple[int, float]] = None
+
+def load_dictionary(version: Optional[int] = None) -> Tuple[int, bytes]:
+    with db_connection() as conn:
+        cur = conn.cursor()
+        if version is None:
+            cur.execute('SELECT version, dictionary FROM payload_dictionaries ORDER BY version DESC LIMIT 1')
+        else:
+            cur.execute('SELECT version, dictionary FROM payload_dictionaries WHERE version = %s', (version,))
+        row = cur.fetchone()
+        cur.close()
+
+    if not row:
+        if version is not None:
+            raise KeyError(f'Payload dictionary {version} not found')
+        return 0, b''
+
+    _dictionaries[row[0]] = bytes(row[1])
+    return row[0], _dictionaries[row[0]]
+
+def get_latest_dictionary() -> Tuple[int, bytes]:
+    global _latest
+    if _latest is None or time.monotonic() - _latest[1] > PAYLOAD_DICT_TTL:
+        try:
+            version, _ = load_dictionary()
+        except Exception as e:
+            print(f'Failed to load payload dictionary: {e}')
+            version = _latest[0] if _latest else 0
+        _latest = (version, time.monotonic())
+    return _latest[0], _dictionaries[_latest[0]]
+
+def get_dictionary(version: int) -> bytes:
+    if version not in _dictionaries:
+        load_dictionary(version)
+    return _dictionaries[version]
+
+def compress(data: bytes, dictionary: bytes) -> bytes:
+    compressor = zlib.compressobj(PAYLOAD_COMPRESS_LEVEL, zdict=dictionary) if dictionary \
+        else zlib.compressobj(PAYLOAD_COMPRESS_LEVEL)
+    return compressor.compress(data) + compressor.flush()
+
+def decompress(blob: bytes, dictionary: bytes) -> bytes:
+    decompressor = zlib.decompressobj(zdict=dictionary) if dictionary else zlib.decompressobj()
+    return decompressor.decompress(blob) + decompressor.flush()
+
+def encode_payloads(request_data: Optional[str], response_data: Optional[str]) \
+        -> Tuple[Optional[str], Optional[str], Optional[bytes], Optional[bytes], Optional[str]]:
+    if PAYLOAD_STORAGE != 'zlib':
+        return request_data, response_data, None, None, None
+
+    texts = [request_data, response_data]
+    if not any(text and len(text) >= PAYLOAD_COMPRESS_MIN for text in texts):
+        return request_data, response_data, None, None, None
+
+    version, dictionary = get_latest_dictionary()
+    blobs = [None, None]
+    for index, text in enumerate(texts):
+        if text and len(text) >= PAYLOAD_COMPRESS_MIN:
+            blobs[index] = compress(text.encode(), dictionary)
+            texts[index] = None
+
+    return texts[0], texts[1], blobs[0], blobs[1], f'zlib:{version}'
+
+def decode_payload(text: Optional[str], blob: Optional[bytes], codec: Optional[str]) -> Optional[str]:
+    if blob is None or not codec:
+        return text
+
+    name, _, version = codec.partition(':')
+    if name != 'zlib':
+        raise ValueError(f'Unknown payload codec {codec}')
+    return decompress(bytes(blob), get_dictionary(int(version or 0))).decode()
+
+def ngram_hashes(data: bytes) -> Set[int]:
+    return {hash(data[i:i + PAYLOAD_DICT_NGRAM]) for i in range(len(data) - PAYLOAD_DICT_NGRAM + 1)}
+
+def build_dictionary(samples: Iterable[str], size: int = PAYLOAD_DICT_SIZE) -> bytes:
+    texts = [text.encode() for text in dict.fromkeys(sample for sample in samples if sample)]
+    grams = [ngram_hashes(text) for text in texts]
+    shared: Counter = Counter()
+    for sample_grams in grams:
+        shared.update(sample_grams)
+
+    def gain(index: int) -> int:
+        return sum(shared[gram] for gram in grams[index] if shared[gram] > 1)
+
+    queue = [(-gain(index), index) for index in range(len(texts))]
+    heapq.heapify(queue)
+    chunks = []
+    total = 0
+    while queue:
+        _, index = heapq.heappop(queue)
+        current = gain(index)
+        if queue and current < -queue[0][0]:
+            heapq.heappush(queue, (-current, index))
+            continue
+        if total + len(texts[index]) > size:
+            continue
+        chunks.append(texts[index])
+        total += len(texts[index])
+        for gram in grams[index]:
+            shared[gram] = 0
+
+    return b''.join(reversed(chunks))
@@ -0,0 +1,152 @@
+'''
+Business: Фоновая отправка чеков из receipt_outbox в EcomKassa с ограниченным параллелизмом, повторами и dead-letter
+Args: event от таймера или HTTP POST с body (batch_size, concurrency не больше DB_POOL_MAX, max_seconds), context с request_id
+Returns: HTTP response со статистикой обработки (claimed, sent, retried, dead, skipped — аренду перехватил другой воркер)
+'''
+
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional
+from db import DB_SYNC_POOL_MAX, db_connection, request_connection
+from integration_log import current_request_id, log_buffer
+from ecomkassa import send_receipt
+from receipt_outbox import claim_due_receipts, mark_receipt_failed, mark_receipt_sent, renew_receipt_lease
+from tracing import TraceContext, current_trace_context, trace, trace_invocation
+
+OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', '50'))
+OUTBOX_CONCURRENCY = int(os.environ.get('OUTBOX_CONCURRENCY', '4'))
+OUTBOX_MAX_SECONDS = float(os.environ.get('OUTBOX_MAX_SECONDS', '240'))
+
+def get_user_settings(member_id: str) -> Optional[Dict[str, Any]]:
+    with db_connection() as conn:
+        cur = conn.cursor()
+
+        query = '''
+            SELECT ecom_login, ecom_pass, token_ecom_kassa,
+                   EXTRACT(EPOCH FROM token_ecom_kassa_expires_at - LOCALTIMESTAMP)
+            FROM users WHERE member_id = %s
+        '''
+        cur.execute(query, (member_id,))
+        row = cur.fetchone()
+        cur.close()
+
+    if not row:
+        return None
+
+    return {
+        'ecom_login': row[0],
+        'ecom_pass': row[1],
+        'token_ecom_kassa': row[2],
+        'token_ecom_kassa_ttl': float(row[3]) if row[3] is not None else None
+    }
+
+def deliver_receipt(item: Dict[str, Any], request_id: Optional[str], trace_context: Optional[TraceContext]) -> str:
+    with request_connection(), log_buffer(request_id), \
+            trace('outbox.deliver_receipt', parent=trace_context, external_id=item['external_id']):
+        if not renew_receipt_lease(item['id'], item['attempts']):
+            return 'skipped'
+
+        try:
+            settings = get_user_settings(item['member_id'])
+            if not settings:
+                raise Exception('User settings not found')
+
+            response_data = send_receipt(item['member_id'], settings, item['payload'],
+                                         item['deal_id'], item['external_id'])
+        except Exception as e:
+            return mark_receipt_failed(item['id'], item['attempts'], str(e))
+
+        mark_receipt_sent(item['id'], response_data)
+        return 'sent'
+
+def drain_outbox(batch_size: int, concurrency: int, max_seconds: float) -> Dict[str, Any]:
+    request_id = current_request_id()
+    trace_context = current_trace_context()
+    started = time.monotonic()
+    stats = {'claimed': 0, 'sent': 0, 'retried': 0, 'dead': 0, 'skipped': 0}
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while time.monotonic() - started < max_seconds:
+            with request_connection():
+                items = claim_due_receipts(batch_size)
+            if not items:
+                break
+
+            stats['claimed'] += len(items)
+            for status in executor.map(lambda item: deliver_receipt(item, request_id, trace_context), items):
+                if status == 'sent':
+                    stats['sent'] += 1
+                elif status == 'dead':
+                    stats['dead'] += 1
+                elif status == 'skipped':
+                    stats['skipped'] += 1
+                else:
+                    stats['retried'] += 1
+
+            print(json.dumps({'event': 'outbox_batch', **stats}))
+
+    stats['elapsed'] = round(time.monotonic() - started, 3)
+    return stats
+
+def handle_request(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    method: str = event.get('httpMethod', 'TIMER')
+
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': '',
+            'isBase64Encoded': False
+        }
+
+    if method not in ['POST', 'TIMER']:
+        return {
+            'statusCode': 405,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Method not allowed'}),
+            'isBase64Encoded': False
+        }
+
+    try:
+        body_data = json.loads(event.get('body') or '{}') if method == 'POST' else {}
+
+        batch_size = int(body_data.get('batch_size') or OUTBOX_BATCH_SIZE)
+        concurrency = min(int(body_data.get('concurrency') or OUTBOX_CONCURRENCY), DB_SYNC_POOL_MAX)
+        max_seconds = float(body_data.get('max_seconds') or OUTBOX_MAX_SECONDS)
+
+        if batch_size < 1 or concurrency < 1 or max_seconds <= 0:
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'batch_size, concurrency and max_seconds must be positive'}),
+                'isBase64Encoded': False
+            }
+
+        result = drain_outbox(batch_size, concurrency, max_seconds)
+
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'success': True, **result}),
+            'isBase64Encoded': False
+        }
+
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    request_id = getattr(context, 'request_id', None)
+    with log_buffer(request_id), trace_invocation('outbox', event, request_id):
+        return handle_request(event, context)
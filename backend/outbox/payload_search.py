@@ -0,0 +1,66 @@
+'''
+Ключи поиска по телам журнала: при записи из request_data/response_data извлекаются external_id, email, ИНН,
+сумма, касса, uuid и статус чека, код ошибки EcomKassa и пишутся в integration_logs.search_keys (jsonb с GIN-индексом).
+Сами тела по-прежнему хранятся сжатыми (payload_codec); logs ищет по search_keys через @> и jsonpath.
+'''
+
+import json
+from typing import Any, Callable, Dict, Optional
+
+def as_text(value: Any) -> str:
+    return str(value).strip()
+
+def as_lower_text(value: Any) -> str:
+    return str(value).strip().lower()
+
+def as_amount(value: Any) -> float:
+    return round(float(value), 2)
+
+SEARCH_KEYS: Dict[str, Callable[[Any], Any]] = {
+    'external_id': as_text,
+    'email': as_lower_text,
+    'inn': as_text,
+    'amount': as_amount,
+    'kassa_id': int,
+    'receipt_uuid': as_text,
+    'receipt_status': as_lower_text,
+    'error_code': as_text
+}
+
+def parse_json(text: Optional[str]) -> Dict[str, Any]:
+    if not text or not text.lstrip().startswith('{'):
+        return {}
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+def normalize_search_keys(values: Dict[str, Any]) -> Dict[str, Any]:
+    keys = {}
+    for key, value in values.items():
+        if value is None or value == '' or key not in SEARCH_KEYS:
+            continue
+        try:
+            keys[key] = SEARCH_KEYS[key](value)
+        except (TypeError, ValueError):
+            continue
+    return keys
+
+def extract_search_keys(request_data: Optional[str], response_data: Optional[str]) -> Optional[str]:
+    request = parse_json(request_data)
+    response = parse_json(response_data)
+    receipt = request.get('receipt') if isinstance(request.get('receipt'), dict) else {}
+    error = response.get('error')
+
+    keys = normalize_search_keys({
+        'external_id': request.get('external_id'),
+        'email': receipt.get('email'),
+        'inn': receipt.get('inn'),
+        'amount': request.get('amount'),
+        'kassa_id': request.get('kassaid'),
+        'receipt_uuid': response.get('uuid') or request.get('uuid'),
+        'receipt_status': response.get('status'),
+        'error_code': error.get('code') if isinstance(error, dict) else None
+    })
+    return json.dumps(keys, ensure_ascii=False) if keys else None
@@ -0,0 +1,150 @@
+'''
+Допуск запросов pay по порталам: корзина токенов на member_id в rate_limit_buckets (один UPSERT на запрос)
+и ограничение одновременных вызовов EcomKassa через сессионные advisory-блокировки — слоты 0..max_inflight-1.
+Лимиты берутся из users (rate_limit_per_minute, rate_limit_burst, max_inflight) или из переменных окружения.
+Блокировки держит соединение запроса (request_connection), поэтому слоты освобождаются и при падении контейнера.
+Пакет списывает по токену на платёж; больше ёмкости корзины он проходит только при полной корзине и уводит её в минус,
+так что портал ждёт, пока долг не погасится. Корзины всех порталов пакета списываются в одной транзакции
+(строки блокируются в порядке member_id): если хоть одному порталу не хватает токенов, не списывается никому,
+а при отказе по слотам списанное возвращается. Если слоты не удалось освободить, соединение закрывается, чтобы
+PostgreSQL снял блокировки. Отказ — AdmissionRejected с retry_after, обработчик отвечает 429 до записи счёта.
+'''
+
+import math
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from db import db_connection
+
+PAY_ADMISSION_ENABLED = os.environ.get('PAY_ADMISSION_ENABLED', 'true').lower() != 'false'
+PAY_RATE_LIMIT_PER_MINUTE = float(os.environ.get('PAY_RATE_LIMIT_PER_MINUTE', '120'))
+PAY_RATE_LIMIT_BURST = float(os.environ.get('PAY_RATE_LIMIT_BURST', '60'))
+PAY_MAX_INFLIGHT = int(os.environ.get('PAY_MAX_INFLIGHT', '4'))
+PAY_INFLIGHT_RETRY_AFTER = int(os.environ.get('PAY_INFLIGHT_RETRY_AFTER', '1'))
+
+class AdmissionRejected(Exception):
+    def __init__(self, member_id: str, reason: str, retry_after: int):
+        super().__init__(f'{reason} for {member_id}')
+        self.member_id = member_id
+        self.reason = reason
+        self.retry_after = retry_after
+
+def tenant_limits(settings: Dict[str, Any]) -> Tuple[float, float, int]:
+    per_minute = settings.get('rate_limit_per_minute') or PAY_RATE_LIMIT_PER_MINUTE
+    burst = settings.get('rate_limit_burst') or PAY_RATE_LIMIT_BURST
+    max_inflight = settings.get('max_inflight') or PAY_MAX_INFLIGHT
+    return float(per_minute) / 60, float(burst), int(max_inflight)
+
+def take_tokens(charges: List[Tuple[str, float, float, float]]) -> Tuple[Optional[str], int]:
+    with db_connection() as conn:
+        cur = conn.cursor()
+
+        query = '''
+            INSERT INTO rate_limit_buckets AS b (member_id, tokens, updated_at)
+            VALUES (%(member_id)s, %(burst)s - %(cost)s, LOCALTIMESTAMP)
+            ON CONFLICT (member_id) DO UPDATE
+            SET tokens = LEAST(%(burst)s, b.tokens + EXTRACT(EPOCH FROM LOCALTIMESTAMP - b.updated_at) * %(rate)s) - %(cost)s,
+                updated_at = LOCALTIMESTAMP
+            WHERE LEAST(%(burst)s, b.tokens + EXTRACT(EPOCH FROM LOCALTIMESTAMP - b.updated_at) * %(rate)s)
+                  >= LEAST(%(cost)s, %(burst)s)
+            RETURNING tokens
+        '''
+        for member_id, cost, rate, burst in sorted(charges):
+            params = {'member_id': member_id, 'cost': cost, 'rate': rate, 'burst': burst}
+            cur.execute(query, params)
+            if cur.fetchone() is not None:
+                continue
+
+            conn.rollback()
+            cur.execute('''
+                SELECT LEAST(%(cost)s, %(burst)s)
+                       - LEAST(%(burst)s, tokens + EXTRACT(EPOCH FROM LOCALTIMESTAMP - updated_at) * %(rate)s)
+                FROM rate_limit_buckets WHERE member_id = %(member_id)s
+            ''', params)
+            row = cur.fetchone()
+            conn.commit()
+            cur.close()
+
+            missing = float(row[0]) if row else min(cost, burst)
+            return member_id, max(1, math.ceil(missing / rate)) if rate > 0 else 60
+
+        conn.commit()
+        cur.close()
+
+    return None, 0
+
+def refund_tokens(charges: List[Tuple[str, float, float, float]]):
+    with db_connection() as conn:
+        cur = conn.cursor()
+        for member_id, cost, _, burst in sorted(charges):
+            cur.execute('''
+                UPDATE rate_limit_buckets SET tokens = LEAST(%s, tokens + %s) WHERE member_id = %s
+            ''', (burst, cost, member_id))
+        conn.commit()
+        cur.close()
+
+def acquire_slots(member_id: str, wanted: int, limit: int) -> List[int]:
+    with db_connection() as conn:
+        cur = conn.cursor()
+
+        query = '''
+            SELECT slot FROM generate_series(0, %s - 1) AS slot
+            WHERE pg_try_advisory_lock(hashtext(%s), slot)
+            LIMIT %s
+        '''
+        cur.execute(query, (limit, f'ecomkassa_inflight:{member_id}', wanted))
+        slots = [row[0] for row in cur.fetchall()]
+        conn.commit()
+        cur.close()
+
+    return slots
+
+def release_slots(member_id: str, slots: List[int]):
+    if not slots:
+        return
+
+    with db_connection() as conn:
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT pg_advisory_unlock(hashtext(%s), slot) FROM unnest(%s::integer[]) AS slot',
+                        (f'ecomkassa_inflight:{member_id}', slots))
+            conn.commit()
+            cur.close()
+        except Exception:
+            conn.close()
+            raise
+
+@contextmanager
+def admit(demands: Dict[str, Tuple[Dict[str, Any], int, int]]) -> Iterator[Dict[str, threading.Semaphore]]:
+    if not PAY_ADMISSION_ENABLED:
+        yield {member_id: threading.Semaphore(max(wanted, 1)) for member_id, (_, _, wanted) in demands.items()}
+        return
+
+    charges = [(member_id, cost, *tenant_limits(settings)[:2]) for member_id, (settings, cost, _) in demands.items()]
+    rejected, retry_after = take_tokens(charges)
+    if rejected:
+        raise AdmissionRejected(rejected, 'Rate limit exceeded', retry_after)
+
+    held: Dict[str, List[int]] = {}
+    try:
+        for member_id, (settings, _, wanted) in demands.items():
+            if not wanted:
+                continue
+            _, _, max_inflight = tenant_limits(settings)
+            held[member_id] = acquire_slots(member_id, min(wanted, max_inflight), max_inflight)
+            if not held[member_id]:
+                try:
+                    refund_tokens(charges)
+                except Exception as e:
+                    print(f'Failed to refund rate limit tokens: {e}')
+                raise AdmissionRejected(member_id, 'Too many concurrent payments', PAY_INFLIGHT_RETRY_AFTER)
+
+        yield {member_id: threading.Semaphore(len(slots)) for member_id, slots in held.items()}
+    finally:
+        for member_id, slots in held.items():
+            try:
+                release_slots(member_id, slots)
+            except Exception as e:
+                print(f'Failed to release EcomKassa slots for {member_id}: {e}')
@@ -0,0 +1,218 @@
+'''
+Асинхронная среда обработчиков (HANDLER_ASYNC=true): постоянный event loop в фоновом потоке контейнера,
+пул asyncpg и httpx.AsyncClient поверх него. Синхронный handler отдаёт корутину в loop через run_async,
+поэтому одновременные вызовы в одном контейнере делят loop, пул соединений и keep-alive к внешним API.
+Как и в http_client, при retry_reads=False (уведомления) повторяются только ошибки соединения, но не 502/503/504.
+Запросы к БД и HTTP-вызовы попадают в trace и счётчики db_stats так же, как в синхронных db и http_client;
+журнал и спаны вызова пишутся в конце параллельно, сжатие тел журнала уходит в поток (asyncio.to_thread).
+Пул asyncpg занимает DB_ASYNC_POOL_MAX из общего DB_POOL_MAX, остальное — синхронному пулу db для обновления токена
+и пакетной оплаты, поэтому контейнер не открывает больше DB_POOL_MAX соединений. Соединение ждётся не дольше
+DB_ACQUIRE_TIMEOUT, вызов целиком — не дольше HANDLER_ASYNC_TIMEOUT, поэтому исчерпанный пул даёт ошибку запроса,
+а не зависший контейнер.
+asyncio, asyncpg и httpx импортируются только при первом асинхронном вызове.
+'''
+
+import os
+import random
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Dict, List, Optional, Tuple
+
+from db import DB_ACQUIRE_TIMEOUT, DB_ASYNC_POOL_MAX, DB_POOL_MIN, count_stat
+from http_client import (HTTP_BACKOFF_FACTOR, HTTP_BACKOFF_MAX, HTTP_CONNECT_TIMEOUT, HTTP_POOL_CONNECTIONS,
+                         HTTP_POOL_MAXSIZE, HTTP_RETRIES)
+from integration_log import log_buffer, prepare_log_rows, take_log_entries
+from tracing import (TRACE_EXPORT_FILE, TRACE_STATEMENT_MAX, current_traceparent, export_spans, set_span_attributes,
+                     span, span_rows, trace_invocation)
+
+HANDLER_ASYNC = os.environ.get('HANDLER_ASYNC', 'false').lower() == 'true'
+HANDLER_ASYNC_TIMEOUT = float(os.environ.get('HANDLER_ASYNC_TIMEOUT', '60'))
+HTTP_RETRY_STATUSES = (502, 503, 504)
+HTTP_RETRY_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+
+LOG_INSERT = '''
+    INSERT INTO integration_logs (created_at, log_type, member_id, deal_id, external_id,
+                                  request_data, response_data, status, error_message,
+                                  duration_ms, connect_ms, bytes_out, bytes_in, http_status, request_id, trace_id,
+                                  request_blob, response_blob, payload_codec, search_keys)
+    VALUES (to_timestamp($1)::timestamp, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14, $15, $16,
+            $17, $18, $19, $20::jsonb)
+'''
+
+SPAN_INSERT = '''
+    INSERT INTO trace_spans (trace_id, span_id, parent_span_id, service, name,
+                             started_at, duration_ms, status, attributes)
+    VALUES ($1, $2, $3, $4, $5, to_timestamp($6)::timestamp, $7, $8, $9)
+    ON CONFLICT (trace_id, span_id) DO NOTHING
+'''
+
+_loop: Optional[Any] = None
+_loop_lock = threading.Lock()
+_pool: Optional[Any] = None
+_pool_lock: Optional[Any] = None
+_client: Optional[Any] = None
+
+def get_event_loop():
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                import asyncio
+
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='aio-runtime', daemon=True).start()
+                _loop = loop
+    return _loop
+
+def run_async(coro: Awaitable[Any]) -> Any:
+    import asyncio
+    from concurrent.futures import TimeoutError as FutureTimeoutError
+
+    future = asyncio.run_coroutine_threadsafe(coro, get_event_loop())
+    try:
+        return future.result(timeout=HANDLER_ASYNC_TIMEOUT)
+    except FutureTimeoutError:
+        future.cancel()
+        raise TimeoutError(f'Async handler did not finish in {HANDLER_ASYNC_TIMEOUT}s')
+
+async def on_connect(conn):
+    count_stat('connects')
+
+async def get_aio_pool():
+    global _pool, _pool_lock
+    import asyncio
+    import asyncpg
+
+    if _pool is None:
+        if _pool_lock is None:
+            _pool_lock = asyncio.Lock()
+        async with _pool_lock:
+            if _pool is None:
+                max_size = max(1, DB_ASYNC_POOL_MAX)
+                _pool = await asyncpg.create_pool(os.environ.get('DATABASE_URL'), min_size=min(DB_POOL_MIN, max_size),
+                                                  max_size=max_size, init=on_connect)
+    return _pool
+
+@asynccontextmanager
+async def aio_connection(held: Optional[Any] = None) -> AsyncIterator[Any]:
+    if held is not None:
+        yield held
+        return
+
+    pool = await get_aio_pool()
+    with span('db.acquire'):
+        conn = await pool.acquire(timeout=DB_ACQUIRE_TIMEOUT)
+    count_stat('acquires')
+    try:
+        yield conn
+    finally:
+        await pool.release(conn)
+
+async def run_query(conn, method: str, query: str, *args: Any) -> Any:
+    count_stat('queries')
+    with span('db.query', statement=' '.join(query.split())[:TRACE_STATEMENT_MAX]):
+        return await getattr(conn, method)(query, *args)
+
+def get_http_client():
+    global _client
+    if _client is None:
+        import httpx
+
+        limits = httpx.Limits(max_connections=HTTP_POOL_CONNECTIONS * HTTP_POOL_MAXSIZE,
+                              max_keepalive_connections=HTTP_POOL_MAXSIZE)
+        _client = httpx.AsyncClient(transport=httpx.AsyncHTTPTransport(retries=HTTP_RETRIES, limits=limits))
+    return _client
+
+def connect_timer(timings: Dict[str, float]):
+    async def on_trace(event: str, info: Dict[str, Any]):
+        if not event.startswith(('connection.connect_tcp.', 'connection.start_tls.')):
+            return
+        if event.endswith('.started'):
+            timings['started'] = time.perf_counter()
+        elif 'started' in timings:
+            timings['connect_ms'] += (time.perf_counter() - timings.pop('started')) * 1000
+    return on_trace
+
+def retry_backoff(attempt: int) -> float:
+    return min(HTTP_BACKOFF_MAX, random.uniform(0, HTTP_BACKOFF_FACTOR * (2 ** attempt)))
+
+async def aio_request(method: str, url: str, read_timeout: float, stats: Optional[Dict[str, Any]] = None,
+                      retry_reads: bool = True, **kwargs: Any) -> Any:
+    import asyncio
+    import httpx
+
+    stats = stats if stats is not None else {}
+    with span(f'http.{method.lower()}', url=url.split('?')[0]):
+        traceparent = current_traceparent()
+        if traceparent:
+            kwargs['headers'] = {**(kwargs.get('headers') or {}), 'traceparent': traceparent}
+
+        timings = {'connect_ms': 0.0}
+        timeout = httpx.Timeout(read_timeout, connect=HTTP_CONNECT_TIMEOUT)
+        started = time.perf_counter()
+        response = None
+        try:
+            for attempt in range(HTTP_RETRIES + 1):
+                response = await get_http_client().request(method, url, timeout=timeout,
+                                                            extensions={'trace': connect_timer(timings)}, **kwargs)
+                if not retry_reads or response.status_code not in HTTP_RETRY_STATUSES \
+                        or method.upper() not in HTTP_RETRY_METHODS or attempt == HTTP_RETRIES:
+                    break
+                await asyncio.sleep(retry_backoff(attempt))
+            return response
+        finally:
+            stats.update({
+                'duration_ms': round((time.perf_counter() - started) * 1000),
+                'connect_ms': round(timings['connect_ms']),
+                'bytes_out': len(response.request.content) if response is not None else 0,
+                'bytes_in': len(response.content) if response is not None else 0,
+                'http_status': response.status_code if response is not None else None
+            })
+            set_span_attributes(**stats)
+
+async def aio_write_logs(entries: List[Tuple]):
+    import asyncio
+
+    if not entries:
+        return
+
+    try:
+        rows = await asyncio.to_thread(prepare_log_rows, entries)
+        async with aio_connection() as conn:
+            await run_query(conn, 'executemany', LOG_INSERT, rows)
+    except Exception as e:
+        print(f'Failed to flush {len(entries)} integration log entries: {e}')
+
+async def aio_flush_logs():
+    await aio_write_logs(take_log_entries())
+
+async def aio_flush_spans(trace_id: str, service: str, spans: List[Dict[str, Any]]):
+    import asyncio
+
+    if not spans:
+        return
+
+    try:
+        async with aio_connection() as conn:
+            await run_query(conn, 'executemany', SPAN_INSERT, span_rows(trace_id, service, spans))
+    except Exception as e:
+        print(f'Failed to write {len(spans)} trace spans: {e}')
+
+    if TRACE_EXPORT_FILE:
+        try:
+            await asyncio.to_thread(export_spans, trace_id, service, spans)
+        except Exception as e:
+            print(f'Failed to export {len(spans)} trace spans: {e}')
+
+@asynccontextmanager
+async def aio_invocation(name: str, event: Dict[str, Any], request_id: Optional[str] = None) -> AsyncIterator[None]:
+    import asyncio
+
+    finished: List[Tuple[str, str, List[Dict[str, Any]]]] = []
+    with log_buffer(request_id):
+        try:
+            with trace_invocation(name, event, request_id, on_finish=lambda *args: finished.append(args)):
+                yield
+        finally:
+            await asyncio.gather(aio_flush_logs(), *(aio_flush_spans(*args) for args in finished))
@@ -0,0 +1,87 @@
+'''
+Отправка чека в очередь фискализации EcomKassa (/api/v1/queue) и запрос его состояния (/api/v1/report/<uuid>)
+с логированием и однократным повтором со свежим токеном при ошибке авторизации.
+Каждая попытка — одна запись ecomkassa_queue или ecomkassa_report: тело без токена, ответ, статус, время и размеры.
+'''
+
+import json
+from typing import Any, Dict
+
+from integration_log import log_integration
+from http_client import http_get, http_post
+from ecomkassa_token import ECOMKASSA_API_URL, get_cached_token, replace_rejected_token
+
+ECOMKASSA_QUEUE_URL = f'{ECOMKASSA_API_URL}/api/v1/queue'
+ECOMKASSA_REPORT_URL = f'{ECOMKASSA_API_URL}/api/v1/report'
+ECOMKASSA_QUEUE_TIMEOUT = 15
+ECOMKASSA_REPORT_TIMEOUT = 10
+ECOMKASSA_AUTH_ERROR_STATUSES = (401, 403)
+
+def post_receipt(member_id: str, payload: Dict[str, Any], token: str, deal_id: str, external_id: str):
+    stats: Dict[str, Any] = {}
+    try:
+        response = http_post(
+            ECOMKASSA_QUEUE_URL,
+            read_timeout=ECOMKASSA_QUEUE_TIMEOUT,
+            stats=stats,
+            json={**payload, 'token': token}
+        )
+    except Exception as e:
+        log_integration('ecomkassa_queue', member_id, deal_id, external_id,
+                        json.dumps(payload), '', 'error', str(e), stats)
+        raise
+
+    error_message = None if response.status_code == 200 else f'HTTP {response.status_code}'
+    log_integration('ecomkassa_queue', member_id, deal_id, external_id,
+                    json.dumps(payload), response.text, 'success' if error_message is None else 'error',
+                    error_message, stats)
+    return response
+
+def send_receipt(member_id: str, settings: Dict[str, Any], payload: Dict[str, Any],
+                 deal_id: str, external_id: str) -> Dict[str, Any]:
+    token = get_cached_token(member_id, settings)
+    response = post_receipt(member_id, payload, token, deal_id, external_id)
+
+    if response.status_code in ECOMKASSA_AUTH_ERROR_STATUSES:
+        token = replace_rejected_token(member_id, settings, token)
+        response = post_receipt(member_id, payload, token, deal_id, external_id)
+
+    if response.status_code != 200:
+        raise Exception(f'EcomKassa API error: {response.text}')
+
+    return response.json()
+
+def get_report(member_id: str, receipt_uuid: str, token: str, deal_id: str, external_id: str):
+    stats: Dict[str, Any] = {}
+    request_data = json.dumps({'uuid': receipt_uuid})
+    try:
+        response = http_get(
+            f'{ECOMKASSA_REPORT_URL}/{receipt_uuid}',
+            read_timeout=ECOMKASSA_REPORT_TIMEOUT,
+            stats=stats,
+            params={'token': token}
+        )
+    except Exception as e:
+        log_integration('ecomkassa_report', member_id, deal_id, external_id,
+                        request_data, '', 'error', str(e), stats)
+        raise
+
+    error_message = None if response.status_code == 200 else f'HTTP {response.status_code}'
+    log_integration('ecomkassa_report', member_id, deal_id, external_id,
+                    request_data, response.text, 'success' if error_message is None else 'error',
+                    error_message, stats)
+    return response
+
+def fetch_receipt_report(member_id: str, settings: Dict[str, Any], receipt_uuid: str,
+                         deal_id: str, external_id: str) -> Dict[str, Any]:
+    token = get_cached_token(member_id, settings)
+    response = get_report(member_id, receipt_uuid, token, deal_id, external_id)
+
+    if response.status_code in ECOMKASSA_AUTH_ERROR_STATUSES:
+        token = replace_rejected_token(member_id, settings, token)
+        response = get_report(member_id, receipt_uuid, token, deal_id, external_id)
+
+    if response.status_code != 200:
+        raise Exception(f'EcomKassa API error: {response.text}')
+
+    return response.json()
@@ -0,0 +1,75 @@
+'''
+Общая HTTP-сессия для исходящих вызовов EcomKassa и Bitrix24.
+Сессия создаётся один раз на контейнер, держит keep-alive пулы соединений по хостам
+и переживает тёплые вызовы. Ошибки соединения и 502/503/504 на идемпотентных методах
+повторяются с экспоненциальной задержкой и случайным разбросом. Вызовы с побочным эффектом (retry_reads=False,
+уведомления Bitrix24 и вебхуки) повторяются только при ошибке соединения: после таймаута чтения запрос
+мог уже выполниться, его повторяет очередь доставок.
+Каждый вызов измеряется по монотонным часам: общее время, время установки новых соединений
+(DNS + TCP + TLS, 0 при переиспользовании keep-alive), байты тела запроса и ответа, HTTP-статус.
+Вызов оформляется спаном http.<метод> текущего trace, контекст уходит получателю в заголовке traceparent.
+requests загружается при первом вызове (http_session), а не при импорте функции.
+'''
+
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from tracing import current_traceparent, set_span_attributes, span
+
+HTTP_POOL_CONNECTIONS = int(os.environ.get('HTTP_POOL_CONNECTIONS', '10'))
+HTTP_POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', '10'))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', '3.05'))
+HTTP_RETRIES = int(os.environ.get('HTTP_RETRIES', '2'))
+HTTP_BACKOFF_FACTOR = float(os.environ.get('HTTP_BACKOFF_FACTOR', '0.3'))
+HTTP_BACKOFF_MAX = float(os.environ.get('HTTP_BACKOFF_MAX', '5'))
+
+_sessions: Dict[bool, Any] = {}
+_session_lock = threading.Lock()
+_local = threading.local()
+
+def record_connect_time(started: float):
+    _local.connect_ms = getattr(_local, 'connect_ms', 0.0) + (time.perf_counter() - started) * 1000
+
+def get_http_session(retry_reads: bool = True):
+    session = _sessions.get(retry_reads)
+    if session is None:
+        with _session_lock:
+            session = _sessions.get(retry_reads)
+            if session is None:
+                from http_session import build_session
+                session = _sessions[retry_reads] = build_session(retry_reads)
+    return session
+
+def http_request(method: str, url: str, read_timeout: float, stats: Optional[Dict[str, Any]] = None,
+                 retry_reads: bool = True, **kwargs: Any) -> Any:
+    stats = stats if stats is not None else {}
+    with span(f'http.{method.lower()}', url=url.split('?')[0]):
+        traceparent = current_traceparent()
+        if traceparent:
+            kwargs['headers'] = {**(kwargs.get('headers') or {}), 'traceparent': traceparent}
+
+        _local.connect_ms = 0.0
+        started = time.perf_counter()
+        response = None
+        try:
+            response = get_http_session(retry_reads).request(method, url, timeout=(HTTP_CONNECT_TIMEOUT, read_timeout),
+                                                             **kwargs)
+            return response
+        finally:
+            body = response.request.body if response is not None else None
+            stats.update({
+                'duration_ms': round((time.perf_counter() - started) * 1000),
+                'connect_ms': round(_local.connect_ms),
+                'bytes_out': len(body.encode() if isinstance(body, str) else body or b''),
+                'bytes_in': len(response.content) if response is not None else 0,
+                'http_status': response.status_code if response is not None else None
+            })
+            set_span_attributes(**stats)
+
+def http_get(url: str, read_timeout: float, stats: Optional[Dict[str, Any]] = None, **kwargs: Any) -> Any:
+    return http_request('GET', url, read_timeout, stats, **kwargs)
+
+def http_post(url: str, read_timeout: float, stats: Optional[Dict[str, Any]] = None, **kwargs: Any) -> Any:
+    return http_request('POST', url, read_timeout, stats, **kwargs)
@@ -0,0 +1,74 @@
+'''
+Сборка requests.Session для http_client: keep-alive пулы по хостам, повторы с разбросом
+(без повторов после таймаута чтения и по статусу, если retry_reads=False)
+и пулы urllib3 с замером времени установки соединения.
+Модуль импортируется при первом исходящем вызове, чтобы холодный старт не платил за requests и urllib3.
+'''
+
+import random
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+from http_client import (HTTP_BACKOFF_FACTOR, HTTP_BACKOFF_MAX, HTTP_POOL_CONNECTIONS, HTTP_POOL_MAXSIZE,
+                         HTTP_RETRIES, record_connect_time)
+
+class TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            record_connect_time(started)
+
+class TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            record_connect_time(started)
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+class JitteredRetry(Retry):
+    def get_backoff_time(self) -> float:
+        backoff = super().get_backoff_time()
+        if backoff <= 0:
+            return 0
+        return min(HTTP_BACKOFF_MAX, random.uniform(0, backoff))
+
+def build_session(retry_reads: bool = True) -> requests.Session:
+    retry = JitteredRetry(
+        total=HTTP_RETRIES,
+        connect=HTTP_RETRIES,
+        read=HTTP_RETRIES if retry_reads else 0,
+        status=HTTP_RETRIES if retry_reads else 0,
+        backoff_factor=HTTP_BACKOFF_FACTOR,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset(['GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS']),
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_CONNECTIONS,
+        pool_maxsize=HTTP_POOL_MAXSIZE,
+        max_retries=retry
+    )
+
+    adapter.poolmanager.pool_classes_by_scheme = {
+        'http': TimedHTTPConnectionPool,
+        'https': TimedHTTPSConnectionPool
+    }
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
@@ -1,16 +1,29 @@
 '''
 Business: Создание платежа EcomKassa и отправка чека на фискализацию
-Args: event с httpMethod, body (member_id, PAYMENT_ID, dealid, secret_code), context с request_id
-Returns: HTTP response с payment_url или ошибкой
+Args: event с httpMethod, body (member_id, PAYMENT_ID, dealid, secret_code) или body.payments — массив таких платежей, context с request_id
+Returns: HTTP response с payment_url (200), признаком постановки чека в очередь (202) или ошибкой
 '''
 
 import json
 import os
+import threading
 import uuid
-import requests
-import psycopg2
-from typing import Dict, Any, Optional
+from collections import Counter
+from typing import Dict, Any, List, Optional, Tuple
 from dataclasses import dataclass
+from db import db_connection, request_connection
+from aio_runtime import HANDLER_ASYNC, run_async
+from integration_log import current_request_id, log_buffer
+from ecomkassa import send_receipt
+from ecomkassa_token import get_cached_token
+from settings_cache import get_cached_settings
+from admission import AdmissionRejected, admit
+from receipt_outbox import enqueue_receipt, enqueue_receipts, mark_receipt_failed, mark_receipt_sent, mark_receipts_sent
+from tracing import TraceContext, current_trace_context, current_traceparent, set_span_attributes, trace, trace_invocation
+
+PAY_OUTBOX_MODE = os.environ.get('PAY_OUTBOX_MODE', 'false').lower() == 'true'
+PAY_BATCH_MAX_ITEMS = int(os.environ.get('PAY_BATCH_MAX_ITEMS', '1000'))
+PAY_BATCH_CONCURRENCY = int(os.environ.get('PAY_BATCH_CONCURRENCY', '4'))
 
 @dataclass
 class PaymentRequest:
@@ -22,28 +35,15 @@ class PaymentRequest:
     amount: float
     client_email: str
 
-def get_db_connection():
-    dsn = os.environ.get('DATABASE_URL')
-    return psycopg2.connect(dsn)
+USER_SETTINGS_COLUMNS = '''
+    ecom_login, ecom_pass, ecom_kassa_id, token_ecom_kassa,
+    payment_object, payment_method, company_email, company_sno,
+    company_inn, company_payment_address, vat_order, webhook_url,
+    EXTRACT(EPOCH FROM token_ecom_kassa_expires_at - LOCALTIMESTAMP),
+    rate_limit_per_minute, rate_limit_burst, max_inflight
+'''
 
-def get_user_settings(member_id: str) -> Optional[Dict[str, Any]]:
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    query = '''
-        SELECT ecom_login, ecom_pass, ecom_kassa_id, token_ecom_kassa,
-               payment_object, payment_method, company_email, company_sno,
-               company_inn, company_payment_address, vat_order, webhook_url
-        FROM users WHERE member_id = %s
-    '''
-    cur.execute(query, (member_id,))
-    row = cur.fetchone()
-    cur.close()
-    conn.close()
-    
-    if not row:
-        return None
-    
+def user_settings_from_row(row: Any) -> Dict[str, Any]:
     return {
         'ecom_login': row[0],
         'ecom_pass': row[1],
@@ -56,82 +56,77 @@ def get_user_settings(member_id: str) -> Optional[Dict[str, Any]]:
         'company_inn': row[8],
         'company_payment_address': row[9],
         'vat_order': row[10],
-        'webhook_url': row[11]
+        'webhook_url': row[11],
+        'token_ecom_kassa_ttl': float(row[12]) if row[12] is not None else None,
+        'rate_limit_per_minute': row[13],
+        'rate_limit_burst': row[14],
+        'max_inflight': row[15]
     }
 
-def get_ecomkassa_token(login: str, password: str) -> Optional[str]:
-    try:
-        response = requests.post(
-            'https://api.ecomkassa.ru/login',
-            json={'login': login, 'password': password},
-            timeout=10
-        )
-        if response.status_code == 200:
-            data = response.json()
-            return data.get('access_token')
-    except:
-        pass
-    return None
+def get_user_settings(member_id: str) -> Optional[Dict[str, Any]]:
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(f'SELECT {USER_SETTINGS_COLUMNS} FROM users WHERE member_id = %s', (member_id,))
+        row = cur.fetchone()
+        cur.close()
+    
+    return user_settings_from_row(row) if row else None
 
-def create_bill(member_id: str, payment_id: int, paysystem_id: int, deal_id: int, external_id: str, secret: str) -> int:
-    conn = get_db_connection()
-    cur = conn.cursor()
+def create_bill_with_receipt(member_id: str, payment_id: int, paysystem_id: int, deal_id: int, external_id: str,
+                             secret: str, payload: Dict[str, Any], leased: bool) -> Tuple[int, int]:
+    with db_connection() as conn:
+        cur = conn.cursor()
     
-    query = '''
-        INSERT INTO bills (member_id, payment_id, paysystem_id, deal_id, external_id, secret, status)
-        VALUES (%s, %s, %s, %s, %s, %s, 'pending')
-        RETURNING id
-    '''
-    cur.execute(query, (member_id, payment_id, paysystem_id, deal_id, external_id, secret))
-    bill_id = cur.fetchone()[0]
+        query = '''
+            INSERT INTO bills (member_id, payment_id, paysystem_id, deal_id, external_id, secret, status)
+            VALUES (%s, %s, %s, %s, %s, %s, 'pending')
+            RETURNING id
+        '''
+        cur.execute(query, (member_id, payment_id, paysystem_id, deal_id, external_id, secret))
+        bill_id = cur.fetchone()[0]
+        outbox_id = enqueue_receipt(cur, bill_id, member_id, external_id, str(deal_id), payload, leased)
     
-    conn.commit()
-    cur.close()
-    conn.close()
+        conn.commit()
+        cur.close()
     
-    return bill_id
+    return bill_id, outbox_id
 
-def cleanup_old_logs():
-    conn = get_db_connection()
-    cur = conn.cursor()
+def create_bills_with_receipts(items: List[Dict[str, Any]], leased: bool) -> None:
+    from psycopg2.extras import execute_values
+
+    with db_connection() as conn:
+        cur = conn.cursor()
     
-    query = '''
-        DELETE FROM integration_logs 
-        WHERE created_at < NOW() - INTERVAL '30 days'
-    '''
-    cur.execute(query)
-    deleted_count = cur.rowcount
+        query = '''
+            INSERT INTO bills (member_id, payment_id, paysystem_id, deal_id, external_id, secret, status)
+            VALUES %s
+            RETURNING id, external_id
+        '''
+        rows = execute_values(cur, query, [
+            (item['request'].member_id, item['request'].PAYMENT_ID, item['request'].PAYSYSTEM_ID,
+             item['request'].dealid, item['external_id'], item['secret'])
+            for item in items
+        ], template="(%s, %s, %s, %s, %s, %s, 'pending')", page_size=len(items), fetch=True)
+        bill_ids = {row[1]: row[0] for row in rows}
     
-    conn.commit()
-    cur.close()
-    conn.close()
+        for item in items:
+            item['bill_id'] = bill_ids[item['external_id']]
+        outbox_ids = enqueue_receipts(cur, [
+            (item['bill_id'], item['request'].member_id, item['external_id'], str(item['request'].dealid), item['payload'])
+            for item in items
+        ], leased)
+        for item in items:
+            item['outbox_id'] = outbox_ids[item['bill_id']]
     
-    return deleted_count
+        conn.commit()
+        cur.close()
 
-def log_integration(log_type: str, member_id: str, deal_id: str, external_id: str, 
-                    request_data: str, response_data: str, status: str, error_message: str = None):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    query = '''
-        INSERT INTO integration_logs (log_type, member_id, deal_id, external_id, 
-                                      request_data, response_data, status, error_message)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-    '''
-    cur.execute(query, (log_type, member_id, deal_id, external_id, 
-                        request_data, response_data, status, error_message))
-    
-    conn.commit()
-    cur.close()
-    conn.close()
+def build_callback_url(external_id: str, bill_secret: str) -> str:
+    callback_url = f'https://your-domain.com/backend/callback?external_id={external_id}&secret={bill_secret}'
+    traceparent = current_traceparent()
+    return f'{callback_url}&traceparent={traceparent}' if traceparent else callback_url
 
-def create_ecomkassa_payment(settings: Dict[str, Any], payment_data: PaymentRequest, external_id: str, callback_url: str) -> Dict[str, Any]:
-    token = settings.get('token_ecom_kassa')
-    if not token:
-        token = get_ecomkassa_token(settings['ecom_login'], settings['ecom_pass'])
-        if not token:
-            raise Exception('Failed to get EcomKassa token')
-    
+def build_receipt_payload(settings: Dict[str, Any], payment_data: PaymentRequest, external_id: str, callback_url: str) -> Dict[str, Any]:
     receipt = {
         'email': payment_data.client_email or settings['company_email'],
         'taxation': settings['company_sno'] or 'usn_income',
@@ -148,40 +143,133 @@ def create_ecomkassa_payment(settings: Dict[str, Any], payment_data: PaymentRequ
         }]
     }
     
-    payload = {
+    return {
         'kassaid': settings['ecom_kassa_id'],
-        'token': token,
         'external_id': external_id,
         'amount': payment_data.amount,
         'description': f'Оплата по сделке #{payment_data.dealid}',
         'receipt': receipt,
         'callback_url': callback_url
     }
+
+def prepare_batch_item(data: Any, settings_by_member: Dict[str, Optional[Dict[str, Any]]]) -> Dict[str, Any]:
+    if not isinstance(data, dict):
+        raise ValueError('Payment must be an object')
+    
+    member_id = data.get('member_id')
+    if not all([member_id, data.get('PAYMENT_ID'), data.get('dealid'), data.get('secret_code'), data.get('amount')]):
+        raise ValueError('Missing required fields')
     
-    log_integration('ecomkassa_request', payment_data.member_id, str(payment_data.dealid), 
-                   external_id, json.dumps(payload), '', 'sent')
+    if member_id not in settings_by_member:
+        settings_by_member[member_id] = get_cached_settings(member_id, get_user_settings)
+    settings = settings_by_member[member_id]
+    if not settings:
+        raise ValueError('User settings not found')
+    if settings.get('secret_code') and settings['secret_code'] != data.get('secret_code'):
+        raise ValueError('Invalid secret code')
     
-    response = requests.post(
-        'https://api.ecomkassa.ru/api/v1/queue',
-        json=payload,
-        timeout=15
+    external_id = f'bitrix24_payment_{uuid.uuid4().hex[:12]}'
+    bill_secret = uuid.uuid4().hex
+    callback_url = build_callback_url(external_id, bill_secret)
+    
+    payment_request = PaymentRequest(
+        member_id=member_id,
+        PAYMENT_ID=data.get('PAYMENT_ID'),
+        PAYSYSTEM_ID=data.get('PAYSYSTEM_ID'),
+        dealid=data.get('dealid'),
+        secret_code=data.get('secret_code'),
+        amount=float(data.get('amount')),
+        client_email=data.get('client_email')
     )
     
-    response_data = response.json() if response.status_code == 200 else response.text
+    return {
+        'request': payment_request,
+        'settings': settings,
+        'external_id': external_id,
+        'secret': bill_secret,
+        'payload': build_receipt_payload(settings, payment_request, external_id, callback_url)
+    }
+
+def send_batch_item(item: Dict[str, Any], slots: threading.Semaphore, request_id: Optional[str],
+                    trace_context: Optional[TraceContext]) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    with slots, log_buffer(request_id), trace('pay.batch_item', parent=trace_context,
+                                              external_id=item['external_id']):
+        try:
+            return send_receipt(item['request'].member_id, item['settings'], item['payload'],
+                                str(item['request'].dealid), item['external_id']), None
+        except Exception as e:
+            return None, str(e)
+
+def process_payment_batch(payments: List[Any]) -> List[Dict[str, Any]]:
+    from concurrent.futures import ThreadPoolExecutor
+
+    results: List[Dict[str, Any]] = [{'index': index} for index in range(len(payments))]
+    settings_by_member: Dict[str, Optional[Dict[str, Any]]] = {}
+    items: List[Dict[str, Any]] = []
     
-    if response.status_code != 200:
-        log_integration('ecomkassa_response', payment_data.member_id, str(payment_data.dealid), 
-                       external_id, '', str(response_data), 'error', f'HTTP {response.status_code}')
-        raise Exception(f'EcomKassa API error: {response.text}')
+    for index, data in enumerate(payments):
+        try:
+            item = prepare_batch_item(data, settings_by_member)
+        except (ValueError, TypeError) as e:
+            results[index].update({'success': False, 'error': str(e)})
+            continue
+        item['index'] = index
+        items.append(item)
     
-    log_integration('ecomkassa_response', payment_data.member_id, str(payment_data.dealid), 
-                   external_id, '', json.dumps(response_data), 'success')
+    if not items:
+        return results
     
-    return response_data
-
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    cleanup_old_logs()
+    counts = Counter(item['request'].member_id for item in items)
+    demands = {
+        member_id: (settings_by_member[member_id], count, 0 if PAY_OUTBOX_MODE else min(count, PAY_BATCH_CONCURRENCY))
+        for member_id, count in counts.items()
+    }
+    with admit(demands) as slots:
+        create_bills_with_receipts(items, leased=not PAY_OUTBOX_MODE)
+    
+        for item in items:
+            results[item['index']].update({
+                'success': True,
+                'external_id': item['external_id'],
+                'bill_id': item['bill_id']
+            })
+    
+        if PAY_OUTBOX_MODE:
+            for item in items:
+                results[item['index']]['queued'] = True
+            return results
     
+        for member_id, settings in settings_by_member.items():
+            if settings:
+                try:
+                    get_cached_token(member_id, settings)
+                except Exception:
+                    pass
+    
+        request_id = current_request_id()
+        trace_context = current_trace_context()
+        with ThreadPoolExecutor(max_workers=PAY_BATCH_CONCURRENCY) as executor:
+            outcomes = list(executor.map(
+                lambda item: send_batch_item(item, slots[item['request'].member_id], request_id, trace_context), items))
+    
+        sent = []
+        for item, (ecom_response, error) in zip(items, outcomes):
+            result = results[item['index']]
+            if error is None:
+                sent.append((item['outbox_id'], ecom_response))
+                result.update({
+                    'payment_url': ecom_response.get('payment_url'),
+                    'payment_id': ecom_response.get('payment_id')
+                })
+            else:
+                mark_receipt_failed(item['outbox_id'], 1, error)
+                result.update({'queued': True, 'error': error})
+    
+        mark_receipts_sent(sent)
+    
+    return results
+
+def handle_request(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
@@ -208,6 +296,28 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     try:
         body_data = json.loads(event.get('body', '{}'))
         
+        if isinstance(body_data.get('payments'), list):
+            payments = body_data['payments']
+            if not payments or len(payments) > PAY_BATCH_MAX_ITEMS:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': f'payments must contain 1 to {PAY_BATCH_MAX_ITEMS} items'}),
+                    'isBase64Encoded': False
+                }
+            
+            results = process_payment_batch(payments)
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({
+                    'success': all(result['success'] for result in results),
+                    'results': results
+                }),
+                'isBase64Encoded': False
+            }
+        
         member_id = body_data.get('member_id')
         payment_id = body_data.get('PAYMENT_ID')
         paysystem_id = body_data.get('PAYSYSTEM_ID')
@@ -224,7 +334,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'isBase64Encoded': False
             }
         
-        settings = get_user_settings(member_id)
+        settings = get_cached_settings(member_id, get_user_settings)
         if not settings:
             return {
                 'statusCode': 404,
@@ -243,8 +353,9 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         
         external_id = f'bitrix24_payment_{uuid.uuid4().hex[:12]}'
         bill_secret = uuid.uuid4().hex
+        set_span_attributes(member_id=member_id, external_id=external_id)
         
-        callback_url = f'https://your-domain.com/backend/callback?external_id={external_id}&secret={bill_secret}'
+        callback_url = build_callback_url(external_id, bill_secret)
         
         payment_request = PaymentRequest(
             member_id=member_id,
@@ -256,27 +367,83 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             client_email=client_email
         )
         
-        ecom_response = create_ecomkassa_payment(settings, payment_request, external_id, callback_url)
+        with admit({member_id: (settings, 1, 0 if PAY_OUTBOX_MODE else 1)}):
+            payload = build_receipt_payload(settings, payment_request, external_id, callback_url)
+            bill_id, outbox_id = create_bill_with_receipt(member_id, payment_id, paysystem_id, deal_id, external_id,
+                                                          bill_secret, payload, leased=not PAY_OUTBOX_MODE)
+        
+            if PAY_OUTBOX_MODE:
+                return {
+                    'statusCode': 202,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({
+                        'success': True,
+                        'queued': True,
+                        'external_id': external_id,
+                        'bill_id': bill_id
+                    }),
+                    'isBase64Encoded': False
+                }
+        
+            try:
+                ecom_response = send_receipt(member_id, settings, payload, str(deal_id), external_id)
+            except Exception as e:
+                mark_receipt_failed(outbox_id, 1, str(e))
+                return {
+                    'statusCode': 202,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({
+                        'success': True,
+                        'queued': True,
+                        'error': str(e),
+                        'external_id': external_id,
+                        'bill_id': bill_id
+                    }),
+                    'isBase64Encoded': False
+                }
         
-        bill_id = create_bill(member_id, payment_id, paysystem_id, deal_id, external_id, bill_secret)
+            mark_receipt_sent(outbox_id, ecom_response)
         
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({
+                    'success': True,
+                    'payment_url': ecom_response.get('payment_url'),
+                    'payment_id': ecom_response.get('payment_id'),
+                    'external_id': external_id,
+                    'bill_id': bill_id
+                }),
+                'isBase64Encoded': False
+            }
+        
+    except AdmissionRejected as e:
+        set_span_attributes(admission=e.reason)
         return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({
-                'success': True,
-                'payment_url': ecom_response.get('payment_url'),
-                'payment_id': ecom_response.get('payment_id'),
-                'external_id': external_id,
-                'bill_id': bill_id
-            }),
+            'statusCode': 429,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Expose-Headers': 'Retry-After',
+                'Retry-After': str(e.retry_after)
+            },
+            'body': json.dumps({'error': e.reason, 'member_id': e.member_id, 'retry_after': e.retry_after}),
             'isBase64Encoded': False
         }
-        
+    
     except Exception as e:
         return {
             'statusCode': 500,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'body': json.dumps({'error': str(e)}),
             'isBase64Encoded': False
-        }
\ No newline at end of file
+        }
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    if HANDLER_ASYNC:
+        from pay_async import async_handler
+        return run_async(async_handler(event, context))
+
+    request_id = getattr(context, 'request_id', None)
+    with request_connection(), log_buffer(request_id), trace_invocation('pay', event, request_id):
+        return handle_request(event, context)
@@ -0,0 +1,363 @@
+'''
+Асинхронный pay (HANDLER_ASYNC=true): одиночный платёж на asyncpg и httpx. Допуск (корзина токенов и слот
+EcomKassa на сессионной advisory-блокировке) идёт через соединения пула asyncpg. Счёт и чек пишутся на соединении,
+которое держит слот, поэтому запрос не ждёт второе соединение, удерживая первое. Получение токена EcomKassa
+перекрывается с записью счёта, отметка чека и журнал вызовов пишутся одновременно после освобождения слота.
+Промах кэша настроек загружается на asyncpg тем же набором колонок и разбором строки, что и в index.
+Обновление токена (отдельное соединение под advisory-блокировкой и /login) и пакет payments — целиком синхронный
+process_payment_batch с закреплённым соединением — идут в потоке (asyncio.to_thread) через синхронный пул,
+которому db оставляет долю DB_POOL_MAX.
+'''
+
+import asyncio
+import json
+import math
+import uuid
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from db import request_connection
+from aio_runtime import aio_connection, aio_flush_logs, aio_invocation, aio_request, run_query
+from admission import PAY_ADMISSION_ENABLED, PAY_INFLIGHT_RETRY_AFTER, AdmissionRejected, tenant_limits
+from ecomkassa import ECOMKASSA_AUTH_ERROR_STATUSES, ECOMKASSA_QUEUE_TIMEOUT, ECOMKASSA_QUEUE_URL
+from ecomkassa_token import get_cached_token, replace_rejected_token
+from integration_log import log_integration
+from receipt_outbox import OUTBOX_LEASE_SECONDS, OUTBOX_MAX_ATTEMPTS, retry_delay
+from settings_cache import get_cached_settings_async
+from tracing import set_span_attributes
+from index import (PAY_BATCH_MAX_ITEMS, PAY_OUTBOX_MODE, USER_SETTINGS_COLUMNS, PaymentRequest, build_callback_url,
+                   build_receipt_payload, get_user_settings, process_payment_batch, user_settings_from_row)
+
+def as_int(value: Any) -> Optional[int]:
+    return int(value) if value is not None else None
+
+async def fetch_user_settings(member_id: str) -> Optional[Dict[str, Any]]:
+    async with aio_connection() as conn:
+        row = await run_query(conn, 'fetchrow', f'SELECT {USER_SETTINGS_COLUMNS} FROM users WHERE member_id = $1',
+                              member_id)
+    return user_settings_from_row(row) if row else None
+
+async def take_tokens(member_id: str, cost: float, rate: float, burst: float) -> int:
+    async with aio_connection() as conn:
+        admitted = await run_query(conn, 'fetchval', '''
+            INSERT INTO rate_limit_buckets AS b (member_id, tokens, updated_at)
+            VALUES ($1, $2::double precision - $3::double precision, LOCALTIMESTAMP)
+            ON CONFLICT (member_id) DO UPDATE
+            SET tokens = LEAST($2, b.tokens + EXTRACT(EPOCH FROM LOCALTIMESTAMP - b.updated_at) * $4) - $3,
+                updated_at = LOCALTIMESTAMP
+            WHERE LEAST($2, b.tokens + EXTRACT(EPOCH FROM LOCALTIMESTAMP - b.updated_at) * $4::double precision)
+                  >= LEAST($3, $2)
+            RETURNING tokens
+        ''', member_id, burst, cost, rate)
+        if admitted is not None:
+            return 0
+
+        missing = await run_query(conn, 'fetchval', '''
+            SELECT LEAST($2::double precision, $3::double precision) - LEAST($3::double precision,
+                   tokens + EXTRACT(EPOCH FROM LOCALTIMESTAMP - updated_at) * $4::double precision)
+            FROM rate_limit_buckets WHERE member_id = $1
+        ''', member_id, cost, burst, rate)
+
+    missing = float(missing) if missing is not None else min(cost, burst)
+    return max(1, math.ceil(missing / rate)) if rate > 0 else 60
+
+@asynccontextmanager
+async def admit(member_id: str, settings: Dict[str, Any], wanted: int) -> AsyncIterator[Optional[Any]]:
+    if not PAY_ADMISSION_ENABLED:
+        yield None
+        return
+
+    rate, burst, max_inflight = tenant_limits(settings)
+    retry_after = await take_tokens(member_id, 1, rate, burst)
+    if retry_after:
+        raise AdmissionRejected(member_id, 'Rate limit exceeded', retry_after)
+    if not wanted:
+        yield None
+        return
+
+    lock_key = f'ecomkassa_inflight:{member_id}'
+    async with aio_connection() as conn:
+        slots = await run_query(conn, 'fetch', '''
+            SELECT slot FROM generate_series(0, $1::integer - 1) AS slot
+            WHERE pg_try_advisory_lock(hashtext($2), slot)
+            LIMIT $3
+        ''', max_inflight, lock_key, min(wanted, max_inflight))
+        if not slots:
+            raise AdmissionRejected(member_id, 'Too many concurrent payments', PAY_INFLIGHT_RETRY_AFTER)
+
+        try:
+            yield conn
+        finally:
+            try:
+                await run_query(conn, 'execute', '''
+                    SELECT pg_advisory_unlock(hashtext($1), slot) FROM unnest($2::integer[]) AS slot
+                ''', lock_key, [row[0] for row in slots])
+            except Exception as e:
+                conn.terminate()
+                print(f'Failed to release EcomKassa slots for {member_id}: {e}')
+
+async def create_bill_with_receipt(held: Optional[Any], member_id: str, payment_id: int, paysystem_id: int,
+                                   deal_id: int, external_id: str, secret: str, payload: Dict[str, Any],
+                                   leased: bool) -> Tuple[int, int]:
+    async with aio_connection(held) as conn, conn.transaction():
+        bill_id = await run_query(conn, 'fetchval', '''
+            INSERT INTO bills (member_id, payment_id, paysystem_id, deal_id, external_id, secret, status)
+            VALUES ($1, $2, $3, $4, $5, $6, 'pending')
+            RETURNING id
+        ''', member_id, as_int(payment_id), as_int(paysystem_id), as_int(deal_id), external_id, secret)
+
+        outbox_id = await run_query(conn, 'fetchval', '''
+            INSERT INTO receipt_outbox (bill_id, member_id, external_id, deal_id, payload,
+                                        status, attempts, next_attempt_at)
+            VALUES ($1, $2, $3, $4, $5, $6, $7, LOCALTIMESTAMP + make_interval(secs => $8::double precision))
+            RETURNING id
+        ''', bill_id, member_id, external_id, str(deal_id), json.dumps(payload),
+            'processing' if leased else 'pending', 1 if leased else 0, OUTBOX_LEASE_SECONDS if leased else 0)
+
+    return bill_id, outbox_id
+
+async def post_receipt(member_id: str, payload: Dict[str, Any], token: str, deal_id: str, external_id: str):
+    stats: Dict[str, Any] = {}
+    try:
+        response = await aio_request('POST', ECOMKASSA_QUEUE_URL, ECOMKASSA_QUEUE_TIMEOUT, stats,
+                                     json={**payload, 'token': token})
+    except Exception as e:
+        log_integration('ecomkassa_queue', member_id, deal_id, external_id,
+                        json.dumps(payload), '', 'error', str(e), stats)
+        raise
+
+    error_message = None if response.status_code == 200 else f'HTTP {response.status_code}'
+    log_integration('ecomkassa_queue', member_id, deal_id, external_id,
+                    json.dumps(payload), response.text, 'success' if error_message is None else 'error',
+                    error_message, stats)
+    return response
+
+async def send_receipt(member_id: str, settings: Dict[str, Any], payload: Dict[str, Any],
+                       deal_id: str, external_id: str, token: str) -> Dict[str, Any]:
+    response = await post_receipt(member_id, payload, token, deal_id, external_id)
+
+    if response.status_code in ECOMKASSA_AUTH_ERROR_STATUSES:
+        token = await asyncio.to_thread(replace_rejected_token, member_id, settings, token)
+        response = await post_receipt(member_id, payload, token, deal_id, external_id)
+
+    if response.status_code != 200:
+        raise Exception(f'EcomKassa API error: {response.text}')
+
+    return response.json()
+
+async def mark_receipt_sent(outbox_id: int, response_data: Dict[str, Any]):
+    async with aio_connection() as conn:
+        await run_query(conn, 'execute', '''
+            UPDATE receipt_outbox
+            SET status = 'sent', response_data = $1, last_error = NULL, updated_at = CURRENT_TIMESTAMP
+            WHERE id = $2
+        ''', json.dumps(response_data), outbox_id)
+
+async def mark_receipt_failed(outbox_id: int, attempts: int, error: str):
+    async with aio_connection() as conn:
+        await run_query(conn, 'execute', '''
+            UPDATE receipt_outbox
+            SET status = $1,
+                last_error = $2,
+                next_attempt_at = LOCALTIMESTAMP + make_interval(secs => $3::double precision),
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = $4
+        ''', 'dead' if attempts >= OUTBOX_MAX_ATTEMPTS else 'pending', error, retry_delay(attempts), outbox_id)
+
+def process_pinned_batch(payments: List[Any]) -> List[Dict[str, Any]]:
+    with request_connection():
+        return process_payment_batch(payments)
+
+async def process_payment(settings: Dict[str, Any], payment_request: PaymentRequest, external_id: str,
+                          bill_secret: str, callback_url: str) -> Dict[str, Any]:
+    member_id = payment_request.member_id
+    deal_id = payment_request.dealid
+
+    async with admit(member_id, settings, 0 if PAY_OUTBOX_MODE else 1) as held:
+        payload = build_receipt_payload(settings, payment_request, external_id, callback_url)
+        created = create_bill_with_receipt(held, member_id, payment_request.PAYMENT_ID, payment_request.PAYSYSTEM_ID,
+                                           deal_id, external_id, bill_secret, payload, leased=not PAY_OUTBOX_MODE)
+
+        if PAY_OUTBOX_MODE:
+            bill_id, _ = await created
+            return {
+                'statusCode': 202,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({
+                    'success': True,
+                    'queued': True,
+                    'external_id': external_id,
+                    'bill_id': bill_id
+                }),
+                'isBase64Encoded': False
+            }
+
+        token, created_ids = await asyncio.gather(asyncio.to_thread(get_cached_token, member_id, settings), created,
+                                                  return_exceptions=True)
+        if isinstance(created_ids, BaseException):
+            raise created_ids
+        bill_id, outbox_id = created_ids
+
+        error: Optional[str] = None
+        try:
+            if isinstance(token, BaseException):
+                raise token
+            ecom_response = await send_receipt(member_id, settings, payload, str(deal_id), external_id, token)
+        except Exception as e:
+            error = str(e)
+
+    if error is not None:
+        await asyncio.gather(mark_receipt_failed(outbox_id, 1, error), aio_flush_logs())
+        return {
+            'statusCode': 202,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({
+                'success': True,
+                'queued': True,
+                'error': error,
+                'external_id': external_id,
+                'bill_id': bill_id
+            }),
+            'isBase64Encoded': False
+        }
+
+    await asyncio.gather(mark_receipt_sent(outbox_id, ecom_response), aio_flush_logs())
+
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({
+            'success': True,
+            'payment_url': ecom_response.get('payment_url'),
+            'payment_id': ecom_response.get('payment_id'),
+            'external_id': external_id,
+            'bill_id': bill_id
+        }),
+        'isBase64Encoded': False
+    }
+
+async def handle_request(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    method: str = event.get('httpMethod', 'GET')
+
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Member-Id, X-Secret-Code',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': '',
+            'isBase64Encoded': False
+        }
+
+    if method != 'POST':
+        return {
+            'statusCode': 405,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Method not allowed'}),
+            'isBase64Encoded': False
+        }
+
+    try:
+        body_data = json.loads(event.get('body', '{}'))
+
+        if isinstance(body_data.get('payments'), list):
+            payments = body_data['payments']
+            if not payments or len(payments) > PAY_BATCH_MAX_ITEMS:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': f'payments must contain 1 to {PAY_BATCH_MAX_ITEMS} items'}),
+                    'isBase64Encoded': False
+                }
+
+            results = await asyncio.to_thread(process_pinned_batch, payments)
+
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({
+                    'success': all(result['success'] for result in results),
+                    'results': results
+                }),
+                'isBase64Encoded': False
+            }
+
+        member_id = body_data.get('member_id')
+        payment_id = body_data.get('PAYMENT_ID')
+        paysystem_id = body_data.get('PAYSYSTEM_ID')
+        deal_id = body_data.get('dealid')
+        secret_code = body_data.get('secret_code')
+        amount = body_data.get('amount')
+        client_email = body_data.get('client_email')
+
+        if not all([member_id, payment_id, deal_id, secret_code, amount]):
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Missing required fields'}),
+                'isBase64Encoded': False
+            }
+
+        settings = await get_cached_settings_async(member_id, get_user_settings, fetch_user_settings)
+        if not settings:
+            return {
+                'statusCode': 404,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'User settings not found'}),
+                'isBase64Encoded': False
+            }
+
+        if settings.get('secret_code') and settings['secret_code'] != secret_code:
+            return {
+                'statusCode': 403,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Invalid secret code'}),
+                'isBase64Encoded': False
+            }
+
+        external_id = f'bitrix24_payment_{uuid.uuid4().hex[:12]}'
+        bill_secret = uuid.uuid4().hex
+        set_span_attributes(member_id=member_id, external_id=external_id)
+
+        payment_request = PaymentRequest(
+            member_id=member_id,
+            PAYMENT_ID=payment_id,
+            PAYSYSTEM_ID=paysystem_id,
+            dealid=deal_id,
+            secret_code=secret_code,
+            amount=float(amount),
+            client_email=client_email
+        )
+
+        return await process_payment(settings, payment_request, external_id, bill_secret,
+                                     build_callback_url(external_id, bill_secret))
+
+    except AdmissionRejected as e:
+        set_span_attributes(admission=e.reason)
+        return {
+            'statusCode': 429,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Expose-Headers': 'Retry-After',
+                'Retry-After': str(e.retry_after)
+            },
+            'body': json.dumps({'error': e.reason, 'member_id': e.member_id, 'retry_after': e.retry_after}),
+            'isBase64Encoded': False
+        }
+
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
+
+async def async_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    request_id = getattr(context, 'request_id', None)
+    async with aio_invocation('pay', event, request_id):
+        return await handle_request(event, context)
@@ -0,0 +1,159 @@
+'''
+Работа с таблицей receipt_outbox: постановка чека в очередь в транзакции счёта,
+захват готовых к отправке записей с арендой и планирование повторов с экспоненциальной задержкой.
+Пачка захватывается одной арендой, а отправляется по частям, поэтому перед отправкой аренда продлевается
+только если запись всё ещё за этим захватом (status processing и тот же attempts); иначе её уже забрал другой воркер.
+Запись, исчерпавшая OUTBOX_MAX_ATTEMPTS попыток, переводится в статус dead.
+'''
+
+import json
+import os
+import random
+from typing import Any, Dict, List, Tuple
+
+from db import db_connection
+
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', '8'))
+OUTBOX_RETRY_BASE = float(os.environ.get('OUTBOX_RETRY_BASE', '30'))
+OUTBOX_RETRY_MAX = float(os.environ.get('OUTBOX_RETRY_MAX', '3600'))
+OUTBOX_LEASE_SECONDS = int(os.environ.get('OUTBOX_LEASE_SECONDS', '120'))
+
+def enqueue_receipt(cur, bill_id: int, member_id: str, external_id: str, deal_id: str,
+                    payload: Dict[str, Any], leased: bool = False) -> int:
+    cur.execute('''
+        INSERT INTO receipt_outbox (bill_id, member_id, external_id, deal_id, payload,
+                                    status, attempts, next_attempt_at)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, LOCALTIMESTAMP + make_interval(secs => %s))
+        RETURNING id
+    ''', (bill_id, member_id, external_id, deal_id, json.dumps(payload),
+          'processing' if leased else 'pending', 1 if leased else 0,
+          OUTBOX_LEASE_SECONDS if leased else 0))
+    return cur.fetchone()[0]
+
+def enqueue_receipts(cur, receipts: List[Tuple[int, str, str, str, Dict[str, Any]]], leased: bool = False) -> Dict[int, int]:
+    from psycopg2.extras import execute_values
+
+    rows = execute_values(cur, '''
+        INSERT INTO receipt_outbox (bill_id, member_id, external_id, deal_id, payload,
+                                    status, attempts, next_attempt_at)
+        VALUES %s
+        RETURNING bill_id, id
+    ''', [
+        (bill_id, member_id, external_id, deal_id, json.dumps(payload),
+         'processing' if leased else 'pending', 1 if leased else 0,
+         OUTBOX_LEASE_SECONDS if leased else 0)
+        for bill_id, member_id, external_id, deal_id, payload in receipts
+    ], template='(%s, %s, %s, %s, %s, %s, %s, LOCALTIMESTAMP + make_interval(secs => %s))',
+       page_size=len(receipts), fetch=True)
+    return {row[0]: row[1] for row in rows}
+
+def claim_due_receipts(limit: int) -> List[Dict[str, Any]]:
+    with db_connection() as conn:
+        cur = conn.cursor()
+
+        query = '''
+            UPDATE receipt_outbox o
+            SET status = 'processing',
+                attempts = o.attempts + 1,
+                next_attempt_at = LOCALTIMESTAMP + make_interval(secs => %s),
+                updated_at = CURRENT_TIMESTAMP
+            WHERE o.id IN (
+                SELECT id FROM receipt_outbox
+                WHERE status IN ('pending', 'processing') AND next_attempt_at <= LOCALTIMESTAMP
+                ORDER BY next_attempt_at
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING o.id, o.bill_id, o.member_id, o.external_id, o.deal_id, o.payload, o.attempts
+        '''
+        cur.execute(query, (OUTBOX_LEASE_SECONDS, limit))
+        rows = cur.fetchall()
+
+        conn.commit()
+        cur.close()
+
+    return [{
+        'id': row[0],
+        'bill_id': row[1],
+        'member_id': row[2],
+        'external_id': row[3],
+        'deal_id': row[4],
+        'payload': json.loads(row[5]),
+        'attempts': row[6]
+    } for row in rows]
+
+def renew_receipt_lease(outbox_id: int, attempts: int) -> bool:
+    with db_connection() as conn:
+        cur = conn.cursor()
+
+        query = '''
+            UPDATE receipt_outbox
+            SET next_attempt_at = LOCALTIMESTAMP + make_interval(secs => %s), updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s AND status = 'processing' AND attempts = %s
+        '''
+        cur.execute(query, (OUTBOX_LEASE_SECONDS, outbox_id, attempts))
+        renewed = cur.rowcount == 1
+
+        conn.commit()
+        cur.close()
+
+    return renewed
+
+def mark_receipt_sent(outbox_id: int, response_data: Dict[str, Any]):
+    with db_connection() as conn:
+        cur = conn.cursor()
+
+        query = '''
+            UPDATE receipt_outbox
+            SET status = 'sent', response_data = %s, last_error = NULL, updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s
+        '''
+        cur.execute(query, (json.dumps(response_data), outbox_id))
+
+        conn.commit()
+        cur.close()
+
+def mark_receipts_sent(results: List[Tuple[int, Dict[str, Any]]]):
+    from psycopg2.extras import execute_values
+
+    if not results:
+        return
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+
+        query = '''
+            UPDATE receipt_outbox o
+            SET status = 'sent', response_data = v.response_data, last_error = NULL, updated_at = CURRENT_TIMESTAMP
+            FROM (VALUES %s) AS v(id, response_data)
+            WHERE o.id = v.id
+        '''
+        execute_values(cur, query, [(outbox_id, json.dumps(response_data)) for outbox_id, response_data in results],
+                       template='(%s::bigint, %s)', page_size=len(results))
+
+        conn.commit()
+        cur.close()
+
+def retry_delay(attempts: int) -> float:
+    return random.uniform(0, min(OUTBOX_RETRY_MAX, OUTBOX_RETRY_BASE * (2 ** max(attempts - 1, 0))))
+
+def mark_receipt_failed(outbox_id: int, attempts: int, error: str) -> str:
+    status = 'dead' if attempts >= OUTBOX_MAX_ATTEMPTS else 'pending'
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+
+        query = '''
+            UPDATE receipt_outbox
+            SET status = %s,
+                last_error = %s,
+                next_attempt_at = LOCALTIMESTAMP + make_interval(secs => %s),
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s
+        '''
+        cur.execute(query, (status, error, retry_delay(attempts), outbox_id))
+
+        conn.commit()
+        cur.close()
+
+    return status
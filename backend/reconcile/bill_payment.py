@@ -0,0 +1,128 @@
+'''
+Проведение оплаты счёта: перевод bills в paid вместе с постановкой уведомлений, первая доставка
+и запись ответа в callback_ledger. Общий путь для callback от EcomKassa и сверки зависших счетов (reconcile),
+поэтому повторный callback после сверки получает тот же ответ из журнала.
+'''
+
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+from db import db_connection
+from settings_cache import get_cached_settings
+from notifications import deliver_notifications, enqueue_notifications, resolve_targets
+
+NOTIFY_INLINE_TIMEOUT = float(os.environ.get('NOTIFY_INLINE_TIMEOUT', '5'))
+
+NOTIFICATION_SETTINGS_COLUMNS = 'webhook_url, extra_webhook_urls'
+
+def notification_settings_from_row(row: Any) -> Dict[str, Any]:
+    return {
+        'webhook_url': row[0],
+        'extra_webhook_urls': row[1]
+    }
+
+def get_notification_settings(member_id: str) -> Optional[Dict[str, Any]]:
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(f'SELECT {NOTIFICATION_SETTINGS_COLUMNS} FROM users WHERE member_id = %s', (member_id,))
+        row = cur.fetchone()
+        cur.close()
+
+    return notification_settings_from_row(row) if row else None
+
+def claim_payment(bill: Dict[str, Any], external_id: str, targets: List[Dict[str, str]]) -> Optional[List[Dict[str, Any]]]:
+    with db_connection() as conn:
+        cur = conn.cursor()
+
+        query = '''
+            UPDATE bills
+            SET status = 'paid', updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s AND status = 'pending'
+            RETURNING id
+        '''
+        cur.execute(query, (bill['id'],))
+        if cur.fetchone() is None:
+            conn.rollback()
+            cur.close()
+            return None
+
+        deliveries = enqueue_notifications(cur, bill, external_id, targets)
+        conn.commit()
+        cur.close()
+
+    return deliveries
+
+def record_callback_result(external_id: str, bill_id: int, response: Dict[str, Any]) -> Dict[str, Any]:
+    with db_connection() as conn:
+        cur = conn.cursor()
+
+        query = '''
+            INSERT INTO callback_ledger (external_id, bill_id, status_code, response_body)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (external_id) DO UPDATE
+            SET status_code = EXCLUDED.status_code,
+                response_body = EXCLUDED.response_body,
+                updated_at = CURRENT_TIMESTAMP
+        '''
+        cur.execute(query, (external_id, bill_id, response['statusCode'], response['body']))
+        conn.commit()
+        cur.close()
+
+    return response
+
+def settle_payment(bill: Dict[str, Any], external_id: str) -> Dict[str, Any]:
+    notification_settings = get_cached_settings(bill['member_id'], get_notification_settings) or {}
+    targets = resolve_targets({**bill, **notification_settings})
+
+    if not targets:
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({
+                'error': 'Failed to mark payment in Bitrix24',
+                'external_id': external_id
+            }),
+            'isBase64Encoded': False
+        }
+
+    deliveries = claim_payment(bill, external_id, targets)
+
+    if deliveries is None:
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'message': 'Payment already processed'}),
+            'isBase64Encoded': False
+        }
+
+    statuses = deliver_notifications(deliveries, NOTIFY_INLINE_TIMEOUT)
+    return record_callback_result(external_id, bill['id'], settlement_response(external_id, deliveries, statuses))
+
+def settlement_response(external_id: str, deliveries: List[Dict[str, Any]], statuses: List[str]) -> Dict[str, Any]:
+    if all(status == 'delivered' for status in statuses):
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({
+                'message': 'Payment processed successfully',
+                'payment_marked': True,
+                'external_id': external_id
+            }),
+            'isBase64Encoded': False
+        }
+
+    return {
+        'statusCode': 202,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({
+            'message': 'Payment accepted, notifications scheduled for retry',
+            'payment_marked': False,
+            'external_id': external_id,
+            'deliveries': [
+                {'target_type': delivery['target_type'], 'status': status}
+                for delivery, status in zip(deliveries, statuses)
+            ]
+        }),
+        'isBase64Encoded': False
+    }
@@ -0,0 +1,178 @@
+'''
+Кэш токенов EcomKassa по (member_id, ecom_login): в памяти контейнера и в таблице users.
+Токен обновляется заранее, за ECOMKASSA_TOKEN_REFRESH_MARGIN секунд до истечения.
+Обновление однополётное: внутри контейнера через threading.Lock, между контейнерами через сессионную
+pg_try_advisory_lock на отдельном соединении из пула, а не на соединении запроса, чей commit (например, сброс журнала)
+снял бы транзакционную блокировку посреди вызова /login. Пока блокировку держит другой контейнер, остальные
+перечитывают токен из users до ECOMKASSA_TOKEN_LOCK_WAIT секунд. Если блокировку не удалось снять,
+соединение закрывается, и PostgreSQL снимает её сам.
+Вызов /login пишется в integration_logs как ecomkassa_login без пароля и токена.
+'''
+
+import json
+import os
+import time
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+from db import acquire_connection, broken_connection_errors, release_connection
+from http_client import http_post
+from integration_log import log_integration
+
+ECOMKASSA_API_URL = os.environ.get('ECOMKASSA_API_URL', 'https://api.ecomkassa.ru').rstrip('/')
+ECOMKASSA_LOGIN_URL = f'{ECOMKASSA_API_URL}/login'
+ECOMKASSA_TOKEN_TTL = int(os.environ.get('ECOMKASSA_TOKEN_TTL', '86400'))
+ECOMKASSA_TOKEN_REFRESH_MARGIN = int(os.environ.get('ECOMKASSA_TOKEN_REFRESH_MARGIN', '300'))
+ECOMKASSA_TOKEN_LOCK_WAIT = float(os.environ.get('ECOMKASSA_TOKEN_LOCK_WAIT', '15'))
+ECOMKASSA_TOKEN_LOCK_POLL = 0.2
+
+_tokens: Dict[Tuple[str, str], Tuple[str, float]] = {}
+_refresh_locks: Dict[Tuple[str, str], threading.Lock] = {}
+_refresh_locks_guard = threading.Lock()
+
+def get_ecomkassa_token(member_id: str, login: str, password: str) -> Optional[Tuple[str, int]]:
+    stats: Dict[str, Any] = {}
+    request_data = json.dumps({'login': login})
+    try:
+        response = http_post(
+            ECOMKASSA_LOGIN_URL,
+            read_timeout=10,
+            stats=stats,
+            json={'login': login, 'password': password}
+        )
+        if response.status_code == 200:
+            data = response.json()
+            token = data.get('access_token')
+            if token:
+                log_integration('ecomkassa_login', member_id, '', '', request_data,
+                                json.dumps({'expires_in': data.get('expires_in')}), 'success', None, stats)
+                return token, int(data.get('expires_in') or ECOMKASSA_TOKEN_TTL)
+        log_integration('ecomkassa_login', member_id, '', '', request_data,
+                        response.text, 'error', f'HTTP {response.status_code}', stats)
+    except Exception as e:
+        log_integration('ecomkassa_login', member_id, '', '', request_data, '', 'error', str(e), stats)
+    return None
+
+def is_token_fresh(expires_at: float) -> bool:
+    return expires_at - ECOMKASSA_TOKEN_REFRESH_MARGIN > time.time()
+
+def get_refresh_lock(key: Tuple[str, str]) -> threading.Lock:
+    with _refresh_locks_guard:
+        lock = _refresh_locks.get(key)
+        if lock is None:
+            lock = _refresh_locks[key] = threading.Lock()
+        return lock
+
+def remember_token(key: Tuple[str, str], token: str, ttl: Optional[float]) -> str:
+    expires_at = time.time() + (ttl if ttl is not None else ECOMKASSA_TOKEN_TTL)
+    _tokens[key] = (token, expires_at)
+    return token
+
+def read_stored_token(cur, member_id: str, rejected_token: Optional[str]) -> Optional[Tuple[str, float]]:
+    cur.execute('''
+        SELECT token_ecom_kassa,
+               EXTRACT(EPOCH FROM token_ecom_kassa_expires_at - LOCALTIMESTAMP)
+        FROM users WHERE member_id = %s
+    ''', (member_id,))
+    row = cur.fetchone()
+    if row and row[0] and row[0] != rejected_token and row[1] is not None \
+            and float(row[1]) > ECOMKASSA_TOKEN_REFRESH_MARGIN:
+        return row[0], float(row[1])
+    return None
+
+def try_refresh_lock(cur, lock_name: str) -> bool:
+    cur.execute('SELECT pg_try_advisory_lock(hashtext(%s))', (lock_name,))
+    return bool(cur.fetchone()[0])
+
+def fetch_and_store_token(conn, member_id: str, settings: Dict[str, Any],
+                          rejected_token: Optional[str]) -> Tuple[str, float]:
+    cur = conn.cursor()
+    stored = read_stored_token(cur, member_id, rejected_token)
+    conn.commit()
+    if stored:
+        cur.close()
+        return stored
+
+    fetched = get_ecomkassa_token(member_id, settings['ecom_login'], settings['ecom_pass'])
+    if not fetched:
+        cur.close()
+        raise Exception('Failed to get EcomKassa token')
+
+    token, ttl = fetched
+    cur.execute('''
+        UPDATE users
+        SET token_ecom_kassa = %s,
+            token_ecom_kassa_expires_at = LOCALTIMESTAMP + make_interval(secs => %s)
+        WHERE member_id = %s
+    ''', (token, ttl, member_id))
+    conn.commit()
+    cur.close()
+    return token, ttl
+
+def refresh_token(member_id: str, settings: Dict[str, Any], rejected_token: Optional[str]) -> str:
+    key = (member_id, settings['ecom_login'])
+    lock_name = f'ecomkassa_token:{member_id}'
+
+    with get_refresh_lock(key):
+        cached = _tokens.get(key)
+        if cached and cached[0] != rejected_token and is_token_fresh(cached[1]):
+            return cached[0]
+
+        conn = acquire_connection()
+        broken = False
+        try:
+            cur = conn.cursor()
+            deadline = time.monotonic() + ECOMKASSA_TOKEN_LOCK_WAIT
+            while not try_refresh_lock(cur, lock_name):
+                stored = read_stored_token(cur, member_id, rejected_token)
+                conn.commit()
+                if stored:
+                    cur.close()
+                    return remember_token(key, *stored)
+                if time.monotonic() >= deadline:
+                    cur.close()
+                    raise Exception('Timed out waiting for EcomKassa token refresh')
+                time.sleep(ECOMKASSA_TOKEN_LOCK_POLL)
+            conn.commit()
+
+            try:
+                token, ttl = fetch_and_store_token(conn, member_id, settings, rejected_token)
+            finally:
+                try:
+                    conn.rollback()
+                    cur.execute('SELECT pg_advisory_unlock(hashtext(%s))', (lock_name,))
+                    conn.commit()
+                    cur.close()
+                except Exception:
+                    broken = True
+                    raise
+        except broken_connection_errors():
+            broken = True
+            raise
+        finally:
+            release_connection(conn, broken)
+
+        return remember_token(key, token, ttl)
+
+def get_cached_token(member_id: str, settings: Dict[str, Any]) -> str:
+    key = (member_id, settings['ecom_login'])
+
+    cached = _tokens.get(key)
+    if cached and is_token_fresh(cached[1]):
+        return cached[0]
+
+    token = settings.get('token_ecom_kassa')
+    token_ttl = settings.get('token_ecom_kassa_ttl')
+    if token and token_ttl is None:
+        return remember_token(key, token, None)
+    if token and float(token_ttl) > ECOMKASSA_TOKEN_REFRESH_MARGIN:
+        return remember_token(key, token, float(token_ttl))
+
+    return refresh_token(member_id, settings, None)
+
+def replace_rejected_token(member_id: str, settings: Dict[str, Any], rejected_token: str) -> str:
+    key = (member_id, settings['ecom_login'])
+    cached = _tokens.get(key)
+    if cached and cached[0] == rejected_token:
+        _tokens.pop(key, None)
+    return refresh_token(member_id, settings, rejected_token)
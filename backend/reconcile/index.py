@@ -0,0 +1,251 @@
+'''
+Business: Сверка зависших счетов: запрашивает в EcomKassa состояние чеков по счетам без callback и проводит оплату тем же путём, что callback
+Args: event от таймера или HTTP POST с body (page_size, concurrency не больше DB_POOL_MAX - 1, max_seconds, min_age), context с request_id
+Returns: HTTP response со статистикой сверки (checked, paid, failed, waiting, no_receipt, errors)
+'''
+
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+from db import DB_SYNC_POOL_MAX, db_connection, request_connection
+from integration_log import current_request_id, log_buffer, log_integration
+from ecomkassa import fetch_receipt_report
+from bill_payment import settle_payment
+from tracing import TraceContext, current_trace_context, trace, trace_invocation
+
+RECONCILE_MIN_AGE = float(os.environ.get('RECONCILE_MIN_AGE', '900'))
+RECONCILE_PAGE_SIZE = int(os.environ.get('RECONCILE_PAGE_SIZE', '200'))
+RECONCILE_CONCURRENCY = int(os.environ.get('RECONCILE_CONCURRENCY', '4'))
+RECONCILE_MAX_SECONDS = float(os.environ.get('RECONCILE_MAX_SECONDS', '240'))
+RECONCILE_KASSA_RPS = float(os.environ.get('RECONCILE_KASSA_RPS', '5'))
+RECONCILE_RETRY_BASE = float(os.environ.get('RECONCILE_RETRY_BASE', '600'))
+RECONCILE_RETRY_MAX = float(os.environ.get('RECONCILE_RETRY_MAX', '21600'))
+
+REPORT_PAID_STATUSES = ('done',)
+REPORT_FAILED_STATUSES = ('fail',)
+
+class KassaRateLimiter:
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0
+        self.lock = threading.Lock()
+        self.next_slot: Dict[Any, float] = {}
+
+    def acquire(self, kassa_id: Any):
+        if not self.interval:
+            return
+
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(kassa_id, now))
+            self.next_slot[kassa_id] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+def fetch_stale_bills(min_age: float, after: Optional[Tuple[datetime, int]], limit: int) -> List[Dict[str, Any]]:
+    conditions = ''
+    args: List[Any] = [min_age]
+    if after:
+        conditions = 'AND (b.created_at, b.id) > (%s, %s)'
+        args.extend(after)
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+
+        query = f'''
+            SELECT b.id, b.member_id, b.payment_id, b.paysystem_id, b.deal_id, b.status, b.external_id,
+                   b.created_at, b.reconcile_attempts, o.response_data,
+                   u.ecom_kassa_id, u.ecom_login, u.ecom_pass, u.token_ecom_kassa,
+                   EXTRACT(EPOCH FROM u.token_ecom_kassa_expires_at - LOCALTIMESTAMP)
+            FROM bills b
+            JOIN users u ON u.member_id = b.member_id
+            LEFT JOIN receipt_outbox o ON o.bill_id = b.id AND o.status = 'sent'
+            WHERE b.status = 'pending' AND b.created_at < LOCALTIMESTAMP - make_interval(secs => %s)
+              AND (b.reconcile_next_at IS NULL OR b.reconcile_next_at <= LOCALTIMESTAMP)
+              {conditions}
+            ORDER BY b.created_at, b.id
+            LIMIT %s
+        '''
+        cur.execute(query, (*args, limit))
+        rows = cur.fetchall()
+        cur.close()
+
+    return [{
+        'id': row[0],
+        'member_id': row[1],
+        'payment_id': row[2],
+        'paysystem_id': row[3],
+        'deal_id': row[4],
+        'status': row[5],
+        'external_id': row[6],
+        'created_at': row[7],
+        'reconcile_attempts': row[8],
+        'receipt_uuid': (json.loads(row[9]) if row[9] else {}).get('uuid'),
+        'ecom_kassa_id': row[10],
+        'settings': {
+            'ecom_login': row[11],
+            'ecom_pass': row[12],
+            'token_ecom_kassa': row[13],
+            'token_ecom_kassa_ttl': float(row[14]) if row[14] is not None else None
+        }
+    } for row in rows]
+
+def retry_delay(attempts: int) -> float:
+    delay = min(RECONCILE_RETRY_MAX, RECONCILE_RETRY_BASE * (2 ** attempts))
+    return random.uniform(delay / 2, delay)
+
+def record_checks(results: List[Tuple[Dict[str, Any], str, Optional[str]]]):
+    from psycopg2.extras import execute_values
+
+    pending = [(bill, outcome, error) for bill, outcome, error in results if outcome != 'paid']
+    if not pending:
+        return
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+
+        query = '''
+            UPDATE bills b
+            SET status = CASE WHEN v.outcome = 'failed' THEN 'failed' ELSE b.status END,
+                reconcile_attempts = b.reconcile_attempts + 1,
+                reconcile_next_at = LOCALTIMESTAMP + make_interval(secs => v.delay),
+                reconcile_error = v.error,
+                updated_at = CURRENT_TIMESTAMP
+            FROM (VALUES %s) AS v(id, outcome, error, delay)
+            WHERE b.id = v.id AND b.status = 'pending'
+        '''
+        execute_values(cur, query, [
+            (bill['id'], outcome, error, retry_delay(bill['reconcile_attempts']))
+            for bill, outcome, error in pending
+        ], template='(%s::integer, %s, %s, %s::double precision)', page_size=len(pending))
+
+        conn.commit()
+        cur.close()
+
+def check_bill(bill: Dict[str, Any], limiter: KassaRateLimiter, request_id: Optional[str],
+               trace_context: Optional[TraceContext]) -> Tuple[Dict[str, Any], str, Optional[str]]:
+    with request_connection(), log_buffer(request_id), \
+            trace('reconcile.check_bill', parent=trace_context, external_id=bill['external_id']):
+        if not bill['receipt_uuid']:
+            return bill, 'no_receipt', 'Receipt was not accepted by EcomKassa yet'
+
+        try:
+            limiter.acquire(bill['ecom_kassa_id'])
+            report = fetch_receipt_report(bill['member_id'], bill['settings'], bill['receipt_uuid'],
+                                          str(bill['deal_id']), bill['external_id'])
+        except Exception as e:
+            return bill, 'error', str(e)
+
+        status = str(report.get('status') or '').lower()
+        if status in REPORT_FAILED_STATUSES:
+            return bill, 'failed', json.dumps(report.get('error'))[:500] if report.get('error') else 'fail'
+        if status not in REPORT_PAID_STATUSES:
+            return bill, 'waiting', None
+
+        log_integration('reconcile_paid', bill['member_id'], str(bill['deal_id']), bill['external_id'],
+                        json.dumps({'uuid': bill['receipt_uuid']}), json.dumps(report), 'processing')
+        try:
+            response = settle_payment(bill, bill['external_id'])
+        except Exception as e:
+            return bill, 'error', str(e)
+
+        if response['statusCode'] >= 500:
+            return bill, 'error', response['body']
+        return bill, 'paid', None
+
+def reconcile_bills(page_size: int, concurrency: int, max_seconds: float, min_age: float) -> Dict[str, Any]:
+    from concurrent.futures import ThreadPoolExecutor
+
+    request_id = current_request_id()
+    trace_context = current_trace_context()
+    limiter = KassaRateLimiter(RECONCILE_KASSA_RPS)
+    started = time.monotonic()
+    stats = {'pages': 0, 'checked': 0, 'paid': 0, 'failed': 0, 'waiting': 0, 'no_receipt': 0, 'errors': 0}
+    after: Optional[Tuple[datetime, int]] = None
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while time.monotonic() - started < max_seconds:
+            with request_connection():
+                bills = fetch_stale_bills(min_age, after, page_size)
+            if not bills:
+                break
+
+            after = (bills[-1]['created_at'], bills[-1]['id'])
+            results = list(executor.map(lambda bill: check_bill(bill, limiter, request_id, trace_context), bills))
+            with request_connection():
+                record_checks(results)
+
+            stats['pages'] += 1
+            stats['checked'] += len(results)
+            for _, outcome, _ in results:
+                stats['errors' if outcome == 'error' else outcome] += 1
+
+            print(json.dumps({'event': 'reconcile_page', **stats}))
+
+    stats['elapsed'] = round(time.monotonic() - started, 3)
+    return stats
+
+def handle_request(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    method: str = event.get('httpMethod', 'TIMER')
+
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': '',
+            'isBase64Encoded': False
+        }
+
+    if method not in ['POST', 'TIMER']:
+        return {
+            'statusCode': 405,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Method not allowed'}),
+            'isBase64Encoded': False
+        }
+
+    try:
+        body_data = json.loads(event.get('body') or '{}') if method == 'POST' else {}
+
+        page_size = int(body_data.get('page_size') or RECONCILE_PAGE_SIZE)
+        concurrency = min(int(body_data.get('concurrency') or RECONCILE_CONCURRENCY), max(1, DB_SYNC_POOL_MAX - 1))
+        max_seconds = float(body_data.get('max_seconds') or RECONCILE_MAX_SECONDS)
+        min_age = float(body_data.get('min_age') if body_data.get('min_age') is not None else RECONCILE_MIN_AGE)
+
+        if page_size < 1 or concurrency < 1 or max_seconds <= 0 or min_age < 0:
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'page_size, concurrency and max_seconds must be positive, min_age not negative'}),
+                'isBase64Encoded': False
+            }
+
+        result = reconcile_bills(page_size, concurrency, max_seconds, min_age)
+
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'success': True, **result}),
+            'isBase64Encoded': False
+        }
+
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    request_id = getattr(context, 'request_id', None)
+    with log_buffer(request_id), trace_invocation('reconcile', event, request_id):
+        return handle_request(event, context)
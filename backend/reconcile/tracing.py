@@ -0,0 +1,219 @@
+'''
+Лёгкая трассировка: дерево спанов на вызов функции — обработчик, ожидание пула, запросы к БД, HTTP-вызовы.
+Контекст передаётся между функциями в формате W3C traceparent: pay добавляет его в callback_url,
+callback продолжает тот же trace. Спаны копятся в памяти и пишутся в trace_spans одним INSERT
+в конце вызова; при TRACE_EXPORT_FILE дополнительно дописываются в файл строками OTLP/JSON.
+Preflight OPTIONS не трассируется, чтобы не открывать соединение с БД ради записи спана.
+Текущий trace и стек спанов хранятся в ContextVar: задачи asyncio одного потока ведут собственные ветки
+дерева, а asyncio.to_thread продолжает trace вызывающей задачи.
+'''
+
+import json
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+TRACING_ENABLED = os.environ.get('TRACING_ENABLED', 'true').lower() != 'false'
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '1'))
+TRACE_EXPORT_FILE = os.environ.get('TRACE_EXPORT_FILE', '')
+TRACE_STATEMENT_MAX = int(os.environ.get('TRACE_STATEMENT_MAX', '120'))
+
+TRACEPARENT_RE = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+TraceContext = Tuple[str, str, str]
+
+_trace: ContextVar[Optional[Dict[str, Any]]] = ContextVar('trace', default=None)
+_stack: ContextVar[Tuple[Dict[str, Any], ...]] = ContextVar('trace_stack', default=())
+_export_lock = threading.Lock()
+
+def new_id(length: int) -> str:
+    return f'{random.getrandbits(length * 4):0{length}x}'
+
+def parse_traceparent(value: Optional[str]) -> Optional[Tuple[str, str, bool]]:
+    match = TRACEPARENT_RE.match((value or '').strip().lower())
+    if not match or match.group(1) == '0' * 32 or match.group(2) == '0' * 16:
+        return None
+    return match.group(1), match.group(2), bool(int(match.group(3), 16) & 1)
+
+def traceparent_from_event(event: Dict[str, Any]) -> Optional[str]:
+    headers = event.get('headers') or {}
+    for key, value in headers.items():
+        if key.lower() == 'traceparent':
+            return value
+    return (event.get('queryStringParameters') or {}).get('traceparent')
+
+def is_tracing() -> bool:
+    state = _trace.get()
+    return bool(state and state['spans'] is not None)
+
+def current_trace_id() -> Optional[str]:
+    return _trace.get()['trace_id'] if is_tracing() else None
+
+def current_trace_context() -> Optional[TraceContext]:
+    if not is_tracing():
+        return None
+    state = _trace.get()
+    return state['trace_id'], _stack.get()[-1]['span_id'], state['service']
+
+def current_traceparent() -> Optional[str]:
+    context = current_trace_context()
+    return f'00-{context[0]}-{context[1]}-01' if context else None
+
+def set_span_attributes(**attributes: Any):
+    if is_tracing():
+        _stack.get()[-1]['attributes'].update(attributes)
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[None]:
+    if not is_tracing():
+        yield
+        return
+
+    stack = _stack.get()
+    record = {
+        'span_id': new_id(16),
+        'parent_span_id': stack[-1]['span_id'],
+        'name': name,
+        'started_at': time.time(),
+        'status': 'ok',
+        'attributes': attributes
+    }
+    token = _stack.set(stack + (record,))
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        record['status'] = 'error'
+        record['attributes']['error'] = str(e)[:500]
+        raise
+    finally:
+        record['duration_ms'] = (time.perf_counter() - started) * 1000
+        _stack.reset(token)
+        _trace.get()['spans'].append(record)
+
+@contextmanager
+def trace(name: str, traceparent: Optional[str] = None, parent: Optional[TraceContext] = None,
+          on_finish: Optional[Callable[[str, str, List[Dict[str, Any]]], None]] = None,
+          **attributes: Any) -> Iterator[None]:
+    if not TRACING_ENABLED or _trace.get() is not None:
+        with span(name, **attributes):
+            yield
+        return
+
+    incoming = parse_traceparent(traceparent)
+    service = parent[2] if parent else name
+    if parent:
+        trace_id, parent_span_id, sampled = parent[0], parent[1], True
+    elif incoming:
+        trace_id, parent_span_id, sampled = incoming
+    else:
+        trace_id, parent_span_id, sampled = new_id(32), None, random.random() < TRACE_SAMPLE_RATE
+
+    if not sampled:
+        trace_token = _trace.set({'trace_id': trace_id, 'service': service, 'spans': None})
+        try:
+            yield
+        finally:
+            _trace.reset(trace_token)
+        return
+
+    state = {'trace_id': trace_id, 'service': service, 'spans': []}
+    trace_token = _trace.set(state)
+    stack_token = _stack.set(({'span_id': parent_span_id},))
+    try:
+        with span(name, **attributes):
+            yield
+    finally:
+        _stack.reset(stack_token)
+        _trace.reset(trace_token)
+        (on_finish or flush_spans)(trace_id, service, state['spans'])
+
+@contextmanager
+def trace_invocation(name: str, event: Dict[str, Any], request_id: Optional[str] = None,
+                     on_finish: Optional[Callable[[str, str, List[Dict[str, Any]]], None]] = None) -> Iterator[None]:
+    method = event.get('httpMethod', 'TIMER')
+    if method == 'OPTIONS':
+        yield
+        return
+
+    with trace(name, traceparent=traceparent_from_event(event), on_finish=on_finish,
+               request_id=request_id, method=method):
+        yield
+
+def span_rows(trace_id: str, service: str, spans: List[Dict[str, Any]]) -> List[Tuple]:
+    return [
+        (trace_id, record['span_id'], record['parent_span_id'], service, record['name'],
+         record['started_at'], round(record['duration_ms'], 3), record['status'],
+         json.dumps(record['attributes'], default=str))
+        for record in spans
+    ]
+
+def write_spans(trace_id: str, service: str, spans: List[Dict[str, Any]]):
+    from psycopg2.extras import execute_values
+    from db import db_connection
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+
+        query = '''
+            INSERT INTO trace_spans (trace_id, span_id, parent_span_id, service, name,
+                                     started_at, duration_ms, status, attributes)
+            VALUES %s
+            ON CONFLICT (trace_id, span_id) DO NOTHING
+        '''
+        execute_values(cur, query, span_rows(trace_id, service, spans), template='(%s, %s, %s, %s, %s, to_timestamp(%s)::timestamp, %s, %s, %s)', page_size=len(spans))
+
+        conn.commit()
+        cur.close()
+
+def otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+def export_spans(trace_id: str, service: str, spans: List[Dict[str, Any]]):
+    line = json.dumps({'resourceSpans': [{
+        'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': service}}]},
+        'scopeSpans': [{
+            'scope': {'name': 'ecomkassa-api-logs'},
+            'spans': [{
+                'traceId': trace_id,
+                'spanId': record['span_id'],
+                'parentSpanId': record['parent_span_id'] or '',
+                'name': record['name'],
+                'kind': 1,
+                'startTimeUnixNano': str(int(record['started_at'] * 1e9)),
+                'endTimeUnixNano': str(int(record['started_at'] * 1e9 + record['duration_ms'] * 1e6)),
+                'attributes': [{'key': key, 'value': otlp_value(value)} for key, value in record['attributes'].items()],
+                'status': {'code': 2 if record['status'] == 'error' else 1}
+            } for record in spans]
+        }]
+    }]})
+
+    with _export_lock:
+        with open(TRACE_EXPORT_FILE, 'a') as export_file:
+            export_file.write(line + '\n')
+
+def flush_spans(trace_id: str, service: str, spans: List[Dict[str, Any]]):
+    if not spans:
+        return
+
+    try:
+        write_spans(trace_id, service, spans)
+    except Exception as e:
+        print(f'Failed to write {len(spans)} trace spans: {e}')
+
+    if TRACE_EXPORT_FILE:
+        try:
+            export_spans(trace_id, service, spans)
+        except Exception as e:
+            print(f'Failed to export {len(spans)} trace spans: {e}')
@@ -0,0 +1,271 @@
+'''
+Business: Обслуживание секций integration_logs: создание секций наперёд, удаление устаревших секций и пачечная дочистка секции по умолчанию и спанов trace_spans, пересборка словаря сжатия тел журнала
+Args: event от таймера или HTTP POST с body (retention_days не меньше LOG_RETENTION_DAYS, batch_size и max_seconds не больше настроенных), context с request_id
+Returns: HTTP response со статистикой удаления (deleted, spans_deleted, batches, done) и версией нового словаря (payload_dictionary)
+'''
+
+import json
+import os
+import time
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+from db import db_connection, request_connection
+from payload_codec import build_dictionary, decode_payload
+from tracing import trace_invocation
+
+RETENTION_DAYS = int(os.environ.get('LOG_RETENTION_DAYS', '30'))
+RETENTION_BATCH_SIZE = int(os.environ.get('LOG_RETENTION_BATCH_SIZE', '5000'))
+RETENTION_BATCH_PAUSE = float(os.environ.get('LOG_RETENTION_BATCH_PAUSE', '0.2'))
+RETENTION_MAX_SECONDS = float(os.environ.get('LOG_RETENTION_MAX_SECONDS', '240'))
+PARTITIONS_AHEAD_DAYS = int(os.environ.get('LOG_PARTITIONS_AHEAD_DAYS', '7'))
+TRACE_RETENTION_DAYS = int(os.environ.get('TRACE_RETENTION_DAYS', '7'))
+PAYLOAD_DICT_MAX_AGE_DAYS = int(os.environ.get('LOG_PAYLOAD_DICT_MAX_AGE_DAYS', '7'))
+PAYLOAD_DICT_SAMPLES_PER_MEMBER = int(os.environ.get('LOG_PAYLOAD_DICT_SAMPLES_PER_MEMBER', '3'))
+PAYLOAD_DICT_MIN_SAMPLES = int(os.environ.get('LOG_PAYLOAD_DICT_MIN_SAMPLES', '20'))
+
+def get_retention_cutoff(retention_days: int) -> datetime:
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('SELECT LOCALTIMESTAMP - make_interval(days => %s)', (retention_days,))
+        cutoff = cur.fetchone()[0]
+        cur.close()
+
+    return cutoff
+
+def ensure_log_partitions(days_ahead: int) -> List[str]:
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('SELECT ensure_integration_logs_partitions(%s)', (days_ahead,))
+        created = [row[0] for row in cur.fetchall()]
+        conn.commit()
+        cur.close()
+
+    return created
+
+def drop_expired_log_partitions(cutoff: datetime) -> List[str]:
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('SELECT drop_integration_logs_partitions(%s)', (cutoff.date(),))
+        dropped = [row[0] for row in cur.fetchall()]
+        conn.commit()
+        cur.close()
+
+    return dropped
+
+def delete_logs_batch(cutoff: datetime, batch_size: int) -> int:
+    with db_connection() as conn:
+        cur = conn.cursor()
+
+        query = '''
+            WITH batch AS (
+                SELECT id FROM integration_logs_default
+                WHERE created_at < %s
+                ORDER BY created_at
+                LIMIT %s
+            )
+            DELETE FROM integration_logs_default l
+            USING batch
+            WHERE l.id = batch.id
+        '''
+        cur.execute(query, (cutoff, batch_size))
+        deleted_count = cur.rowcount
+
+        conn.commit()
+        cur.close()
+
+    return deleted_count
+
+def delete_spans_batch(cutoff: datetime, batch_size: int) -> int:
+    with db_connection() as conn:
+        cur = conn.cursor()
+
+        query = '''
+            WITH batch AS (
+                SELECT trace_id, span_id FROM trace_spans
+                WHERE started_at < %s
+                ORDER BY started_at
+                LIMIT %s
+            )
+            DELETE FROM trace_spans s
+            USING batch
+            WHERE s.trace_id = batch.trace_id AND s.span_id = batch.span_id
+        '''
+        cur.execute(query, (cutoff, batch_size))
+        deleted_count = cur.rowcount
+
+        conn.commit()
+        cur.close()
+
+    return deleted_count
+
+def prune_old_logs(retention_days: int, batch_size: int, max_seconds: float) -> Dict[str, Any]:
+    cutoff = get_retention_cutoff(retention_days)
+    started = time.monotonic()
+
+    created_partitions = ensure_log_partitions(PARTITIONS_AHEAD_DAYS)
+    dropped_partitions = drop_expired_log_partitions(cutoff)
+
+    print(json.dumps({
+        'event': 'retention_partitions',
+        'created': created_partitions,
+        'dropped': dropped_partitions
+    }))
+
+    deleted_total = 0
+    batches = 0
+    done = False
+
+    while time.monotonic() - started < max_seconds:
+        deleted = delete_logs_batch(cutoff, batch_size)
+        deleted_total += deleted
+        batches += 1
+
+        print(json.dumps({
+            'event': 'retention_batch',
+            'batch': batches,
+            'deleted': deleted,
+            'deleted_total': deleted_total,
+            'elapsed': round(time.monotonic() - started, 3)
+        }))
+
+        if deleted < batch_size:
+            done = True
+            break
+
+        time.sleep(RETENTION_BATCH_PAUSE)
+
+    spans_cutoff = get_retention_cutoff(TRACE_RETENTION_DAYS)
+    spans_deleted = 0
+    spans_done = False
+
+    while time.monotonic() - started < max_seconds:
+        deleted = delete_spans_batch(spans_cutoff, batch_size)
+        spans_deleted += deleted
+
+        if deleted < batch_size:
+            spans_done = True
+            break
+
+        time.sleep(RETENTION_BATCH_PAUSE)
+
+    print(json.dumps({'event': 'retention_spans', 'deleted': spans_deleted, 'done': spans_done}))
+
+    return {
+        'cutoff': cutoff.isoformat(),
+        'partitions_created': created_partitions,
+        'partitions_dropped': dropped_partitions,
+        'deleted': deleted_total,
+        'spans_deleted': spans_deleted,
+        'batches': batches,
+        'done': done and spans_done,
+        'elapsed': round(time.monotonic() - started, 3)
+    }
+
+def refresh_payload_dictionary() -> Optional[int]:
+    with db_connection() as conn:
+        cur = conn.cursor()
+
+        cur.execute('''
+            SELECT 1 FROM payload_dictionaries
+            WHERE created_at >= LOCALTIMESTAMP - make_interval(days => %s)
+            LIMIT 1
+        ''', (PAYLOAD_DICT_MAX_AGE_DAYS,))
+        if cur.fetchone():
+            cur.close()
+            return None
+
+        cur.execute('''
+            SELECT request_data, request_blob, payload_codec
+            FROM (
+                SELECT request_data, request_blob, payload_codec,
+                       row_number() OVER (PARTITION BY member_id ORDER BY created_at DESC) AS member_rank
+                FROM integration_logs
+                WHERE log_type = 'ecomkassa_queue'
+                  AND created_at >= LOCALTIMESTAMP - make_interval(days => %s)
+            ) recent
+            WHERE member_rank <= %s
+        ''', (PAYLOAD_DICT_MAX_AGE_DAYS, PAYLOAD_DICT_SAMPLES_PER_MEMBER))
+        samples = [decode_payload(row[0], row[1], row[2]) for row in cur.fetchall()]
+
+        if len(samples) < PAYLOAD_DICT_MIN_SAMPLES:
+            cur.close()
+            return None
+
+        cur.execute('''
+            INSERT INTO payload_dictionaries (version, dictionary, sample_count)
+            SELECT COALESCE(MAX(version), 0) + 1, %s, %s FROM payload_dictionaries
+            ON CONFLICT (version) DO NOTHING
+            RETURNING version
+        ''', (build_dictionary(samples), len(samples)))
+        row = cur.fetchone()
+
+        conn.commit()
+        cur.close()
+
+    return row[0] if row else None
+
+def handle_request(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    method: str = event.get('httpMethod', 'TIMER')
+
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': '',
+            'isBase64Encoded': False
+        }
+
+    if method not in ['POST', 'TIMER']:
+        return {
+            'statusCode': 405,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Method not allowed'}),
+            'isBase64Encoded': False
+        }
+
+    try:
+        body_data = json.loads(event.get('body') or '{}') if method == 'POST' else {}
+
+        retention_days = int(body_data.get('retention_days') or RETENTION_DAYS)
+        batch_size = int(body_data.get('batch_size') or RETENTION_BATCH_SIZE)
+        max_seconds = float(body_data.get('max_seconds') or RETENTION_MAX_SECONDS)
+
+        if retention_days < RETENTION_DAYS or not 1 <= batch_size <= RETENTION_BATCH_SIZE \
+                or not 0 < max_seconds <= RETENTION_MAX_SECONDS:
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({
+                    'error': f'retention_days must be at least {RETENTION_DAYS}, batch_size from 1 to '
+                             f'{RETENTION_BATCH_SIZE} and max_seconds up to {RETENTION_MAX_SECONDS}'
+                }),
+                'isBase64Encoded': False
+            }
+
+        result = prune_old_logs(retention_days, batch_size, max_seconds)
+        result['payload_dictionary'] = refresh_payload_dictionary()
+
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'success': True, **result}),
+            'isBase64Encoded': False
+        }
+
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    request_id = getattr(context, 'request_id', None)
+    with request_connection(), trace_invocation('retention', event, request_id):
+        return handle_request(event, context)
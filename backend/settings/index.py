@@ -5,31 +5,27 @@ Returns: HTTP response с настройками или статусом опе
 '''
 
 import json
-import os
 import uuid
-import psycopg2
 from typing import Dict, Any, Optional
-
-def get_db_connection():
-    dsn = os.environ.get('DATABASE_URL')
-    return psycopg2.connect(dsn)
+from db import db_connection, request_connection
+from settings_cache import get_cached_settings, invalidate_settings
+from tracing import trace_invocation
 
 def get_settings(member_id: str) -> Optional[Dict[str, Any]]:
-    conn = get_db_connection()
-    cur = conn.cursor()
+    with db_connection() as conn:
+        cur = conn.cursor()
     
-    query = '''
-        SELECT id, member_id, secret_code, ecom_login, ecom_kassa_id, 
-               payment_object, payment_method, email_def_check,
-               vat_100, vat_shipment, vat_order,
-               company_email, company_sno, company_inn, company_payment_address,
-               webhook_url, created_at, updated_at
-        FROM users WHERE member_id = %s
-    '''
-    cur.execute(query, (member_id,))
-    row = cur.fetchone()
-    cur.close()
-    conn.close()
+        query = '''
+            SELECT id, member_id, secret_code, ecom_login, ecom_kassa_id, 
+                   payment_object, payment_method, email_def_check,
+                   vat_100, vat_shipment, vat_order,
+                   company_email, company_sno, company_inn, company_payment_address,
+                   webhook_url, created_at, updated_at, extra_webhook_urls
+            FROM users WHERE member_id = %s
+        '''
+        cur.execute(query, (member_id,))
+        row = cur.fetchone()
+        cur.close()
     
     if not row:
         return None
@@ -52,49 +48,50 @@ def get_settings(member_id: str) -> Optional[Dict[str, Any]]:
         'company_payment_address': row[14],
         'webhook_url': row[15],
         'created_at': row[16].isoformat() if row[16] else None,
-        'updated_at': row[17].isoformat() if row[17] else None
+        'updated_at': row[17].isoformat() if row[17] else None,
+        'extra_webhook_urls': row[18] or []
     }
 
 def create_settings(data: Dict[str, Any]) -> Dict[str, Any]:
-    conn = get_db_connection()
-    cur = conn.cursor()
+    with db_connection() as conn:
+        cur = conn.cursor()
     
-    secret_code = data.get('secret_code') or uuid.uuid4().hex
+        secret_code = data.get('secret_code') or uuid.uuid4().hex
     
-    query = '''
-        INSERT INTO users (
-            member_id, secret_code, ecom_login, ecom_pass, ecom_kassa_id,
-            payment_object, payment_method, email_def_check,
-            vat_100, vat_shipment, vat_order,
-            company_email, company_sno, company_inn, company_payment_address,
-            webhook_url
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        RETURNING id, member_id, secret_code
-    '''
+        query = '''
+            INSERT INTO users (
+                member_id, secret_code, ecom_login, ecom_pass, ecom_kassa_id,
+                payment_object, payment_method, email_def_check,
+                vat_100, vat_shipment, vat_order,
+                company_email, company_sno, company_inn, company_payment_address,
+                webhook_url, extra_webhook_urls
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            RETURNING id, member_id, secret_code
+        '''
     
-    cur.execute(query, (
-        data['member_id'],
-        secret_code,
-        data.get('ecom_login'),
-        data.get('ecom_pass'),
-        data.get('ecom_kassa_id'),
-        data.get('payment_object'),
-        data.get('payment_method'),
-        data.get('email_def_check'),
-        data.get('vat_100'),
-        data.get('vat_shipment'),
-        data.get('vat_order'),
-        data.get('company_email'),
-        data.get('company_sno'),
-        data.get('company_inn'),
-        data.get('company_payment_address'),
-        data.get('webhook_url')
-    ))
+        cur.execute(query, (
+            data['member_id'],
+            secret_code,
+            data.get('ecom_login'),
+            data.get('ecom_pass'),
+            data.get('ecom_kassa_id'),
+            data.get('payment_object'),
+            data.get('payment_method'),
+            data.get('email_def_check'),
+            data.get('vat_100'),
+            data.get('vat_shipment'),
+            data.get('vat_order'),
+            data.get('company_email'),
+            data.get('company_sno'),
+            data.get('company_inn'),
+            data.get('company_payment_address'),
+            data.get('webhook_url'),
+            data.get('extra_webhook_urls')
+        ))
     
-    row = cur.fetchone()
-    conn.commit()
-    cur.close()
-    conn.close()
+        row = cur.fetchone()
+        conn.commit()
+        cur.close()
     
     return {
         'id': row[0],
@@ -103,55 +100,63 @@ def create_settings(data: Dict[str, Any]) -> Dict[str, Any]:
     }
 
 def update_settings(member_id: str, data: Dict[str, Any]) -> bool:
-    conn = get_db_connection()
-    cur = conn.cursor()
+    with db_connection() as conn:
+        cur = conn.cursor()
     
-    query = '''
-        UPDATE users SET
-            ecom_login = COALESCE(%s, ecom_login),
-            ecom_pass = COALESCE(%s, ecom_pass),
-            ecom_kassa_id = COALESCE(%s, ecom_kassa_id),
-            payment_object = COALESCE(%s, payment_object),
-            payment_method = COALESCE(%s, payment_method),
-            email_def_check = COALESCE(%s, email_def_check),
-            vat_100 = COALESCE(%s, vat_100),
-            vat_shipment = COALESCE(%s, vat_shipment),
-            vat_order = COALESCE(%s, vat_order),
-            company_email = COALESCE(%s, company_email),
-            company_sno = COALESCE(%s, company_sno),
-            company_inn = COALESCE(%s, company_inn),
-            company_payment_address = COALESCE(%s, company_payment_address),
-            webhook_url = COALESCE(%s, webhook_url),
-            updated_at = CURRENT_TIMESTAMP
-        WHERE member_id = %s
-    '''
+        query = '''
+            UPDATE users SET
+                token_ecom_kassa = CASE
+                    WHEN ecom_login IS DISTINCT FROM COALESCE(%s, ecom_login)
+                      OR ecom_pass IS DISTINCT FROM COALESCE(%s, ecom_pass)
+                    THEN NULL ELSE token_ecom_kassa
+                END,
+                ecom_login = COALESCE(%s, ecom_login),
+                ecom_pass = COALESCE(%s, ecom_pass),
+                ecom_kassa_id = COALESCE(%s, ecom_kassa_id),
+                payment_object = COALESCE(%s, payment_object),
+                payment_method = COALESCE(%s, payment_method),
+                email_def_check = COALESCE(%s, email_def_check),
+                vat_100 = COALESCE(%s, vat_100),
+                vat_shipment = COALESCE(%s, vat_shipment),
+                vat_order = COALESCE(%s, vat_order),
+                company_email = COALESCE(%s, company_email),
+                company_sno = COALESCE(%s, company_sno),
+                company_inn = COALESCE(%s, company_inn),
+                company_payment_address = COALESCE(%s, company_payment_address),
+                webhook_url = COALESCE(%s, webhook_url),
+                extra_webhook_urls = COALESCE(%s, extra_webhook_urls),
+                updated_at = CURRENT_TIMESTAMP
+            WHERE member_id = %s
+        '''
     
-    cur.execute(query, (
-        data.get('ecom_login'),
-        data.get('ecom_pass'),
-        data.get('ecom_kassa_id'),
-        data.get('payment_object'),
-        data.get('payment_method'),
-        data.get('email_def_check'),
-        data.get('vat_100'),
-        data.get('vat_shipment'),
-        data.get('vat_order'),
-        data.get('company_email'),
-        data.get('company_sno'),
-        data.get('company_inn'),
-        data.get('company_payment_address'),
-        data.get('webhook_url'),
-        member_id
-    ))
+        cur.execute(query, (
+            data.get('ecom_login'),
+            data.get('ecom_pass'),
+            data.get('ecom_login'),
+            data.get('ecom_pass'),
+            data.get('ecom_kassa_id'),
+            data.get('payment_object'),
+            data.get('payment_method'),
+            data.get('email_def_check'),
+            data.get('vat_100'),
+            data.get('vat_shipment'),
+            data.get('vat_order'),
+            data.get('company_email'),
+            data.get('company_sno'),
+            data.get('company_inn'),
+            data.get('company_payment_address'),
+            data.get('webhook_url'),
+            data.get('extra_webhook_urls'),
+            member_id
+        ))
     
-    affected = cur.rowcount
-    conn.commit()
-    cur.close()
-    conn.close()
+        affected = cur.rowcount
+        conn.commit()
+        cur.close()
     
     return affected > 0
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+def handle_request(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
@@ -180,7 +185,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'isBase64Encoded': False
                 }
             
-            settings = get_settings(member_id)
+            settings = get_cached_settings(member_id, get_settings)
             
             if not settings:
                 return {
@@ -209,7 +214,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'isBase64Encoded': False
                 }
             
-            existing = get_settings(member_id)
+            existing = get_cached_settings(member_id, get_settings)
             if existing:
                 return {
                     'statusCode': 409,
@@ -219,6 +224,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 }
             
             result = create_settings(body_data)
+            invalidate_settings(member_id)
             
             return {
                 'statusCode': 201,
@@ -244,6 +250,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 }
             
             success = update_settings(member_id, body_data)
+            invalidate_settings(member_id)
             
             if not success:
                 return {
@@ -278,3 +285,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': json.dumps({'error': str(e)}),
             'isBase64Encoded': False
         }
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    request_id = getattr(context, 'request_id', None)
+    with request_connection(), trace_invocation('settings', event, request_id):
+        return handle_request(event, context)
@@ -0,0 +1,108 @@
+'''
+Кэш настроек портала (строки users) по member_id в памяти контейнера: TTL, вытеснение LRU
+и кэширование отсутствия настроек. Межконтейнерная инвалидация — через LISTEN settings_changed:
+триггер на users шлёт NOTIFY при любом изменении, уведомления вычитываются перед каждым чтением кэша.
+При потере слушающего соединения кэш сбрасывается целиком. Записи портала разделены по загрузчику: pay, callback
+и settings читают users разными запросами, и в одном процессе (server/serve.py) не получают чужой набор полей.
+Асинхронные обработчики читают тот же кэш через get_cached_settings_async: ключ — синхронный загрузчик,
+а промах загружает fetch на asyncpg, не занимая синхронный пул.
+'''
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+SETTINGS_CACHE_TTL = float(os.environ.get('SETTINGS_CACHE_TTL', '300'))
+SETTINGS_CACHE_NEGATIVE_TTL = float(os.environ.get('SETTINGS_CACHE_NEGATIVE_TTL', '30'))
+SETTINGS_CACHE_MAX_ENTRIES = int(os.environ.get('SETTINGS_CACHE_MAX_ENTRIES', '1000'))
+SETTINGS_CACHE_LISTEN = os.environ.get('SETTINGS_CACHE_LISTEN', 'true').lower() != 'false'
+SETTINGS_CHANNEL = 'settings_changed'
+
+_entries: 'OrderedDict[str, Dict[Callable, Tuple[Optional[Dict[str, Any]], float]]]' = OrderedDict()
+_lock = threading.Lock()
+_listener = None
+_generation = 0
+
+def open_listener():
+    import psycopg2
+
+    conn = psycopg2.connect(os.environ.get('DATABASE_URL'))
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute(f'LISTEN {SETTINGS_CHANNEL}')
+    cur.close()
+    return conn
+
+def drain_invalidations():
+    global _listener, _generation
+    if not SETTINGS_CACHE_LISTEN:
+        return
+
+    import psycopg2
+
+    try:
+        if _listener is None or _listener.closed:
+            _listener = open_listener()
+            _entries.clear()
+            _generation += 1
+            return
+
+        _listener.poll()
+        while _listener.notifies:
+            notify = _listener.notifies.pop()
+            _entries.pop(notify.payload, None)
+            _generation += 1
+    except psycopg2.Error:
+        if _listener is not None and not _listener.closed:
+            _listener.close()
+        _listener = None
+        _entries.clear()
+        _generation += 1
+
+def lookup_settings(member_id: str, loader: Callable) -> Tuple[bool, Optional[Dict[str, Any]], int]:
+    with _lock:
+        drain_invalidations()
+        cached = _entries.get(member_id, {}).get(loader)
+        if cached and cached[1] > time.monotonic():
+            _entries.move_to_end(member_id)
+            return True, cached[0], _generation
+        return False, None, _generation
+
+def store_settings(member_id: str, loader: Callable, value: Optional[Dict[str, Any]], generation: int):
+    ttl = SETTINGS_CACHE_TTL if value is not None else SETTINGS_CACHE_NEGATIVE_TTL
+
+    with _lock:
+        drain_invalidations()
+        if generation != _generation:
+            return
+        _entries.setdefault(member_id, {})[loader] = (value, time.monotonic() + ttl)
+        _entries.move_to_end(member_id)
+        while len(_entries) > SETTINGS_CACHE_MAX_ENTRIES:
+            _entries.popitem(last=False)
+
+def get_cached_settings(member_id: str, loader: Callable[[str], Optional[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+    found, value, generation = lookup_settings(member_id, loader)
+    if found:
+        return value
+
+    value = loader(member_id)
+    store_settings(member_id, loader, value, generation)
+    return value
+
+async def get_cached_settings_async(member_id: str, loader: Callable[[str], Optional[Dict[str, Any]]],
+                                    fetch: Callable[[str], Awaitable[Any]]) -> Optional[Dict[str, Any]]:
+    found, value, generation = lookup_settings(member_id, loader)
+    if found:
+        return value
+
+    value = await fetch(member_id)
+    store_settings(member_id, loader, value, generation)
+    return value
+
+def invalidate_settings(member_id: str):
+    global _generation
+    with _lock:
+        _entries.pop(member_id, None)
+        _generation += 1
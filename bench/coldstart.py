@@ -0,0 +1,123 @@
+'''
+Замер холодного старта функций backend: время импорта index, первый и тёплый вызов handler
+и какие тяжёлые модули (psycopg2, requests, asyncio, asyncpg, httpx) оказались загружены после каждого шага.
+Каждая функция запускается в отдельном чистом интерпретаторе с cwd = каталогу функции, как в облаке.
+
+    python3 bench/coldstart.py                    # все функции, preflight OPTIONS
+    python3 bench/coldstart.py pay callback --runs 5
+    python3 bench/coldstart.py pay --event event.json --json
+
+С --event первый и тёплый вызовы выполняются с заданным событием; для путей с БД нужен DATABASE_URL.
+'''
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Any, Dict, List
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+HEAVY_MODULES = ('psycopg2', 'requests', 'urllib3', 'asyncio', 'asyncpg', 'httpx')
+
+PROBE = '''
+import json, sys, time
+started = time.perf_counter()
+import index
+imported = time.perf_counter()
+after_import = [name for name in HEAVY if name in sys.modules]
+
+class Context:
+    request_id = 'coldstart'
+    function_name = FUNCTION
+
+def call():
+    begin = time.perf_counter()
+    try:
+        status = index.handler(json.loads(EVENT), Context()).get('statusCode')
+    except Exception as e:
+        status = type(e).__name__
+    return (time.perf_counter() - begin) * 1000, status
+
+first_ms, first_status = call()
+after_first = [name for name in HEAVY if name in sys.modules]
+warm_ms, warm_status = call()
+
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'first_ms': first_ms,
+    'warm_ms': warm_ms,
+    'status': [first_status, warm_status],
+    'heavy_after_import': after_import,
+    'heavy_after_first': after_first
+}))
+'''
+
+def list_functions() -> List[str]:
+    return sorted(
+        name for name in os.listdir(BACKEND_DIR)
+        if os.path.isfile(os.path.join(BACKEND_DIR, name, 'index.py'))
+    )
+
+def probe(function: str, event: Dict[str, Any]) -> Dict[str, Any]:
+    code = (f'HEAVY = {HEAVY_MODULES!r}\nFUNCTION = {function!r}\nEVENT = {json.dumps(event)!r}\n' + PROBE)
+    result = subprocess.run(
+        [sys.executable, '-c', code],
+        cwd=os.path.join(BACKEND_DIR, function),
+        capture_output=True, text=True, timeout=120
+    )
+    lines = [line for line in result.stdout.splitlines() if line.startswith('{')]
+    if result.returncode != 0 or not lines:
+        return {'error': (result.stderr.strip().splitlines() or ['no output'])[-1]}
+    return json.loads(lines[-1])
+
+def summarize(function: str, runs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    ok = [run for run in runs if 'error' not in run]
+    if not ok:
+        return {'function': function, 'error': runs[0]['error']}
+
+    return {
+        'function': function,
+        'runs': len(ok),
+        'import_ms': round(statistics.median(run['import_ms'] for run in ok), 1),
+        'first_ms': round(statistics.median(run['first_ms'] for run in ok), 1),
+        'warm_ms': round(statistics.median(run['warm_ms'] for run in ok), 2),
+        'status': ok[-1]['status'],
+        'heavy_after_import': ok[-1]['heavy_after_import'],
+        'heavy_after_first': ok[-1]['heavy_after_first']
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Cold start report for backend functions')
+    parser.add_argument('functions', nargs='*', help='function directories (default: all)')
+    parser.add_argument('--runs', type=int, default=3, help='fresh interpreters per function')
+    parser.add_argument('--event', help='JSON file with the event for the first and warm calls')
+    parser.add_argument('--json', action='store_true', help='print JSON instead of a table')
+    args = parser.parse_args()
+
+    event = {'httpMethod': 'OPTIONS', 'headers': {}, 'queryStringParameters': {}, 'body': ''}
+    if args.event:
+        with open(args.event) as event_file:
+            event = json.load(event_file)
+
+    report = [
+        summarize(function, [probe(function, event) for _ in range(args.runs)])
+        for function in args.functions or list_functions()
+    ]
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"{'function':<12} {'import ms':>10} {'first ms':>10} {'warm ms':>9}  {'status':<12} heavy modules (import / first call)")
+    for row in report:
+        if 'error' in row:
+            print(f"{row['function']:<12} error: {row['error']}")
+            continue
+        print(f"{row['function']:<12} {row['import_ms']:>10} {row['first_ms']:>10} {row['warm_ms']:>9}  "
+              f"{'/'.join(map(str, row['status'])):<12} "
+              f"{','.join(row['heavy_after_import']) or '-'} / {','.join(row['heavy_after_first']) or '-'}")
+
+if __name__ == '__main__':
+    main()
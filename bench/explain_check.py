@@ -0,0 +1,276 @@
+'''
+Проверка планов горячих запросов: засевает bills, integration_logs, очереди и trace_spans,
+делает ANALYZE и прогоняет EXPLAIN для запросов из обработчиков. Код выхода 1, если в плане
+есть Seq Scan по одной из отслеживаемых таблиц. Всё выполняется в одной транзакции
+и откатывается, поэтому проверку можно запускать на базе с данными.
+
+    python3 bench/explain_check.py --database-url postgresql://localhost/ecomkassa_bench --apply-migrations
+    python3 bench/explain_check.py --bills 50000 --logs 200000
+    python3 bench/explain_check.py --planner-choice --verbose   # без enable_seqscan = off
+
+По умолчанию последовательное сканирование запрещено (enable_seqscan = off): на засеянном объёме
+планировщик иногда честно выбирает Seq Scan, а проверяется, что подходящий индекс вообще есть.
+'''
+
+import argparse
+import json
+import os
+import sys
+from typing import Any, Dict, Iterator, List, Tuple
+
+from loadtest import apply_migrations
+
+WATCHED_TABLES = ('bills', 'users', 'callback_ledger', 'receipt_outbox', 'notification_deliveries',
+                  'trace_spans', 'integration_logs')
+SCAN_NODES = ('Seq Scan', 'Index Scan', 'Index Only Scan', 'Bitmap Heap Scan', 'Bitmap Index Scan')
+
+SEED_QUERIES = (
+    '''
+    INSERT INTO users (member_id, secret_code)
+    SELECT 'explain_member_' || g, 'explain_secret_' || g FROM generate_series(1, %(members)s) g
+    ON CONFLICT (member_id) DO NOTHING
+    ''',
+    '''
+    INSERT INTO bills (member_id, external_id, secret, payment_id, paysystem_id, deal_id, status, created_at)
+    SELECT 'explain_member_' || (g %% %(members)s + 1), 'explain_' || md5(random()::text || g),
+           md5(g::text), g, 1, g, CASE WHEN g %% 25 = 0 THEN 'pending' ELSE 'paid' END,
+           LOCALTIMESTAMP - make_interval(mins => g)
+    FROM generate_series(1, %(bills)s) g
+    ''',
+    '''
+    INSERT INTO callback_ledger (external_id, bill_id, status_code, response_body)
+    SELECT external_id, id, 200, '{"result": "ok"}' FROM bills
+    WHERE external_id LIKE 'explain_%%' AND status = 'paid' AND id %% 2 = 0
+    ''',
+    '''
+    INSERT INTO receipt_outbox (bill_id, member_id, external_id, deal_id, payload, status, next_attempt_at)
+    SELECT id, member_id, external_id, deal_id::text, '{}',
+           CASE WHEN status = 'pending' THEN 'pending' ELSE 'sent' END, created_at
+    FROM bills WHERE external_id LIKE 'explain_%%'
+    ''',
+    '''
+    INSERT INTO notification_deliveries (bill_id, member_id, external_id, deal_id, payment_id,
+                                         target_type, url, status, next_attempt_at)
+    SELECT id, member_id, external_id, deal_id, payment_id, 'bitrix24', 'https://example.test/rest/',
+           CASE WHEN id %% 50 = 0 THEN 'pending' ELSE 'delivered' END, created_at
+    FROM bills WHERE external_id LIKE 'explain_%%' AND status = 'paid'
+    ''',
+    '''
+    SELECT ensure_integration_logs_partitions(1, (LOCALTIMESTAMP - make_interval(days => %(log_days)s))::date)
+    ''',
+    '''
+    INSERT INTO integration_logs (created_at, log_type, member_id, deal_id, external_id, status, trace_id, search_keys)
+    SELECT LOCALTIMESTAMP - make_interval(secs => g * %(log_step)s), 'ecomkassa_queue',
+           'explain_member_' || (g %% %(members)s + 1), g::text, 'explain_log_' || (g / 3),
+           CASE WHEN g %% 10 = 0 THEN 'error' ELSE 'success' END,
+           CASE WHEN g %% 5 = 0 THEN md5('trace' || g) END,
+           jsonb_build_object('email', 'client' || (g %% 5000) || '@example.test', 'amount', g %% 3000,
+                              'receipt_status', CASE WHEN g %% 10 = 0 THEN 'fail' ELSE 'wait' END)
+    FROM generate_series(1, %(logs)s) g
+    ''',
+    '''
+    INSERT INTO trace_spans (trace_id, span_id, parent_span_id, service, name, started_at, duration_ms, status)
+    SELECT md5('trace' || (g / 4)), substr(md5('span' || g), 1, 16), NULL, 'pay', 'db.query',
+           LOCALTIMESTAMP - make_interval(secs => g), 1.5, 'ok'
+    FROM generate_series(1, %(spans)s) g
+    '''
+)
+
+HOT_QUERIES: Dict[str, str] = {
+    'callback.get_bill_by_external_id': '''
+        SELECT b.id, b.member_id, b.payment_id, b.paysystem_id, b.deal_id, b.status,
+               l.status_code, l.response_body
+        FROM bills b
+        LEFT JOIN callback_ledger l ON l.external_id = b.external_id
+        WHERE b.external_id = %(external_id)s AND b.secret = %(secret)s
+    ''',
+    'settings.get_user_settings': '''
+        SELECT * FROM users WHERE member_id = %(member_id)s
+    ''',
+    'outbox.claim_receipts': '''
+        UPDATE receipt_outbox o
+        SET status = 'processing', attempts = o.attempts + 1
+        WHERE o.id IN (
+            SELECT id FROM receipt_outbox
+            WHERE status IN ('pending', 'processing') AND next_attempt_at <= LOCALTIMESTAMP
+            ORDER BY next_attempt_at
+            LIMIT 50
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING o.id
+    ''',
+    'notifier.claim_deliveries': '''
+        UPDATE notification_deliveries d
+        SET status = 'processing', attempts = d.attempts + 1
+        WHERE d.id IN (
+            SELECT id FROM notification_deliveries
+            WHERE status IN ('pending', 'processing') AND next_attempt_at <= LOCALTIMESTAMP
+            ORDER BY next_attempt_at
+            LIMIT 50
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING d.id
+    ''',
+    'reconcile.fetch_stale_bills': '''
+        SELECT b.id, b.external_id, o.response_data, u.ecom_kassa_id
+        FROM bills b
+        JOIN users u ON u.member_id = b.member_id
+        LEFT JOIN receipt_outbox o ON o.bill_id = b.id AND o.status = 'sent'
+        WHERE b.status = 'pending' AND b.created_at < LOCALTIMESTAMP - make_interval(secs => 900)
+          AND (b.reconcile_next_at IS NULL OR b.reconcile_next_at <= LOCALTIMESTAMP)
+          AND (b.created_at, b.id) > (LOCALTIMESTAMP - interval '3 days', 0)
+        ORDER BY b.created_at, b.id
+        LIMIT 200
+    ''',
+    'logs.by_member_and_time': '''
+        SELECT id, created_at, log_type, status FROM integration_logs
+        WHERE member_id = %(member_id)s AND created_at >= LOCALTIMESTAMP - interval '1 day'
+          AND created_at < LOCALTIMESTAMP
+        ORDER BY created_at DESC, id DESC
+        LIMIT 51
+    ''',
+    'logs.by_member_next_page': '''
+        SELECT id, created_at, log_type, status FROM integration_logs
+        WHERE member_id = %(member_id)s AND (created_at, id) < (LOCALTIMESTAMP - interval '2 hours', 0)
+        ORDER BY created_at DESC, id DESC
+        LIMIT 51
+    ''',
+    'logs.by_external_id': '''
+        SELECT id, created_at, log_type, status FROM integration_logs
+        WHERE external_id = %(log_external_id)s
+        ORDER BY created_at DESC, id DESC
+        LIMIT 51
+    ''',
+    'logs.latest_page': '''
+        SELECT id, created_at, log_type, status FROM integration_logs
+        ORDER BY created_at DESC, id DESC
+        LIMIT 51
+    ''',
+    'logs.by_trace_id': '''
+        SELECT id, created_at, log_type, status FROM integration_logs
+        WHERE trace_id = %(trace_id)s
+        ORDER BY created_at DESC, id DESC
+        LIMIT 51
+    ''',
+    'logs.search_keys': '''
+        SELECT id, created_at, log_type, status FROM integration_logs
+        WHERE search_keys @> '{"email": "client42@example.test"}'::jsonb
+          AND created_at >= LOCALTIMESTAMP - interval '30 days'
+        ORDER BY created_at DESC, id DESC
+        LIMIT 51
+    ''',
+    'logs.search_jsonpath': '''
+        SELECT id, created_at, log_type, status FROM integration_logs
+        WHERE search_keys @? '$ ? (@.amount == 1500 && @.receipt_status == "fail")'::jsonpath
+        ORDER BY created_at DESC, id DESC
+        LIMIT 51
+    ''',
+    'logs.trace_spans': '''
+        SELECT span_id, parent_span_id, service, name, started_at, duration_ms, status
+        FROM trace_spans
+        WHERE trace_id = %(trace_id)s
+        ORDER BY started_at, span_id
+    '''
+}
+
+def seed(cur, args: argparse.Namespace) -> Dict[str, Any]:
+    log_step = 10
+    params = {
+        'members': args.members,
+        'bills': args.bills,
+        'logs': args.logs,
+        'spans': args.logs // 5,
+        'log_step': log_step,
+        'log_days': args.logs * log_step // 86400 + 1
+    }
+    for query in SEED_QUERIES:
+        cur.execute(query, params)
+
+    cur.execute('ANALYZE users, bills, callback_ledger, receipt_outbox, notification_deliveries, integration_logs, trace_spans')
+
+    cur.execute('''
+        SELECT external_id, secret, member_id FROM bills
+        WHERE external_id LIKE 'explain_%' ORDER BY id DESC LIMIT 1
+    ''')
+    external_id, secret, member_id = cur.fetchone()
+    return {
+        'external_id': external_id,
+        'secret': secret,
+        'member_id': member_id,
+        'log_external_id': 'explain_log_42',
+        'trace_id': 'abcdef' * 5 + 'ab'
+    }
+
+def walk(plan: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from walk(child)
+
+def is_watched(relation: str) -> bool:
+    return any(relation == table or relation.startswith(f'{table}_') for table in WATCHED_TABLES)
+
+def explain(cur, query: str, params: Dict[str, Any]) -> Tuple[List[str], List[str]]:
+    cur.execute(f'EXPLAIN (FORMAT JSON) {query}', params)
+    plan = cur.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    scans: List[str] = []
+    violations: List[str] = []
+    for node in walk(plan[0]['Plan']):
+        if node['Node Type'] not in SCAN_NODES:
+            continue
+        relation = node.get('Relation Name') or ''
+        target = node.get('Index Name') or relation
+        scans.append(f"{node['Node Type']} {target}")
+        if node['Node Type'] == 'Seq Scan' and is_watched(relation):
+            violations.append(relation)
+    return scans, violations
+
+def main():
+    parser = argparse.ArgumentParser(description='Fail on sequential scans in hot query plans')
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--apply-migrations', action='store_true')
+    parser.add_argument('--members', type=int, default=50)
+    parser.add_argument('--bills', type=int, default=20000)
+    parser.add_argument('--logs', type=int, default=100000)
+    parser.add_argument('--planner-choice', action='store_true', help='keep enable_seqscan on')
+    parser.add_argument('--verbose', action='store_true', help='print scan nodes for every query')
+    args = parser.parse_args()
+
+    if not args.database_url:
+        parser.error('--database-url or DATABASE_URL is required')
+    if args.apply_migrations:
+        apply_migrations(args.database_url)
+
+    import psycopg2
+
+    conn = psycopg2.connect(args.database_url)
+    cur = conn.cursor()
+    failures: Dict[str, List[str]] = {}
+    try:
+        params = seed(cur, args)
+        if not args.planner_choice:
+            cur.execute('SET LOCAL enable_seqscan = off')
+
+        for name, query in HOT_QUERIES.items():
+            scans, violations = explain(cur, query, params)
+            if violations:
+                failures[name] = violations
+            status = 'SEQ SCAN ' + ','.join(sorted(set(violations))) if violations else 'ok'
+            print(f'{name:<36} {status}')
+            if args.verbose or violations:
+                for scan in scans:
+                    print(f'    {scan}')
+    finally:
+        conn.rollback()
+        cur.close()
+        conn.close()
+
+    if failures:
+        print(f'{len(failures)} of {len(HOT_QUERIES)} hot queries use sequential scans')
+        sys.exit(1)
+    print(f'all {len(HOT_QUERIES)} hot queries use indexes')
+
+if __name__ == '__main__':
+    main()
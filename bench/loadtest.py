@@ -0,0 +1,300 @@
+'''
+Нагрузочный прогон обработчиков pay, callback и settings в одном процессе против локального Postgres
+и заглушек EcomKassa и Bitrix24 (mock_servers). Для каждого сценария печатает req/s, p50/p95/p99,
+долю ошибок и число обращений к БД на запрос (db_stats функции), сравнивает с сохранённой базой.
+
+    python3 bench/loadtest.py --database-url postgresql://localhost/ecomkassa_bench --apply-migrations
+    python3 bench/loadtest.py --requests 1000 --concurrency 16 --ecom-latency 80 --ecom-error-rate 0.02
+    python3 bench/loadtest.py --save-baseline            # записать bench/baseline.json
+    python3 bench/loadtest.py --baseline bench/baseline.json   # код выхода 1 при регрессии
+
+--apply-migrations прогоняет db_migrations/*.sql по порядку и рассчитан на пустую базу.
+'''
+
+import argparse
+import glob
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Tuple
+
+from mock_servers import Bitrix24Handler, EcomKassaHandler, MockBehavior, MockServer
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+BACKEND_DIR = os.path.join(ROOT_DIR, 'backend')
+MIGRATIONS_DIR = os.path.join(ROOT_DIR, 'db_migrations')
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+SCENARIOS = ('settings_get', 'pay', 'callback')
+
+class Context:
+    def __init__(self, function_name: str):
+        self.request_id = uuid.uuid4().hex
+        self.function_name = function_name
+
+class LoadedFunction:
+    def __init__(self, name: str):
+        self.name = name
+        self.dir = os.path.join(BACKEND_DIR, name)
+        self.local_names = {os.path.splitext(os.path.basename(path))[0] for path in glob.glob(os.path.join(self.dir, '*.py'))}
+        self.modules: Dict[str, Any] = {}
+        with self.active():
+            import index
+            self.handler = index.handler
+            self.db = sys.modules['db']
+
+    @contextmanager
+    def active(self) -> Iterator[None]:
+        for module in self.local_names:
+            sys.modules.pop(module, None)
+        sys.modules.update(self.modules)
+        sys.path.insert(0, self.dir)
+        try:
+            yield
+        finally:
+            sys.path.remove(self.dir)
+            for module in self.local_names:
+                loaded = sys.modules.pop(module, None)
+                if loaded is not None:
+                    self.modules[module] = loaded
+
+    def __call__(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        return self.handler(event, Context(self.name))
+
+def apply_migrations(database_url: str):
+    import psycopg2
+
+    conn = psycopg2.connect(database_url)
+    conn.autocommit = True
+    cur = conn.cursor()
+    for path in sorted(glob.glob(os.path.join(MIGRATIONS_DIR, 'V*.sql'))):
+        with open(path) as migration:
+            cur.execute(migration.read())
+        print(f'applied {os.path.basename(path)}')
+    cur.close()
+    conn.close()
+
+def seed_members(database_url: str, members: int, bitrix_url: str) -> List[Dict[str, str]]:
+    import psycopg2
+
+    seeded = []
+    conn = psycopg2.connect(database_url)
+    cur = conn.cursor()
+    for index in range(members):
+        member = {'member_id': f'bench_member_{index}', 'secret_code': f'bench_secret_{index}'}
+        cur.execute('''
+            INSERT INTO users (member_id, secret_code, ecom_login, ecom_pass, ecom_kassa_id,
+                               payment_object, payment_method, vat_order, company_email, company_sno,
+                               company_inn, company_payment_address, webhook_url)
+            VALUES (%s, %s, %s, 'bench', 1, 'service', 'full_prepayment', 'vat20', 'bench@example.test',
+                    'usn_income', '7707083893', 'г. Москва, ул. Тестовая, д. 1', %s)
+            ON CONFLICT (member_id) DO UPDATE
+            SET secret_code = EXCLUDED.secret_code, webhook_url = EXCLUDED.webhook_url, token_ecom_kassa = NULL
+        ''', (member['member_id'], member['secret_code'], f"bench_{index}", f'{bitrix_url}/rest/'))
+        seeded.append(member)
+    conn.commit()
+    cur.close()
+    conn.close()
+    return seeded
+
+def fetch_bill_secrets(database_url: str, external_ids: List[str]) -> List[Tuple[str, str]]:
+    import psycopg2
+
+    conn = psycopg2.connect(database_url)
+    cur = conn.cursor()
+    cur.execute('SELECT external_id, secret FROM bills WHERE external_id = ANY(%s)', (external_ids,))
+    rows = cur.fetchall()
+    cur.close()
+    conn.close()
+    return rows
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    position = (len(ordered) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+def run_scenario(function: LoadedFunction, events: List[Dict[str, Any]],
+                 concurrency: int) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    def call(event: Dict[str, Any]) -> Tuple[float, Any, Dict[str, Any]]:
+        started = time.perf_counter()
+        try:
+            response = function(event)
+            status = response.get('statusCode')
+        except Exception as e:
+            response, status = {}, type(e).__name__
+        return (time.perf_counter() - started) * 1000, status, response
+
+    with function.active():
+        db_before = function.db.db_stats()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(call, events))
+        elapsed = time.perf_counter() - started
+        db_after = function.db.db_stats()
+
+    latencies = [latency for latency, _, _ in results]
+    errors = sum(1 for _, status, _ in results if not isinstance(status, int) or status >= 500)
+    statuses: Dict[str, int] = {}
+    for _, status, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    summary = {
+        'requests': len(results),
+        'errors': errors,
+        'statuses': statuses,
+        'rps': round(len(results) / elapsed, 1) if elapsed > 0 else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50), 2),
+        'p95_ms': round(percentile(latencies, 0.95), 2),
+        'p99_ms': round(percentile(latencies, 0.99), 2),
+        'mean_ms': round(statistics.fmean(latencies), 2) if latencies else 0.0,
+        'db_queries_per_request': round((db_after['queries'] - db_before['queries']) / max(len(results), 1), 2),
+        'db_connects': db_after['connects'] - db_before['connects']
+    }
+    return summary, [response for _, _, response in results]
+
+def pay_event(member: Dict[str, str], index: int) -> Dict[str, Any]:
+    return {
+        'httpMethod': 'POST',
+        'headers': {'Content-Type': 'application/json'},
+        'queryStringParameters': {},
+        'body': json.dumps({
+            'member_id': member['member_id'],
+            'secret_code': member['secret_code'],
+            'PAYMENT_ID': 100000 + index,
+            'PAYSYSTEM_ID': 1,
+            'dealid': 200000 + index,
+            'amount': round(random.uniform(100, 10000), 2),
+            'client_email': 'client@example.test'
+        })
+    }
+
+def compare_with_baseline(report: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]],
+                          tolerance: float) -> List[str]:
+    regressions = []
+    for scenario, current in report.items():
+        base = baseline.get(scenario)
+        if not base:
+            continue
+        if current['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{scenario}: p95 {current['p95_ms']} ms vs baseline {base['p95_ms']} ms")
+        if current['rps'] < base['rps'] * (1 - tolerance):
+            regressions.append(f"{scenario}: {current['rps']} req/s vs baseline {base['rps']} req/s")
+        if current['db_queries_per_request'] > base['db_queries_per_request'] + 0.5:
+            regressions.append(f"{scenario}: {current['db_queries_per_request']} DB queries/request "
+                               f"vs baseline {base['db_queries_per_request']}")
+        if current['errors'] > base['errors'] + max(1, int(base['requests'] * tolerance * 0.1)):
+            regressions.append(f"{scenario}: {current['errors']} errors vs baseline {base['errors']}")
+    return regressions
+
+def print_report(report: Dict[str, Dict[str, Any]]):
+    print(f"{'scenario':<14} {'req':>6} {'err':>5} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'db/req':>7}  statuses")
+    for scenario, row in report.items():
+        print(f"{scenario:<14} {row['requests']:>6} {row['errors']:>5} {row['rps']:>8} {row['p50_ms']:>8} "
+              f"{row['p95_ms']:>8} {row['p99_ms']:>8} {row['db_queries_per_request']:>7}  {row['statuses']}")
+
+def main():
+    parser = argparse.ArgumentParser(description='In-process load test for pay, callback and settings')
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--apply-migrations', action='store_true')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--members', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--ecom-latency', type=float, default=50)
+    parser.add_argument('--ecom-jitter', type=float, default=10)
+    parser.add_argument('--ecom-error-rate', type=float, default=0.0)
+    parser.add_argument('--bitrix-latency', type=float, default=30)
+    parser.add_argument('--bitrix-jitter', type=float, default=10)
+    parser.add_argument('--bitrix-error-rate', type=float, default=0.0)
+    parser.add_argument('--baseline', help='baseline JSON to compare against')
+    parser.add_argument('--save-baseline', nargs='?', const=DEFAULT_BASELINE, help='write results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative slowdown before failing')
+    parser.add_argument('--json', action='store_true')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    if not args.database_url:
+        parser.error('--database-url or DATABASE_URL is required')
+    random.seed(args.seed)
+    scenarios = [name for name in args.scenarios.split(',') if name]
+
+    ecomkassa = MockServer(EcomKassaHandler, MockBehavior(args.ecom_latency, args.ecom_jitter, args.ecom_error_rate)).start()
+    bitrix = MockServer(Bitrix24Handler, MockBehavior(args.bitrix_latency, args.bitrix_jitter, args.bitrix_error_rate)).start()
+
+    os.environ['DATABASE_URL'] = args.database_url
+    os.environ['ECOMKASSA_API_URL'] = ecomkassa.url
+    os.environ.setdefault('DB_POOL_MAX', str(max(args.concurrency, 5)))
+    os.environ.setdefault('HTTP_POOL_MAXSIZE', str(max(args.concurrency, 10)))
+
+    if args.apply_migrations:
+        apply_migrations(args.database_url)
+    members = seed_members(args.database_url, args.members, bitrix.url)
+
+    functions = {name: LoadedFunction(name) for name in ('settings', 'pay', 'callback')}
+    report: Dict[str, Dict[str, Any]] = {}
+    paid: List[str] = []
+
+    try:
+        if 'settings_get' in scenarios:
+            events = [{'httpMethod': 'GET', 'queryStringParameters': {'member_id': random.choice(members)['member_id']}}
+                      for _ in range(args.warmup + args.requests)]
+            run_scenario(functions['settings'], events[:args.warmup], args.concurrency)
+            report['settings_get'], _ = run_scenario(functions['settings'], events[args.warmup:], args.concurrency)
+
+        if 'pay' in scenarios or 'callback' in scenarios:
+            events = [pay_event(random.choice(members), index) for index in range(args.warmup + args.requests)]
+            run_scenario(functions['pay'], events[:args.warmup], args.concurrency)
+            summary, responses = run_scenario(functions['pay'], events[args.warmup:], args.concurrency)
+            if 'pay' in scenarios:
+                report['pay'] = summary
+            for response in responses:
+                try:
+                    paid.append(json.loads(response.get('body') or '{}')['external_id'])
+                except (KeyError, ValueError):
+                    pass
+
+        if 'callback' in scenarios and paid:
+            events = [{'httpMethod': 'GET', 'queryStringParameters': {'external_id': external_id, 'secret': secret}}
+                      for external_id, secret in fetch_bill_secrets(args.database_url, paid)]
+            report['callback'], _ = run_scenario(functions['callback'], events, args.concurrency)
+            replay, _ = run_scenario(functions['callback'], events, args.concurrency)
+            report['callback_replay'] = replay
+    finally:
+        ecomkassa.stop()
+        bitrix.stop()
+
+    if args.json:
+        print(json.dumps({'report': report, 'mocks': {
+            'ecomkassa': ecomkassa.stats.requests, 'bitrix24': bitrix.stats.requests
+        }}, indent=2))
+    else:
+        print_report(report)
+        print(f'mock EcomKassa: {ecomkassa.stats.requests}, injected errors {ecomkassa.stats.errors}')
+        print(f'mock Bitrix24: {sum(bitrix.stats.requests.values())} requests, injected errors {bitrix.stats.errors}')
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as baseline_file:
+            json.dump(report, baseline_file, indent=2)
+        print(f'baseline written to {args.save_baseline}')
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare_with_baseline(report, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
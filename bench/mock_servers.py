@@ -0,0 +1,127 @@
+'''
+Локальные заглушки внешних API для бенчмарка: EcomKassa (/login, /api/v1/queue, /api/v1/report/<uuid>)
+и Bitrix24 (/rest/sale.paysystem.pay.payment плюс произвольные пути как пользовательские вебхуки).
+У каждого сервера настраиваются задержка (средняя и разброс) и доля ответов с ошибкой.
+'''
+
+import json
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+@dataclass
+class MockBehavior:
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    error_rate: float = 0.0
+    error_status: int = 503
+
+    def delay(self):
+        latency = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        if latency > 0:
+            time.sleep(latency / 1000)
+
+    def should_fail(self) -> bool:
+        return self.error_rate > 0 and random.random() < self.error_rate
+
+@dataclass
+class MockStats:
+    requests: Dict[str, int] = field(default_factory=dict)
+    errors: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def record(self, path: str, failed: bool):
+        with self.lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+            if failed:
+                self.errors += 1
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    behavior: MockBehavior
+    stats: MockStats
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_body(self) -> bytes:
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def send_json(self, status: int, payload: Dict):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def respond(self, method: str):
+        body = self.read_body()
+        path = self.path.split('?')[0]
+        self.behavior.delay()
+
+        failed = self.behavior.should_fail()
+        self.stats.record(path, failed)
+        if failed:
+            self.send_json(self.behavior.error_status, {'error': 'injected failure'})
+            return
+
+        status, payload = self.route(method, path, body)
+        self.send_json(status, payload)
+
+    def route(self, method: str, path: str, body: bytes) -> Tuple[int, Dict]:
+        return 200, {'result': True}
+
+    def do_GET(self):
+        self.respond('GET')
+
+    def do_POST(self):
+        self.respond('POST')
+
+class EcomKassaHandler(MockHandler):
+    def route(self, method: str, path: str, body: bytes) -> Tuple[int, Dict]:
+        if path == '/login':
+            return 200, {'access_token': uuid.uuid4().hex, 'expires_in': 86400}
+        if path == '/api/v1/queue':
+            data = json.loads(body or b'{}')
+            if not data.get('token'):
+                return 401, {'error': 'token required'}
+            return 200, {
+                'uuid': str(uuid.uuid4()),
+                'status': 'wait',
+                'payment_url': f"https://pay.example.test/{data.get('external_id')}"
+            }
+        if path.startswith('/api/v1/report/'):
+            return 200, {'uuid': path.rsplit('/', 1)[-1], 'status': 'done', 'error': None}
+        return 404, {'error': 'not found'}
+
+class Bitrix24Handler(MockHandler):
+    def route(self, method: str, path: str, body: bytes) -> Tuple[int, Dict]:
+        return 200, {'result': True, 'time': {'start': time.time()}}
+
+class MockServer:
+    def __init__(self, handler_class, behavior: Optional[MockBehavior] = None):
+        self.behavior = behavior or MockBehavior()
+        self.stats = MockStats()
+        handler = type(handler_class.__name__, (handler_class,), {'behavior': self.behavior, 'stats': self.stats})
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'MockServer':
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,117 @@
+-- Перевод integration_logs на секционирование по дням (created_at).
+-- Срок хранения соблюдается удалением целых секций вместо построчного DELETE.
+
+ALTER TABLE integration_logs RENAME TO integration_logs_legacy;
+ALTER SEQUENCE integration_logs_id_seq RENAME TO integration_logs_legacy_id_seq;
+ALTER INDEX integration_logs_pkey RENAME TO integration_logs_legacy_pkey;
+
+CREATE TABLE integration_logs (
+    id BIGSERIAL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    log_type VARCHAR(50) NOT NULL,
+    member_id VARCHAR(255),
+    deal_id VARCHAR(255),
+    external_id VARCHAR(255),
+    request_data TEXT,
+    response_data TEXT,
+    status VARCHAR(50),
+    error_message TEXT,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+-- Страховочная секция: принимает строки, для которых дневная секция ещё не создана
+CREATE TABLE integration_logs_default PARTITION OF integration_logs DEFAULT;
+
+-- Создаёт дневную секцию и переносит в неё строки, успевшие попасть в секцию по умолчанию
+CREATE OR REPLACE FUNCTION create_integration_logs_partition(p_day DATE) RETURNS TEXT AS $$
+DECLARE
+    part_name TEXT := 'integration_logs_' || to_char(p_day, 'YYYYMMDD');
+BEGIN
+    IF to_regclass(part_name) IS NOT NULL THEN
+        RETURN NULL;
+    END IF;
+
+    EXECUTE format(
+        'CREATE TABLE %I (LIKE integration_logs INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+        part_name
+    );
+    EXECUTE format(
+        'WITH moved AS (
+            DELETE FROM integration_logs_default
+            WHERE created_at >= %L AND created_at < %L
+            RETURNING *
+        ) INSERT INTO %I SELECT * FROM moved',
+        p_day, p_day + 1, part_name
+    );
+    EXECUTE format(
+        'ALTER TABLE integration_logs ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+        part_name, p_day, p_day + 1
+    );
+
+    RETURN part_name;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Гарантирует наличие секций с p_from по сегодняшний день плюс p_days_ahead дней вперёд
+CREATE OR REPLACE FUNCTION ensure_integration_logs_partitions(p_days_ahead INTEGER, p_from DATE DEFAULT CURRENT_DATE)
+RETURNS SETOF TEXT AS $$
+DECLARE
+    part_day DATE;
+    created TEXT;
+BEGIN
+    FOR part_day IN
+        SELECT generate_series(p_from, CURRENT_DATE + p_days_ahead, INTERVAL '1 day')::DATE
+    LOOP
+        created := create_integration_logs_partition(part_day);
+        IF created IS NOT NULL THEN
+            RETURN NEXT created;
+        END IF;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Отсоединяет и удаляет дневные секции, целиком лежащие раньше p_before
+CREATE OR REPLACE FUNCTION drop_integration_logs_partitions(p_before DATE) RETURNS SETOF TEXT AS $$
+DECLARE
+    part_name TEXT;
+BEGIN
+    FOR part_name IN
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'integration_logs'::regclass
+          AND c.relname ~ '^integration_logs_[0-9]{8}$'
+          AND to_date(substring(c.relname FROM 18), 'YYYYMMDD') + 1 <= p_before
+        ORDER BY c.relname
+    LOOP
+        EXECUTE format('ALTER TABLE integration_logs DETACH PARTITION %I', part_name);
+        EXECUTE format('DROP TABLE %I', part_name);
+        RETURN NEXT part_name;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT ensure_integration_logs_partitions(
+    7,
+    COALESCE((SELECT MIN(created_at)::DATE FROM integration_logs_legacy), CURRENT_DATE)
+);
+
+INSERT INTO integration_logs (id, created_at, log_type, member_id, deal_id, external_id,
+                              request_data, response_data, status, error_message)
+SELECT id, COALESCE(created_at, CURRENT_TIMESTAMP), log_type, member_id, deal_id, external_id,
+       request_data, response_data, status, error_message
+FROM integration_logs_legacy;
+
+SELECT setval(
+    pg_get_serial_sequence('integration_logs', 'id'),
+    COALESCE((SELECT MAX(id) FROM integration_logs_legacy), 0) + 1,
+    false
+);
+
+DROP TABLE integration_logs_legacy;
+
+CREATE INDEX idx_logs_created_at ON integration_logs(created_at DESC);
+CREATE INDEX idx_logs_member_id ON integration_logs(member_id);
+CREATE INDEX idx_logs_external_id ON integration_logs(external_id);
+
+COMMENT ON TABLE integration_logs IS 'Журнал обмена с EcomKassa и Bitrix24, секционирован по дням created_at';
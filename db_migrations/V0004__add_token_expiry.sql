@@ -0,0 +1,3 @@
+ALTER TABLE users ADD COLUMN IF NOT EXISTS token_ecom_kassa_expires_at TIMESTAMP;
+
+COMMENT ON COLUMN users.token_ecom_kassa_expires_at IS 'Срок действия токена EcomKassa; NULL для токена, заданного вручную';
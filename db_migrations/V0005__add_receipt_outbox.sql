@@ -0,0 +1,26 @@
+-- Очередь исходящих чеков (outbox): счёт и чек записываются в одной транзакции,
+-- отправку в EcomKassa выполняет фоновая функция outbox
+CREATE TABLE IF NOT EXISTS receipt_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    bill_id INTEGER NOT NULL REFERENCES bills(id),
+    member_id VARCHAR(255) NOT NULL,
+    external_id VARCHAR(255) NOT NULL,
+    deal_id VARCHAR(255),
+    payload TEXT NOT NULL,
+    status VARCHAR(50) NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_error TEXT,
+    response_data TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_receipt_outbox_bill_id ON receipt_outbox(bill_id);
+CREATE INDEX IF NOT EXISTS idx_receipt_outbox_due ON receipt_outbox(next_attempt_at)
+    WHERE status IN ('pending', 'processing');
+
+COMMENT ON TABLE receipt_outbox IS 'Чеки, ожидающие отправки в EcomKassa';
+COMMENT ON COLUMN receipt_outbox.payload IS 'Тело запроса /api/v1/queue без токена';
+COMMENT ON COLUMN receipt_outbox.status IS 'Статус отправки: pending, processing, sent, dead';
+COMMENT ON COLUMN receipt_outbox.next_attempt_at IS 'Время следующей попытки; для processing — окончание аренды воркером';
@@ -0,0 +1,31 @@
+-- Дополнительные адреса уведомлений об оплате для портала (помимо webhook_url)
+ALTER TABLE users ADD COLUMN IF NOT EXISTS extra_webhook_urls TEXT[];
+
+COMMENT ON COLUMN users.extra_webhook_urls IS 'Дополнительные вебхуки об оплате, {{ID}} заменяется на ID сделки';
+
+-- Доставка уведомлений об оплате в Bitrix24 и пользовательские вебхуки с расписанием повторов
+CREATE TABLE IF NOT EXISTS notification_deliveries (
+    id BIGSERIAL PRIMARY KEY,
+    bill_id INTEGER NOT NULL REFERENCES bills(id),
+    member_id VARCHAR(255) NOT NULL,
+    external_id VARCHAR(255) NOT NULL,
+    deal_id INTEGER,
+    payment_id INTEGER,
+    target_type VARCHAR(50) NOT NULL,
+    url TEXT NOT NULL,
+    status VARCHAR(50) NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_notification_deliveries_target
+    ON notification_deliveries(bill_id, target_type, url);
+CREATE INDEX IF NOT EXISTS idx_notification_deliveries_due ON notification_deliveries(next_attempt_at)
+    WHERE status IN ('pending', 'processing');
+
+COMMENT ON TABLE notification_deliveries IS 'Уведомления об оплате счёта и их доставка';
+COMMENT ON COLUMN notification_deliveries.target_type IS 'Тип получателя: bitrix24 (sale.paysystem.pay.payment) или webhook';
+COMMENT ON COLUMN notification_deliveries.status IS 'Статус доставки: pending, processing, delivered, dead';
@@ -0,0 +1,12 @@
+-- Журнал идемпотентности callback: повторный callback с тем же external_id
+-- получает сохранённый ответ без обращений к Bitrix24 и вебхукам
+CREATE TABLE IF NOT EXISTS callback_ledger (
+    external_id VARCHAR(255) PRIMARY KEY,
+    bill_id INTEGER NOT NULL REFERENCES bills(id),
+    status_code INTEGER NOT NULL,
+    response_body TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+COMMENT ON TABLE callback_ledger IS 'Результаты обработки callback EcomKassa по external_id';
@@ -0,0 +1,19 @@
+-- Уведомление кэшей настроек в контейнерах функций об изменении строки users
+CREATE OR REPLACE FUNCTION notify_settings_changed() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('settings_changed', OLD.member_id);
+        RETURN OLD;
+    END IF;
+    PERFORM pg_notify('settings_changed', NEW.member_id);
+    IF TG_OP = 'UPDATE' AND OLD.member_id IS DISTINCT FROM NEW.member_id THEN
+        PERFORM pg_notify('settings_changed', OLD.member_id);
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_users_settings_changed ON users;
+CREATE TRIGGER trg_users_settings_changed
+    AFTER INSERT OR UPDATE OR DELETE ON users
+    FOR EACH ROW EXECUTE FUNCTION notify_settings_changed();
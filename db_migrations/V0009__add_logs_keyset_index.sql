@@ -0,0 +1,3 @@
+-- Индекс под keyset-пагинацию журнала по (created_at, id) в функции logs
+CREATE INDEX IF NOT EXISTS idx_logs_created_at_id ON integration_logs(created_at DESC, id DESC);
+DROP INDEX IF EXISTS idx_logs_created_at;
@@ -0,0 +1,42 @@
+-- Длительность вызова для журнала; заполняется обработчиками, используется в агрегатах задержек
+ALTER TABLE integration_logs ADD COLUMN IF NOT EXISTS duration_ms INTEGER;
+
+-- Поэлементное сложение гистограмм задержек при слиянии агрегатов
+CREATE OR REPLACE FUNCTION int_array_add(a INTEGER[], b INTEGER[]) RETURNS INTEGER[] AS $$
+    SELECT ARRAY(
+        SELECT COALESCE(a[i], 0) + COALESCE(b[i], 0)
+        FROM generate_series(1, GREATEST(COALESCE(array_length(a, 1), 0), COALESCE(array_length(b, 1), 0))) AS i
+    )
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Поминутные и почасовые агрегаты integration_logs по типу, порталу и статусу
+CREATE TABLE IF NOT EXISTS metrics_rollup_minute (
+    bucket_start TIMESTAMP NOT NULL,
+    log_type VARCHAR(50) NOT NULL,
+    member_id VARCHAR(255) NOT NULL DEFAULT '',
+    status VARCHAR(50) NOT NULL DEFAULT '',
+    request_count INTEGER NOT NULL DEFAULT 0,
+    error_count INTEGER NOT NULL DEFAULT 0,
+    latency_count INTEGER NOT NULL DEFAULT 0,
+    latency_sum_ms BIGINT NOT NULL DEFAULT 0,
+    latency_hist INTEGER[] NOT NULL DEFAULT '{}',
+    PRIMARY KEY (bucket_start, log_type, member_id, status)
+);
+
+CREATE TABLE IF NOT EXISTS metrics_rollup_hour (LIKE metrics_rollup_minute INCLUDING ALL);
+
+CREATE INDEX IF NOT EXISTS idx_metrics_rollup_minute_member ON metrics_rollup_minute(member_id, bucket_start);
+CREATE INDEX IF NOT EXISTS idx_metrics_rollup_hour_member ON metrics_rollup_hour(member_id, bucket_start);
+
+-- Граница, до которой журнал уже свёрнут в агрегаты
+CREATE TABLE IF NOT EXISTS metrics_rollup_state (
+    id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    rolled_until TIMESTAMP NOT NULL
+);
+
+INSERT INTO metrics_rollup_state (id, rolled_until)
+VALUES (1, date_trunc('minute', LOCALTIMESTAMP))
+ON CONFLICT (id) DO NOTHING;
+
+COMMENT ON COLUMN integration_logs.duration_ms IS 'Длительность исходящего вызова, мс';
+COMMENT ON COLUMN metrics_rollup_minute.latency_hist IS 'Гистограмма задержек в логарифмических корзинах (основание 1.25), сливается поэлементным сложением';
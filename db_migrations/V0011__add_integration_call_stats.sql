@@ -0,0 +1,12 @@
+-- Измерения исходящего вызова: одна запись журнала на вызов вместо пары request/response
+ALTER TABLE integration_logs ADD COLUMN IF NOT EXISTS connect_ms INTEGER;
+ALTER TABLE integration_logs ADD COLUMN IF NOT EXISTS bytes_out INTEGER;
+ALTER TABLE integration_logs ADD COLUMN IF NOT EXISTS bytes_in INTEGER;
+ALTER TABLE integration_logs ADD COLUMN IF NOT EXISTS http_status SMALLINT;
+ALTER TABLE integration_logs ADD COLUMN IF NOT EXISTS request_id VARCHAR(64);
+
+COMMENT ON COLUMN integration_logs.connect_ms IS 'Время установки новых соединений (DNS + TCP + TLS), мс; 0 при keep-alive';
+COMMENT ON COLUMN integration_logs.bytes_out IS 'Размер тела запроса, байт';
+COMMENT ON COLUMN integration_logs.bytes_in IS 'Размер тела ответа, байт';
+COMMENT ON COLUMN integration_logs.http_status IS 'HTTP-статус ответа; NULL, если ответ не получен';
+COMMENT ON COLUMN integration_logs.request_id IS 'request_id вызова функции, в рамках которого сделан запрос';
@@ -0,0 +1,22 @@
+-- Спаны трассировки: дерево на вызов функции, pay и callback одного платежа связаны общим trace_id
+CREATE TABLE IF NOT EXISTS trace_spans (
+    trace_id CHAR(32) NOT NULL,
+    span_id CHAR(16) NOT NULL,
+    parent_span_id CHAR(16),
+    service VARCHAR(50) NOT NULL,
+    name VARCHAR(200) NOT NULL,
+    started_at TIMESTAMP NOT NULL,
+    duration_ms DOUBLE PRECISION NOT NULL,
+    status VARCHAR(10) NOT NULL,
+    attributes TEXT,
+    PRIMARY KEY (trace_id, span_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_trace_spans_started_at ON trace_spans(started_at);
+
+-- Связь записей журнала с trace
+ALTER TABLE integration_logs ADD COLUMN IF NOT EXISTS trace_id CHAR(32);
+
+COMMENT ON TABLE trace_spans IS 'Спаны трассировки обработчиков: ожидание пула, запросы к БД, HTTP-вызовы';
+COMMENT ON COLUMN trace_spans.attributes IS 'Атрибуты спана в JSON (statement, url, http_status, external_id и т.п.)';
+COMMENT ON COLUMN integration_logs.trace_id IS 'trace_id вызова, в рамках которого сделана запись';
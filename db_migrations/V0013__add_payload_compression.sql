@@ -0,0 +1,16 @@
+-- Сжатые тела журнала: длинные request_data/response_data пишутся в *_blob (zlib со словарём),
+-- текстовые колонки при этом остаются NULL
+ALTER TABLE integration_logs ADD COLUMN IF NOT EXISTS request_blob BYTEA;
+ALTER TABLE integration_logs ADD COLUMN IF NOT EXISTS response_blob BYTEA;
+ALTER TABLE integration_logs ADD COLUMN IF NOT EXISTS payload_codec VARCHAR(20);
+
+-- Словари сжатия, собранные из свежих чеков; старые версии нужны для чтения старых записей
+CREATE TABLE IF NOT EXISTS payload_dictionaries (
+    version INTEGER PRIMARY KEY,
+    dictionary BYTEA NOT NULL,
+    sample_count INTEGER NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+COMMENT ON COLUMN integration_logs.payload_codec IS 'Кодек request_blob/response_blob: zlib:<версия словаря>, 0 — без словаря';
+COMMENT ON TABLE payload_dictionaries IS 'Словари zlib для сжатия тел integration_logs';
@@ -0,0 +1,17 @@
+-- Уникальный external_id счёта: callback ищет счёт по external_id + secret,
+-- secret включён в индекс, чтобы проверка не читала лишние версии строк при совпадении external_id
+CREATE UNIQUE INDEX IF NOT EXISTS idx_bills_external_id_unique ON bills(external_id) INCLUDE (secret);
+DROP INDEX IF EXISTS idx_bills_external_id;
+
+-- Обход зависших неоплаченных счетов: в индексе только pending, он остаётся маленьким
+CREATE INDEX IF NOT EXISTS idx_bills_pending ON bills(created_at) WHERE status = 'pending';
+DROP INDEX IF EXISTS idx_bills_status;
+
+-- Журнал портала и журнал платежа с keyset-пагинацией по (created_at, id)
+CREATE INDEX IF NOT EXISTS idx_logs_member_created ON integration_logs(member_id, created_at DESC, id DESC);
+DROP INDEX IF EXISTS idx_logs_member_id;
+CREATE INDEX IF NOT EXISTS idx_logs_external_created ON integration_logs(external_id, created_at DESC, id DESC);
+DROP INDEX IF EXISTS idx_logs_external_id;
+
+-- Записи одного trace; у большинства старых записей trace_id пуст
+CREATE INDEX IF NOT EXISTS idx_logs_trace_id ON integration_logs(trace_id) WHERE trace_id IS NOT NULL;
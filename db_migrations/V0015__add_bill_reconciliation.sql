@@ -0,0 +1,12 @@
+-- Сверка зависших счетов (функция reconcile): сколько раз счёт проверяли в EcomKassa,
+-- когда проверять снова и последняя ошибка проверки
+ALTER TABLE bills ADD COLUMN IF NOT EXISTS reconcile_attempts INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE bills ADD COLUMN IF NOT EXISTS reconcile_next_at TIMESTAMP;
+ALTER TABLE bills ADD COLUMN IF NOT EXISTS reconcile_error TEXT;
+
+COMMENT ON COLUMN bills.reconcile_next_at IS 'Не проверять счёт в EcomKassa раньше этого времени';
+COMMENT ON COLUMN bills.status IS 'pending, paid или failed (EcomKassa отклонила чек, выставляет reconcile)';
+
+-- Обход зависших счетов страницами по (created_at, id)
+CREATE INDEX IF NOT EXISTS idx_bills_pending_keyset ON bills(created_at, id) WHERE status = 'pending';
+DROP INDEX IF EXISTS idx_bills_pending;
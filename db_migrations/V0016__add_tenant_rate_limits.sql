@@ -0,0 +1,15 @@
+-- Лимиты портала для pay: NULL — значения по умолчанию из PAY_RATE_LIMIT_* и PAY_MAX_INFLIGHT
+ALTER TABLE users ADD COLUMN IF NOT EXISTS rate_limit_per_minute INTEGER;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS rate_limit_burst INTEGER;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS max_inflight INTEGER;
+
+COMMENT ON COLUMN users.rate_limit_per_minute IS 'Сколько платежей в минуту принимает pay от портала';
+COMMENT ON COLUMN users.rate_limit_burst IS 'Ёмкость корзины токенов: сколько платежей можно отправить разом';
+COMMENT ON COLUMN users.max_inflight IS 'Одновременных вызовов EcomKassa от портала на все контейнеры';
+
+-- Корзина токенов на портал; обновляется одним UPSERT на запрос
+CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+    member_id VARCHAR(255) PRIMARY KEY,
+    tokens DOUBLE PRECISION NOT NULL,
+    updated_at TIMESTAMP NOT NULL
+);
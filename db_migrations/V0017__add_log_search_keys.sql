@@ -0,0 +1,8 @@
+-- Ключи поиска из тел журнала (external_id, email, inn, amount, kassa_id, receipt_uuid, receipt_status, error_code).
+-- Тела остаются сжатыми, индексируется только этот небольшой jsonb; старые записи без ключей уходят по сроку хранения
+ALTER TABLE integration_logs ADD COLUMN IF NOT EXISTS search_keys JSONB;
+
+COMMENT ON COLUMN integration_logs.search_keys IS 'Ключи для поиска по телам, заполняются при записи (payload_search)';
+
+-- jsonb_path_ops обслуживает @> и jsonpath-операторы @? / @@
+CREATE INDEX IF NOT EXISTS idx_logs_search_keys ON integration_logs USING GIN (search_keys jsonb_path_ops);
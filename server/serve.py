@@ -0,0 +1,615 @@
+'''
+Запуск функций на своих серверах без платформы: один порт, маршрут /<функция> на каждую функцию (по умолчанию
+pay, settings и callback из backend/func2url.json). HTTP-запрос переводится в event того же вида, что даёт платформа
+(httpMethod, headers, queryStringParameters, body, isBase64Encoded), ответ handler — обратно в HTTP.
+
+Модель prefork: мастер открывает сокет и держит --workers процессов, каждый обслуживает запросы пулом из --threads
+потоков. Функции импортируются в воркере после fork, поэтому пул БД (db.py), HTTP-сессия, кэши настроек и токенов
+и event loop HANDLER_ASYNC у каждого воркера свои. Функции одного воркера делят общие модули (db.py, tracing.py и др.):
+при запуске проверяется, что их копии в каталогах функций совпадают, index.py каждой функции грузится отдельно.
+
+SIGHUP — плавная перезагрузка: новые воркеры читают код с диска, и только когда все они готовы, старые получают
+SIGTERM, дообслуживают начатые запросы (не дольше --graceful-timeout) и выходят. Если новый код не загружается,
+остаются старые воркеры. SIGTERM/SIGINT — плавная остановка, упавший воркер перезапускается.
+GET /metrics отдаёт в формате Prometheus сумму по всем воркерам: запросы по функциям и статусам, гистограмму
+длительности, запросы в обработке и db_stats(); воркеры сбрасывают снимки счётчиков в --metrics-dir.
+
+    DATABASE_URL=... python3 server/serve.py --bind 0.0.0.0:8080 --workers 4 --threads 8 --pid-file serve.pid
+    kill -HUP $(cat serve.pid)
+'''
+
+import argparse
+import base64
+import glob
+import hashlib
+import importlib
+import importlib.util
+import json
+import os
+import re
+import select
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Any, Callable, Dict, List, Optional, Set
+from urllib.parse import SplitResult, parse_qsl, urlsplit
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+BACKEND_DIR = os.path.join(ROOT_DIR, 'backend')
+FUNC2URL_PATH = os.path.join(BACKEND_DIR, 'func2url.json')
+
+RESERVED_ROUTES = ('metrics',)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BOOT_ERROR_EXIT = 3
+INDEX_IMPORT_RE = re.compile(r'^\s*(from index import|import index\b)', re.MULTILINE)
+HOP_BY_HOP_HEADERS = ('connection', 'content-length', 'keep-alive', 'transfer-encoding')
+
+def default_functions() -> List[str]:
+    with open(FUNC2URL_PATH) as func2url:
+        return sorted(json.load(func2url))
+
+def function_modules(name: str) -> Dict[str, str]:
+    return {
+        os.path.splitext(os.path.basename(path))[0]: path
+        for path in sorted(glob.glob(os.path.join(BACKEND_DIR, name, '*.py')))
+    }
+
+def check_shared_modules(names: List[str]):
+    owners: Dict[str, tuple] = {}
+    for name in names:
+        for module, path in function_modules(name).items():
+            if module == 'index':
+                continue
+            with open(path, 'rb') as source:
+                digest = hashlib.sha256(source.read()).hexdigest()
+            owner = owners.setdefault(module, (name, digest))
+            if owner[1] != digest:
+                raise RuntimeError(f'{module}.py differs between {owner[0]} and {name}: '
+                                   f'shared modules must be identical copies to run in one worker')
+
+def load_functions(names: List[str]) -> Dict[str, Callable[[Dict[str, Any], Any], Dict[str, Any]]]:
+    check_shared_modules(names)
+    for name in names:
+        sys.path.insert(0, os.path.join(BACKEND_DIR, name))
+
+    handlers = {}
+    for name in names:
+        modules = function_modules(name)
+        spec = importlib.util.spec_from_file_location('index', modules['index'])
+        index = importlib.util.module_from_spec(spec)
+        sys.modules['index'] = index
+        spec.loader.exec_module(index)
+
+        for module, path in modules.items():
+            with open(path) as source:
+                if module != 'index' and INDEX_IMPORT_RE.search(source.read()):
+                    importlib.import_module(module)
+
+        sys.modules[f'{name}_index'] = index
+        handlers[name] = index.handler
+
+    sys.modules.pop('index', None)
+    return handlers
+
+def build_event(method: str, url: SplitResult, headers: Dict[str, str], body: bytes,
+                client_ip: str) -> Dict[str, Any]:
+    try:
+        text, encoded = body.decode('utf-8'), False
+    except UnicodeDecodeError:
+        text, encoded = base64.b64encode(body).decode(), True
+
+    return {
+        'httpMethod': method,
+        'path': url.path,
+        'headers': headers,
+        'queryStringParameters': dict(parse_qsl(url.query, keep_blank_values=True)),
+        'body': text,
+        'isBase64Encoded': encoded,
+        'requestContext': {'identity': {'sourceIp': client_ip}}
+    }
+
+class FunctionContext:
+    def __init__(self, request_id: str, function_name: str):
+        self.request_id = request_id
+        self.function_name = function_name
+
+class WorkerStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.requests: Dict[str, Dict[str, int]] = {}
+        self.latency: Dict[str, Dict[str, Any]] = {}
+
+    def begin(self):
+        with self.lock:
+            self.in_flight += 1
+
+    def finish(self, function: str, status: Any, seconds: float):
+        with self.lock:
+            self.in_flight -= 1
+            by_status = self.requests.setdefault(function, {})
+            by_status[str(status)] = by_status.get(str(status), 0) + 1
+
+            latency = self.latency.setdefault(function, {'buckets': [0] * len(LATENCY_BUCKETS), 'sum': 0.0, 'count': 0})
+            for position, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    latency['buckets'][position] += 1
+                    break
+            latency['sum'] += seconds
+            latency['count'] += 1
+
+    def snapshot(self, db_stats: Optional[Callable[[], Dict[str, int]]]) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                'in_flight': self.in_flight,
+                'requests': {function: dict(by_status) for function, by_status in self.requests.items()},
+                'latency': {function: {**latency, 'buckets': list(latency['buckets'])}
+                            for function, latency in self.latency.items()},
+                'db': db_stats() if db_stats else {}
+            }
+
+def merge_snapshots(snapshots: List[Dict[str, Any]]) -> Dict[str, Any]:
+    total: Dict[str, Any] = {'in_flight': 0, 'requests': {}, 'latency': {}, 'db': {}}
+    for snapshot in snapshots:
+        total['in_flight'] += snapshot.get('in_flight', 0)
+        for function, by_status in snapshot.get('requests', {}).items():
+            merged = total['requests'].setdefault(function, {})
+            for status, count in by_status.items():
+                merged[status] = merged.get(status, 0) + count
+        for function, latency in snapshot.get('latency', {}).items():
+            merged = total['latency'].setdefault(function, {'buckets': [0] * len(LATENCY_BUCKETS),
+                                                            'sum': 0.0, 'count': 0})
+            merged['buckets'] = [a + b for a, b in zip(merged['buckets'], latency['buckets'])]
+            merged['sum'] += latency['sum']
+            merged['count'] += latency['count']
+        for name, value in snapshot.get('db', {}).items():
+            total['db'][name] = total['db'].get(name, 0) + value
+    return total
+
+def snapshot_path(metrics_dir: str, pid: int) -> str:
+    return os.path.join(metrics_dir, f'worker-{pid}.json')
+
+def retired_path(metrics_dir: str) -> str:
+    return os.path.join(metrics_dir, 'retired.json')
+
+def read_snapshot(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path) as snapshot_file:
+            return json.load(snapshot_file)
+    except (OSError, ValueError):
+        return None
+
+def write_snapshot(path: str, snapshot: Dict[str, Any]):
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w') as snapshot_file:
+        json.dump(snapshot, snapshot_file)
+    os.replace(temporary, path)
+
+def render_metrics(total: Dict[str, Any], workers: int) -> str:
+    lines = [
+        '# HELP ecomkassa_server_workers Worker processes reporting metrics',
+        '# TYPE ecomkassa_server_workers gauge',
+        f'ecomkassa_server_workers {workers}',
+        '# HELP ecomkassa_http_in_flight Requests being handled right now',
+        '# TYPE ecomkassa_http_in_flight gauge',
+        f"ecomkassa_http_in_flight {total['in_flight']}",
+        '# HELP ecomkassa_http_requests_total Handled requests by function and status',
+        '# TYPE ecomkassa_http_requests_total counter'
+    ]
+    for function, by_status in sorted(total['requests'].items()):
+        for status, count in sorted(by_status.items()):
+            lines.append(f'ecomkassa_http_requests_total{{function="{function}",status="{status}"}} {count}')
+
+    lines += [
+        '# HELP ecomkassa_http_request_duration_seconds Handler duration by function',
+        '# TYPE ecomkassa_http_request_duration_seconds histogram'
+    ]
+    for function, latency in sorted(total['latency'].items()):
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, latency['buckets']):
+            cumulative += count
+            lines.append(f'ecomkassa_http_request_duration_seconds_bucket'
+                         f'{{function="{function}",le="{bound}"}} {cumulative}')
+        lines += [
+            f'ecomkassa_http_request_duration_seconds_bucket{{function="{function}",le="+Inf"}} {latency["count"]}',
+            f'ecomkassa_http_request_duration_seconds_sum{{function="{function}"}} {round(latency["sum"], 6)}',
+            f'ecomkassa_http_request_duration_seconds_count{{function="{function}"}} {latency["count"]}'
+        ]
+
+    for name, value in sorted(total['db'].items()):
+        lines += [
+            f'# HELP ecomkassa_db_{name}_total db_stats() counter {name}',
+            f'# TYPE ecomkassa_db_{name}_total counter',
+            f'ecomkassa_db_{name}_total {value}'
+        ]
+    return '\n'.join(lines) + '\n'
+
+class FunctionRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'ecomkassa-serve'
+    server: 'WorkerHTTPServer'
+
+    def log_message(self, format, *args):
+        if self.server.access_log:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        self.dispatch()
+
+    def do_POST(self):
+        self.dispatch()
+
+    def do_PUT(self):
+        self.dispatch()
+
+    def do_PATCH(self):
+        self.dispatch()
+
+    def do_DELETE(self):
+        self.dispatch()
+
+    def do_OPTIONS(self):
+        self.dispatch()
+
+    def dispatch(self):
+        url = urlsplit(self.path)
+        route = url.path.strip('/').split('/')[0]
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+        if route == 'metrics' and self.command == 'GET':
+            self.send_body(200, {'Content-Type': 'text/plain; version=0.0.4'}, self.server.render_metrics().encode())
+            return
+
+        handler = self.server.functions.get(route)
+        if handler is None:
+            self.send_body(404, {'Content-Type': 'application/json'}, json.dumps({'error': 'Not found'}).encode())
+            return
+
+        request_id = self.headers.get('X-Request-Id') or uuid.uuid4().hex
+        event = build_event(self.command, url, dict(self.headers.items()), body, self.client_address[0])
+
+        self.server.stats.begin()
+        started = time.perf_counter()
+        status: Any = 500
+        try:
+            response = handler(event, FunctionContext(request_id, route))
+            status = int(response.get('statusCode') or 200)
+        except Exception as e:
+            traceback.print_exc()
+            response = {'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'error': str(e)})}
+        finally:
+            self.server.stats.finish(route, status, time.perf_counter() - started)
+
+        body_text = response.get('body') or ''
+        if response.get('isBase64Encoded'):
+            payload = base64.b64decode(body_text)
+        else:
+            payload = body_text if isinstance(body_text, bytes) else str(body_text).encode()
+        headers = {key: str(value) for key, value in (response.get('headers') or {}).items()
+                   if key.lower() not in HOP_BY_HOP_HEADERS}
+        self.send_body(status, {**headers, 'X-Request-Id': request_id}, payload)
+
+    def send_body(self, status: int, headers: Dict[str, str], payload: bytes):
+        if self.server.stopping:
+            self.close_connection = True
+
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(payload)))
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(payload)
+
+class WorkerHTTPServer(HTTPServer):
+    def __init__(self, sock: socket.socket, functions: Dict[str, Callable], args: argparse.Namespace,
+                 db_stats: Optional[Callable[[], Dict[str, int]]]):
+        super().__init__(sock.getsockname()[:2], FunctionRequestHandler, bind_and_activate=False)
+        self.socket.close()
+        self.socket = sock
+        self.functions = functions
+        self.access_log = args.access_log
+        self.metrics_dir = args.metrics_dir
+        self.db_stats = db_stats
+        self.stats = WorkerStats()
+        self.stopping = False
+        self.executor = ThreadPoolExecutor(max_workers=args.threads, thread_name_prefix='serve')
+        FunctionRequestHandler.timeout = args.keepalive
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return self.stats.snapshot(self.db_stats)
+
+    def render_metrics(self) -> str:
+        own = snapshot_path(self.metrics_dir, os.getpid())
+        others = [read_snapshot(path) for path in glob.glob(snapshot_path(self.metrics_dir, '*')) if path != own]
+        live = [snapshot for snapshot in others if snapshot] + [self.snapshot()]
+        retired = read_snapshot(retired_path(self.metrics_dir))
+        return render_metrics(merge_snapshots(live + ([retired] if retired else [])), len(live))
+
+    def stop(self):
+        self.stopping = True
+        threading.Thread(target=self.shutdown, daemon=True).start()
+
+def report_metrics(server: WorkerHTTPServer, interval: float):
+    path = snapshot_path(server.metrics_dir, os.getpid())
+    while not server.stopping:
+        try:
+            write_snapshot(path, server.snapshot())
+        except OSError as e:
+            print(f'Failed to write metrics snapshot: {e}', file=sys.stderr)
+        time.sleep(interval)
+
+def run_worker(sock: socket.socket, args: argparse.Namespace, ready_fd: int) -> int:
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    try:
+        functions = load_functions(args.functions)
+    except Exception:
+        traceback.print_exc()
+        return BOOT_ERROR_EXIT
+
+    db = sys.modules.get('db')
+    server = WorkerHTTPServer(sock, functions, args, getattr(db, 'db_stats', None))
+    signal.signal(signal.SIGTERM, lambda *_: server.stop())
+    threading.Thread(target=report_metrics, args=(server, args.metrics_interval), daemon=True).start()
+
+    os.write(ready_fd, f'{os.getpid()}\n'.encode())
+    try:
+        server.serve_forever(poll_interval=0.5)
+    finally:
+        server.stopping = True
+        server.executor.shutdown(wait=True)
+        write_snapshot(snapshot_path(args.metrics_dir, os.getpid()), server.snapshot())
+    return 0
+
+class Master:
+    def __init__(self, sock: socket.socket, args: argparse.Namespace):
+        self.sock = sock
+        self.args = args
+        self.workers: Dict[int, int] = {}
+        self.ready: Set[int] = set()
+        self.deadlines: Dict[int, float] = {}
+        self.generation = 0
+        self.pending: Optional[int] = None
+        self.next_generation = 1
+        self.reload_requested = False
+        self.stopping = False
+        self.ready_r, self.ready_w = os.pipe()
+        os.set_blocking(self.ready_r, False)
+
+    def spawn(self, generation: int):
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                os.close(self.ready_r)
+                code = run_worker(self.sock, self.args, self.ready_w)
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                os._exit(code)
+        self.workers[pid] = generation
+
+    def terminate(self, pid: int):
+        if pid in self.deadlines:
+            return
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            return
+        self.deadlines[pid] = time.monotonic() + self.args.graceful_timeout
+
+    def kill_overdue(self):
+        now = time.monotonic()
+        for pid, deadline in list(self.deadlines.items()):
+            if deadline < now and pid in self.workers:
+                print(f'worker {pid} did not stop in {self.args.graceful_timeout}s, killing', file=sys.stderr)
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                self.deadlines[pid] = float('inf')
+
+    def read_ready(self, timeout: float):
+        readable, _, _ = select.select([self.ready_r], [], [], timeout)
+        if not readable:
+            return
+        try:
+            data = os.read(self.ready_r, 4096)
+        except BlockingIOError:
+            return
+        self.ready.update(int(pid) for pid in data.split())
+
+    def retire_metrics(self, pid: int):
+        path = snapshot_path(self.args.metrics_dir, pid)
+        snapshot = read_snapshot(path)
+        if snapshot:
+            retired = read_snapshot(retired_path(self.args.metrics_dir)) or {}
+            merged = merge_snapshots([retired, {**snapshot, 'in_flight': 0}])
+            write_snapshot(retired_path(self.args.metrics_dir), merged)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def reap(self) -> Optional[int]:
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return None
+            if pid == 0:
+                return None
+
+            generation = self.workers.pop(pid, None)
+            was_ready = pid in self.ready
+            self.ready.discard(pid)
+            self.deadlines.pop(pid, None)
+            self.retire_metrics(pid)
+            if self.stopping or generation is None:
+                continue
+
+            exit_code = os.waitstatus_to_exitcode(status)
+            if generation == self.pending and exit_code == BOOT_ERROR_EXIT:
+                print('reload failed: new workers could not load the functions, keeping the old ones', file=sys.stderr)
+                for other, other_generation in list(self.workers.items()):
+                    if other_generation == self.pending:
+                        self.terminate(other)
+                self.pending = None
+                continue
+            if generation != self.generation:
+                continue
+            if exit_code == BOOT_ERROR_EXIT and not any(self.workers[other] == self.generation and other in self.ready
+                                                        for other in self.workers):
+                print('workers could not load the functions, stopping', file=sys.stderr)
+                return BOOT_ERROR_EXIT
+
+            print(f'worker {pid} exited with code {exit_code}{"" if was_ready else " before start"}, restarting',
+                  file=sys.stderr)
+            if not was_ready:
+                time.sleep(1)
+            self.spawn(self.generation)
+
+    def start_reload(self):
+        self.reload_requested = False
+        if self.pending is not None:
+            return
+        self.pending = self.next_generation
+        self.next_generation += 1
+        print(f'reloading: starting {self.args.workers} workers', file=sys.stderr)
+        for _ in range(self.args.workers):
+            self.spawn(self.pending)
+
+    def promote(self):
+        if self.pending is None:
+            return
+        ready = [pid for pid, generation in self.workers.items() if generation == self.pending and pid in self.ready]
+        if len(ready) < self.args.workers:
+            return
+
+        self.generation, self.pending = self.pending, None
+        for pid, generation in list(self.workers.items()):
+            if generation != self.generation:
+                self.terminate(pid)
+        print('reload complete', file=sys.stderr)
+
+    def stop_workers(self):
+        for pid in list(self.workers):
+            self.terminate(pid)
+        while self.workers:
+            self.read_ready(0.2)
+            self.reap()
+            self.kill_overdue()
+
+    def request_stop(self, *_):
+        self.stopping = True
+
+    def request_reload(self, *_):
+        self.reload_requested = True
+
+    def run(self) -> int:
+        signal.signal(signal.SIGTERM, self.request_stop)
+        signal.signal(signal.SIGINT, self.request_stop)
+        signal.signal(signal.SIGHUP, self.request_reload)
+
+        for _ in range(self.args.workers):
+            self.spawn(self.generation)
+
+        code = 0
+        while not self.stopping:
+            self.read_ready(0.5)
+            code = self.reap() or 0
+            if code:
+                break
+            if self.reload_requested:
+                self.start_reload()
+            self.promote()
+            self.kill_overdue()
+
+        self.stopping = True
+        self.stop_workers()
+        return code
+
+def parse_bind(value: str) -> tuple:
+    host, _, port = value.rpartition(':')
+    return host or '0.0.0.0', int(port)
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve backend functions over HTTP with prefork workers')
+    parser.add_argument('--bind', default=os.environ.get('SERVE_BIND', '0.0.0.0:8080'), help='host:port')
+    parser.add_argument('--functions', default=','.join(default_functions()),
+                        help='comma separated functions to mount at /<name> (default: backend/func2url.json)')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('SERVE_WORKERS', os.cpu_count() or 1)))
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('SERVE_THREADS', '8')),
+                        help='concurrent requests per worker')
+    parser.add_argument('--backlog', type=int, default=1024)
+    parser.add_argument('--keepalive', type=float, default=5, help='idle keep-alive timeout, seconds')
+    parser.add_argument('--graceful-timeout', type=float, default=30,
+                        help='seconds a stopping worker may spend finishing requests')
+    parser.add_argument('--metrics-dir', help='directory for per-worker metrics snapshots (default: temporary)')
+    parser.add_argument('--metrics-interval', type=float, default=1, help='seconds between metrics snapshots')
+    parser.add_argument('--pid-file')
+    parser.add_argument('--access-log', action='store_true')
+    args = parser.parse_args()
+
+    args.functions = [name for name in args.functions.split(',') if name]
+    for name in args.functions:
+        if name in RESERVED_ROUTES:
+            parser.error(f'/{name} is reserved by the server')
+        if not os.path.isfile(os.path.join(BACKEND_DIR, name, 'index.py')):
+            parser.error(f'unknown function {name}')
+    if args.workers < 1 or args.threads < 1:
+        parser.error('--workers and --threads must be positive')
+    try:
+        check_shared_modules(args.functions)
+    except RuntimeError as e:
+        parser.error(str(e))
+
+    os.environ.setdefault('DB_POOL_MAX', str(max(args.threads, 5)))
+    os.environ.setdefault('HTTP_POOL_MAXSIZE', str(max(args.threads, 10)))
+
+    temporary_metrics = args.metrics_dir is None
+    if temporary_metrics:
+        args.metrics_dir = tempfile.mkdtemp(prefix='ecomkassa-serve-')
+    os.makedirs(args.metrics_dir, exist_ok=True)
+
+    sock = socket.create_server(parse_bind(args.bind), backlog=args.backlog)
+    sock.setblocking(False)
+    if args.pid_file:
+        with open(args.pid_file, 'w') as pid_file:
+            pid_file.write(f'{os.getpid()}\n')
+
+    host, port = sock.getsockname()[:2]
+    print(f"serving {', '.join('/' + name for name in args.functions)} and /metrics on http://{host}:{port} "
+          f'with {args.workers} workers x {args.threads} threads', file=sys.stderr)
+    try:
+        code = Master(sock, args).run()
+    finally:
+        sock.close()
+        if args.pid_file and os.path.exists(args.pid_file):
+            os.remove(args.pid_file)
+        if temporary_metrics:
+            shutil.rmtree(args.metrics_dir, ignore_errors=True)
+    sys.exit(code)
+
+if __name__ == '__main__':
+    main()
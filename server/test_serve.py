@@ -0,0 +1,82 @@
+'''
+Проверки server/serve.py без БД: функции загружаются в один процесс так же, как в воркере,
+загрузчики настроек подменяются заглушками с формой строк каждой функции.
+
+    python3 -m unittest discover server
+'''
+
+import os
+import sys
+import unittest
+from urllib.parse import urlsplit
+
+os.environ['SETTINGS_CACHE_LISTEN'] = 'false'
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from serve import WorkerStats, build_event, load_functions, merge_snapshots, render_metrics
+
+MEMBER_ID = 'portal-1'
+PAY_SETTINGS = {'company_email': 'shop@example.com', 'ecom_pass': 'secret', 'token_ecom_kassa': 'token'}
+NOTIFICATION_SETTINGS = {'webhook_url': 'https://example.com/hook', 'extra_webhook_urls': []}
+PUBLIC_SETTINGS = {'member_id': MEMBER_ID, 'company_email': 'shop@example.com'}
+
+class SharedWorkerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.handlers = load_functions(['pay', 'callback', 'settings'])
+        cls.pay = sys.modules['pay_index']
+        cls.settings = sys.modules['settings_index']
+        cls.bill_payment = sys.modules['bill_payment']
+        cls.cache = sys.modules['settings_cache']
+
+        cls.pay.get_user_settings = lambda member_id: dict(PAY_SETTINGS)
+        cls.bill_payment.get_notification_settings = lambda member_id: dict(NOTIFICATION_SETTINGS)
+        cls.settings.get_settings = lambda member_id: dict(PUBLIC_SETTINGS)
+
+    def setUp(self):
+        self.cache.invalidate_settings(MEMBER_ID)
+
+    def test_functions_share_one_settings_cache(self):
+        self.assertIs(self.pay.get_cached_settings, self.cache.get_cached_settings)
+        self.assertIs(self.bill_payment.get_cached_settings, self.cache.get_cached_settings)
+
+    def test_callback_then_pay_reads_pay_settings(self):
+        notification = self.cache.get_cached_settings(MEMBER_ID, self.bill_payment.get_notification_settings)
+        payment = self.cache.get_cached_settings(MEMBER_ID, self.pay.get_user_settings)
+
+        self.assertEqual(notification, NOTIFICATION_SETTINGS)
+        self.assertEqual(payment['company_email'], PAY_SETTINGS['company_email'])
+
+    def test_settings_never_returns_pay_secrets(self):
+        self.cache.get_cached_settings(MEMBER_ID, self.pay.get_user_settings)
+        public = self.cache.get_cached_settings(MEMBER_ID, self.settings.get_settings)
+
+        self.assertNotIn('ecom_pass', public)
+        self.assertNotIn('token_ecom_kassa', public)
+
+    def test_invalidation_drops_every_loader(self):
+        self.cache.get_cached_settings(MEMBER_ID, self.pay.get_user_settings)
+        self.cache.get_cached_settings(MEMBER_ID, self.bill_payment.get_notification_settings)
+        self.cache.invalidate_settings(MEMBER_ID)
+
+        self.assertNotIn(MEMBER_ID, self.cache._entries)
+
+    def test_options_is_served_without_database(self):
+        for name, handler in self.handlers.items():
+            event = build_event('OPTIONS', urlsplit(f'/{name}'), {}, b'', '127.0.0.1')
+            self.assertEqual(handler(event, None)['statusCode'], 200, name)
+
+class MetricsTest(unittest.TestCase):
+    def test_histogram_is_cumulative_across_workers(self):
+        first, second = WorkerStats(), WorkerStats()
+        for stats, seconds in ((first, 0.001), (second, 0.3)):
+            stats.begin()
+            stats.finish('pay', 200, seconds)
+
+        text = render_metrics(merge_snapshots([first.snapshot(None), second.snapshot(None)]), 2)
+        self.assertIn('ecomkassa_http_requests_total{function="pay",status="200"} 2', text)
+        self.assertIn('ecomkassa_http_request_duration_seconds_bucket{function="pay",le="0.005"} 1', text)
+        self.assertIn('ecomkassa_http_request_duration_seconds_bucket{function="pay",le="0.5"} 2', text)
+
+if __name__ == '__main__':
+    unittest.main()